@@ -0,0 +1,121 @@
+"""
+Benchmark pipeline upload / backup / cleanup / load trên storage offline
+
+So sánh LocalDirectoryBackend và GitHubStorageBackend trỏ vào mock_github_server
+(có độ trễ giả lập), không cần mạng. Mỗi vòng kiểm tra lại:
+- số lần backup không vượt quá keep_backups
+- dữ liệu load lại khớp với dữ liệu vừa upload
+Sau các vòng replace là 1 vòng upsert 1 tuần mới (chỉ ghi partition năm bị đổi).
+
+Chạy:
+    python benchmarks/bench_storage.py --rows 50000 --uploads 4 --latency 0.05
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import dash_phonghc as dash  # noqa: E402
+from mock_github_server import MockGitHubServer  # noqa: E402
+
+
+def make_data(rows, seed):
+    """Dữ liệu giả lập theo đúng cấu trúc file Excel"""
+    rng = np.random.default_rng(seed)
+    dashboard = dash.PivotTableDashboard()
+    return pd.DataFrame({
+        'Tuần': rng.integers(1, 53, rows),
+        'Tháng': rng.integers(1, 13, rows),
+        'Danh mục': rng.choice(list(dashboard.category_priority), rows),
+        'Nội dung': rng.choice(list(dashboard.content_priority), rows),
+        'Số liệu': rng.integers(0, 10000, rows).astype(float),
+        'Năm': rng.choice([2024, 2025], rows),
+    })
+
+
+def canonical(df):
+    """Partition ghép lại theo năm (và có thể trùng khóa) nên so sánh sau khi sắp xếp theo mọi cột"""
+    return df[sorted(df.columns)].sort_values(sorted(df.columns)).reset_index(drop=True)
+
+
+def run_pipeline(label, manager, rows, uploads, request_count=None):
+    print(f"\n=== {label} ===")
+    for i in range(uploads):
+        data = make_data(rows, i)
+        before = request_count() if request_count else 0
+
+        start = time.perf_counter()
+        assert manager.upload_new_file(data, f"bench_{i}.xlsx"), "upload thất bại"
+        upload_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loaded, metadata = manager.load_current_data()
+        load_time = time.perf_counter() - start
+
+        assert metadata['filename'] == f"bench_{i}.xlsx"
+        # Partition lưu kèm cột tiền xử lý: so phần dữ liệu gốc
+        expected = manager._normalize_frame(data)
+        pd.testing.assert_frame_equal(canonical(manager._raw_columns(loaded)), canonical(expected), check_dtype=False)
+
+        backups = [f['name'] for f in manager.backend.list_files() if f['name'].startswith(manager.backup_prefix)]
+        assert len({manager._backup_group(name) for name in backups}) <= manager.keep_backups, "cleanup không đúng"
+
+        calls = f" • {request_count() - before} requests" if request_count else ""
+        print(f"upload #{i + 1}: {upload_time * 1000:8.1f} ms • load {load_time * 1000:8.1f} ms"
+              f" • {len(backups)} backup{calls}")
+
+        # Tên backup theo giây: tránh trùng tên giữa các vòng
+        time.sleep(1.0)
+
+    # Upsert 1 tuần mới của năm gần nhất
+    week = make_data(max(rows // 52, 1), uploads)
+    week['Năm'] = 2025
+    week['Tuần'] = 53
+    before = request_count() if request_count else 0
+
+    start = time.perf_counter()
+    assert manager.upload_new_file(week, "bench_week.xlsx", mode="upsert"), "upsert thất bại"
+    upload_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded, metadata = manager.load_current_data()
+    load_time = time.perf_counter() - start
+
+    assert metadata['changed_partitions'] == [2025]
+    assert len(loaded) == metadata['row_count']
+
+    calls = f" • {request_count() - before} requests" if request_count else ""
+    print(f"upsert 1 tuần: {upload_time * 1000:6.1f} ms • load {load_time * 1000:8.1f} ms"
+          f" • ghi {metadata['file_size_mb']}MB{calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="Độ trễ mock server mỗi request (giây)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        manager = dash.WeeklyUploadManager(dash.LocalDirectoryBackend(storage_dir))
+        run_pipeline("LocalDirectoryBackend", manager, args.rows, args.uploads)
+
+    with MockGitHubServer(latency=args.latency) as mock:
+        backend = dash.GitHubStorageBackend("token", mock.owner, mock.repo_name, api_url=mock.api_url)
+        manager = dash.WeeklyUploadManager(backend)
+        run_pipeline(f"GitHubStorageBackend + mock (latency {args.latency * 1000:.0f} ms)",
+                     manager, args.rows, args.uploads, request_count=mock.request_count)
+
+
+if __name__ == "__main__":
+    main()
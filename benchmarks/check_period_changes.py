@@ -0,0 +1,85 @@
+"""
+Kiểm tra biến động inline của pivot (period_changes) với bộ lọc mặc định của sidebar
+
+Giả lập create_filters cho từng khoảng thời gian: 1 năm mới nhất, các tháng / tuần mặc định
+chọn đúng các kỳ trong khoảng đó. Cột đầu tiên đang hiển thị phải có biến động (so với kỳ
+liền trước nằm ngoài khoảng thời gian), và với báo cáo theo tuần phải trùng Tỷ_lệ_tuần_trước.
+
+Chạy:
+    python benchmarks/check_period_changes.py
+"""
+import logging
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import dash_phonghc as dash  # noqa: E402
+
+
+def make_data(seed=0):
+    """Đủ mọi tuần cho mỗi nội dung (1 dòng / tuần), có số 0 để gặp cả trường hợp 0 -> dương"""
+    rng = np.random.default_rng(seed)
+    dashboard = dash.PivotTableDashboard()
+    categories = list(dashboard.category_priority)
+    rows = []
+    for year in (2024, 2025):
+        for week in range(1, 53):
+            month = min(12, int((week - 1) // 4.35) + 1)
+            for position, content in enumerate(dashboard.content_priority):
+                value = float(rng.integers(0, 50)) if rng.random() > 0.1 else 0.0
+                rows.append((week, month, categories[position % len(categories)], content, value, year))
+    return pd.DataFrame(rows, columns=['Tuần', 'Tháng', 'Danh mục', 'Nội dung', 'Số liệu', 'Năm'])
+
+
+def default_filters(dashboard, time_range):
+    """Lựa chọn mặc định của create_filters (không mở widget)"""
+    index = dashboard.filter_index
+    years = [max(index.options('Năm'))]
+    months = index.options('Tháng', {'Năm': years}, time_range)
+    if len(months) == 1:
+        weeks = index.options('Tuần', {'Năm': years, 'Tháng': months}, time_range)
+    else:
+        weeks = list(range(1, 53))
+    return years, months, weeks
+
+
+def check(dashboard, time_range, cols):
+    years, months, weeks = default_filters(dashboard, time_range)
+    filtered = dashboard.filter_data(time_range, years, months, weeks, list(dashboard.category_priority))
+    result = dashboard._build_pivot(filtered, ['Danh mục', 'Nội dung'], cols, 'Số liệu', 'sum', True)
+
+    assert result.changes is not None, f"{time_range} / {cols}: không có biến động"
+    first = result.changes[:, 0]
+    assert not np.isnan(first).all(), f"{time_range} / {cols}: cột đầu tiên không có biến động"
+
+    if cols == ['Tuần']:
+        # 1 dòng / (nội dung, tuần): biến động của ô = tỷ lệ so với tuần trước của dòng đó
+        first_week = result.columns[0]
+        rows = filtered[filtered['Tuần'] == first_week].set_index(['Danh mục', 'Nội dung'])
+        expected = rows['Tỷ_lệ_tuần_trước'].reindex(result.index).to_numpy(dtype=float)
+        assert np.allclose(np.nan_to_num(first, nan=-1), np.nan_to_num(expected, nan=-1)), \
+            f"{time_range}: biến động tuần {first_week} khác Tỷ_lệ_tuần_trước"
+
+    print(f"{time_range:>8} {str(cols):>10} cột {result.columns[0]}: "
+          f"{np.count_nonzero(~np.isnan(first))}/{len(first)} ô có biến động")
+
+
+def main():
+    dashboard = dash.PivotTableDashboard()
+    dashboard.load_data_from_dataframe(make_data())
+
+    for time_range in ("1 Tháng", "3 Tháng", "6 Tháng"):
+        check(dashboard, time_range, ['Tuần'])
+        check(dashboard, time_range, ['Tháng'])
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
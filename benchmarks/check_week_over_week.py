@@ -0,0 +1,145 @@
+"""
+Kiểm tra tỷ lệ / thay đổi so với tuần trước: vòng lặp theo chuỗi (bản cũ) và bản vector hóa
+
+Bản vector hóa (PivotTableDashboard._calculate_week_over_week_ratio) phải cho đúng kết quả của
+vòng lặp cũ trên dữ liệu tổng hợp:
+- tuần đầu tiên của chuỗi -> None
+- 0 -> 0 và 0 -> âm -> None; 0 -> dương -> 999 ("∞"), thay đổi = giá trị hiện tại
+- tuần trước âm, thiếu số liệu, chuỗi 1 dòng, chuỗi nối qua năm, dòng không theo thứ tự
+
+Chạy:
+    python benchmarks/check_week_over_week.py --series 300
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import dash_phonghc as dash  # noqa: E402
+
+
+def edge_series():
+    """Các chuỗi viết tay cho từng trường hợp đặc biệt: (Danh mục, Nội dung, [(Năm, Tháng, Tuần, Số liệu)])"""
+    return [
+        # tuần đầu, tăng, giảm về 0, 0 -> 0, 0 -> dương, dương -> âm, âm -> dương
+        ('Biên', 'Cơ bản', [(2025, 1, w, v) for w, v in enumerate([5, 10, 0, 0, 3, -2, 4], start=1)]),
+        # 0 -> âm giữ None
+        ('Biên', 'Không về âm', [(2025, 1, 1, 0), (2025, 1, 2, -5)]),
+        # thiếu số liệu ở tuần trước / tuần hiện tại
+        ('Biên', 'Thiếu số liệu', [(2025, 2, 5, np.nan), (2025, 2, 6, 4), (2025, 2, 7, np.nan), (2025, 2, 8, 6)]),
+        # chuỗi 1 dòng
+        ('Biên', 'Một dòng', [(2025, 3, 10, 7)]),
+        # nối qua năm: tuần 52/2024 -> tuần 1/2025
+        ('Biên', 'Qua năm', [(2024, 12, 51, 8), (2024, 12, 52, 0), (2025, 1, 1, 9), (2025, 1, 2, 9)]),
+    ]
+
+
+def make_data(series, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for category, content, points in edge_series():
+        rows.extend((week, month, category, content, value, year) for year, month, week, value in points)
+
+    for number in range(series):
+        category = f"Danh mục {number % 13}"
+        content = f"Nội dung {number}"
+        for year in (2024, 2025):
+            for week in range(1, 53):
+                month = min(12, int((week - 1) // 4.35) + 1)
+                draw = rng.random()
+                if draw < 0.2:
+                    value = 0.0
+                elif draw < 0.25:
+                    value = np.nan
+                elif draw < 0.3:
+                    value = -float(rng.integers(1, 20))
+                else:
+                    value = float(rng.integers(1, 500))
+                rows.append((week, month, category, content, value, year))
+
+    data = pd.DataFrame(rows, columns=['Tuần', 'Tháng', 'Danh mục', 'Nội dung', 'Số liệu', 'Năm'])
+    # Dòng không theo thứ tự thời gian: cả 2 cách đều phải tự sắp theo chuỗi
+    return data.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def legacy_ratio(data):
+    """Vòng lặp cũ: groupby từng chuỗi, sort rồi so từng dòng với dòng trước"""
+    data = data.copy()
+    data['Tỷ_lệ_tuần_trước'] = None
+    data['Thay_đổi_tuần_trước'] = None
+
+    for (category, content), group in data.groupby(['Danh mục', 'Nội dung']):
+        group_sorted = group.sort_values(['Năm', 'Tháng', 'Tuần']).reset_index()
+
+        for i in range(1, len(group_sorted)):
+            current_idx = group_sorted.loc[i, 'index']
+            current_value = group_sorted.loc[i, 'Số liệu']
+            previous_value = group_sorted.loc[i-1, 'Số liệu']
+
+            if pd.notna(current_value) and pd.notna(previous_value):
+                if previous_value != 0:
+                    ratio = ((current_value - previous_value) / previous_value) * 100
+                    change = current_value - previous_value
+
+                    data.loc[current_idx, 'Tỷ_lệ_tuần_trước'] = ratio
+                    data.loc[current_idx, 'Thay_đổi_tuần_trước'] = change
+                elif previous_value == 0 and current_value > 0:
+                    data.loc[current_idx, 'Tỷ_lệ_tuần_trước'] = 999.0
+                    data.loc[current_idx, 'Thay_đổi_tuần_trước'] = current_value
+    return data
+
+
+def vectorized_ratio(data):
+    dashboard = dash.PivotTableDashboard()
+    dashboard.data = data.copy()
+    dashboard._calculate_week_over_week_ratio()
+    return dashboard.data
+
+
+def as_float(values):
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=300)
+    args = parser.parse_args()
+
+    data = make_data(args.series)
+
+    start = time.perf_counter()
+    legacy = legacy_ratio(data)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = vectorized_ratio(data)
+    vector_time = time.perf_counter() - start
+
+    for column in ('Tỷ_lệ_tuần_trước', 'Thay_đổi_tuần_trước'):
+        expected, actual = as_float(legacy[column]), as_float(vectorized[column])
+        assert np.array_equal(np.isnan(expected), np.isnan(actual)), f"{column}: vị trí None khác bản cũ"
+        assert np.allclose(expected[~np.isnan(expected)], actual[~np.isnan(actual)]), f"{column}: giá trị khác bản cũ"
+
+    # Các trường hợp biên phải thực sự có trong dữ liệu kiểm tra
+    ratios = as_float(vectorized['Tỷ_lệ_tuần_trước'])
+    basic = vectorized[vectorized['Nội dung'] == 'Cơ bản'].sort_values('Tuần')
+    assert np.isnan(as_float(basic['Tỷ_lệ_tuần_trước'])[[0, 3]]).all(), "tuần đầu / 0 -> 0 phải là None"
+    assert as_float(basic['Tỷ_lệ_tuần_trước'])[4] == 999.0, "0 -> dương phải là 999"
+    assert np.isnan(as_float(vectorized.loc[vectorized['Nội dung'] == 'Không về âm', 'Tỷ_lệ_tuần_trước'])).all()
+    assert (ratios == 999.0).any() and (ratios < 0).any()
+
+    print(f"{len(data):,} dòng: vòng lặp {legacy_time:.2f}s, vector hóa {vector_time:.3f}s "
+          f"({legacy_time / vector_time:.0f}x) - kết quả giống nhau")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,23 @@ import requests
 import base64
 import hashlib
 import time
+import gzip
+import io
+import threading
+import uuid
+import tempfile
+import zipfile
+import weakref
+import unicodedata
+import operator
+import logging
+import openpyxl
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 # Cấu hình trang
 st.set_page_config(
@@ -180,311 +197,2423 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ================== DATASET STORAGE FORMAT ==================
+# Payload dạng cột (columnar) nén gzip:
+# - Mỗi cột lưu 1 mảng giá trị thay vì lặp tên cột trên từng dòng
+# - Cột chuỗi (Danh mục, Nội dung...) mã hóa từ điển: dictionary + codes
+# - Cột Categorical (v2) giữ nguyên thứ tự categories
+# - File cũ dạng JSON records (không nén) vẫn đọc được
+STORAGE_FORMAT_NAME = "dashboard-columnar"
+STORAGE_FORMAT_VERSION = 2
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _encode_column(series):
+    """Mã hóa 1 cột thành dict có kiểu rõ ràng"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return {
+            'type': 'category',
+            'categories': [c if isinstance(c, str) else str(c) for c in series.cat.categories],
+            'ordered': bool(series.cat.ordered),
+            'codes': series.cat.codes.tolist()
+        }
+
+    if pd.api.types.is_bool_dtype(series):
+        return {'type': 'bool', 'values': series.astype(bool).tolist()}
+
+    if pd.api.types.is_integer_dtype(series):
+        return {'type': 'int', 'values': series.astype('int64').tolist()}
+
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=float)
+        encoded = {
+            'type': 'float',
+            'values': [None if np.isnan(v) else v for v in values.tolist()]
+        }
+        # Cột float32 (mức nền so sánh) giữ nguyên kiểu khi đọc lại
+        if series.dtype == np.float32:
+            encoded['dtype'] = 'float32'
+        return encoded
+
+    # Chuỗi / object: mã hóa từ điển, -1 là giá trị rỗng
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    return {
+        'type': 'dict',
+        'dictionary': [u if isinstance(u, str) else str(u) for u in uniques],
+        'codes': codes.tolist()
+    }
+
+
+def _decode_column(column):
+    """Giải mã 1 cột về mảng numpy có kiểu"""
+    column_type = column.get('type')
+
+    if column_type == 'dict':
+        # Thêm None ở cuối để code -1 trỏ về giá trị rỗng
+        dictionary = np.array(column['dictionary'] + [None], dtype=object)
+        return dictionary[np.asarray(column['codes'], dtype=np.int64)]
+
+    if column_type == 'category':
+        return pd.Categorical.from_codes(
+            np.asarray(column['codes'], dtype=np.int64),
+            categories=column['categories'],
+            ordered=column.get('ordered', False)
+        )
+
+    if column_type == 'float':
+        return np.array(column['values'], dtype=float).astype(column.get('dtype', 'float64'), copy=False)
+
+    if column_type == 'int':
+        return np.array(column['values'], dtype=np.int64)
+
+    if column_type == 'bool':
+        return np.array(column['values'], dtype=bool)
+
+    raise ValueError(f"Kiểu cột không hỗ trợ: {column_type}")
+
+
+def encode_data_package(data, metadata):
+    """Đóng gói DataFrame + metadata thành bytes (JSON dạng cột, nén gzip)"""
+    package = {
+        'format': STORAGE_FORMAT_NAME,
+        'version': STORAGE_FORMAT_VERSION,
+        'columns': [str(col) for col in data.columns],
+        'row_count': len(data),
+        'data': {str(col): _encode_column(data[col]) for col in data.columns},
+        'metadata': metadata
+    }
+    json_bytes = json.dumps(package, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+    return gzip.compress(json_bytes, compresslevel=6, mtime=0)
+
+
+class ChunkStream(io.RawIOBase):
+    """File object chỉ đọc từ iterator các chunk bytes (vd: response.iter_content)"""
+
+    def __init__(self, chunks, on_close=None):
+        self._chunks = iter(chunks)
+        self._pending = b""
+        self._on_close = on_close
+
+    def close(self):
+        if self._on_close is not None and not self.closed:
+            self._on_close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def decode_data_package(raw):
+    """Giải mã dữ liệu đã lưu thành (DataFrame, metadata)
+
+    `raw` là bytes hoặc file object nhị phân (stream). Với stream, dữ liệu được
+    giải nén trong lúc đọc, không giữ bản nén đầy đủ trong bộ nhớ.
+    Hỗ trợ cả payload dạng cột (nén gzip) và file JSON records cũ.
+    """
+    if hasattr(raw, 'read'):
+        stream = raw if hasattr(raw, 'peek') else io.BufferedReader(raw)
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=stream)
+        package = json.load(stream)
+    else:
+        if raw[:2] == GZIP_MAGIC:
+            raw = gzip.decompress(raw)
+        package = json.loads(raw)
+
+    if package.get('format') == STORAGE_FORMAT_NAME:
+        if package.get('version', 0) > STORAGE_FORMAT_VERSION:
+            raise ValueError(f"Phiên bản dữ liệu {package['version']} mới hơn phiên bản dashboard hỗ trợ")
+        df = pd.DataFrame(
+            {col: _decode_column(package['data'][col]) for col in package['columns']},
+            columns=package['columns']
+        )
+        return df, package.get('metadata')
+
+    # File cũ: danh sách records
+    df = pd.DataFrame(package['data'], columns=package['columns'])
+    return df, package.get('metadata')
+
+
+# ================== EXCEL INGEST ==================
+class ExcelReader:
+    """
+    Đọc file Excel nhanh: openpyxl read-only duyệt từng dòng, chỉ lấy các cột dashboard dùng
+    - Chuyển kiểu ngay khi đọc: Tuần, Tháng, Năm, Số liệu -> số; Danh mục, Nội dung -> text
+    - Kết quả lưu ra đĩa theo digest nội dung file (định dạng cột như storage): mở lại
+      cùng file, xem trước rồi upload... không phải parse Excel lần nữa
+    - File .xls (không phải zip) -> pd.read_excel
+    """
+    
+    required_columns = ['Tuần', 'Tháng', 'Danh mục', 'Nội dung', 'Số liệu']
+    optional_columns = ['Năm']
+    numeric_columns = ['Tuần', 'Tháng', 'Năm', 'Số liệu']
+    # Tăng khi đổi cách parse -> bỏ qua cache cũ trên đĩa
+    reader_version = 1
+    
+    def __init__(self, cache_dir=None, max_cache_files=32):
+        self.cache_dir = Path(cache_dir) if cache_dir else Path(tempfile.gettempdir()) / "dashboard_phonghc_excel"
+        self.max_cache_files = max_cache_files
+        self._lock = threading.Lock()
+        self.stats = {'parsed': 0, 'cache_hits': 0}
+    
+    @staticmethod
+    def source_bytes(source):
+        """Bytes của file Excel: đường dẫn local hoặc file upload (UploadedFile / file-like)"""
+        if isinstance(source, (bytes, bytearray)):
+            return bytes(source)
+        if isinstance(source, (str, os.PathLike)):
+            return Path(source).read_bytes()
+        if hasattr(source, 'getvalue'):
+            return source.getvalue()
+        source.seek(0)
+        return source.read()
+    
+    def read(self, source, sheet_name=None, raw_bytes=None, digest=None):
+        """DataFrame các cột cần dùng của 1 sheet (mặc định sheet đang active)
+        
+        raw_bytes / digest: truyền vào nếu đã có sẵn để không đọc và hash lại file
+        """
+        if raw_bytes is None:
+            raw_bytes = self.source_bytes(source)
+        if digest is None:
+            digest = hashlib.sha256(raw_bytes).hexdigest()
+        
+        cached = self.cached(digest, sheet_name)
+        if cached is not None:
+            return cached
+        
+        data = self.parse(raw_bytes, sheet_name)
+        self.store(digest, sheet_name, data)
+        return data
+    
+    def cached(self, digest, sheet_name=None):
+        """Kết quả parse đã lưu trên đĩa cho file có digest này, None nếu chưa có"""
+        data = self._read_cache(self._cache_path(digest, sheet_name))
+        if data is not None:
+            with self._lock:
+                self.stats['cache_hits'] += 1
+        return data
+    
+    def store(self, digest, sheet_name, data):
+        """Lưu kết quả parse (vd. parse ở process khác) vào cache trên đĩa"""
+        with self._lock:
+            self.stats['parsed'] += 1
+        self._write_cache(self._cache_path(digest, sheet_name), data)
+    
+    @classmethod
+    def parse(cls, raw_bytes, sheet_name=None):
+        """Parse 1 sheet thành DataFrame có kiểu (không dùng cache)"""
+        # .xlsx là file zip; còn lại (.xls) để pandas xử lý
+        if not raw_bytes.startswith(b"PK"):
+            data = pd.read_excel(io.BytesIO(raw_bytes), sheet_name=sheet_name or 0)
+            header = [str(col).strip() for col in data.columns]
+            positions = cls._column_positions(header)
+            return cls._typed_frame({name: data.iloc[:, index].tolist() for name, index in positions.items()})
+        
+        workbook = openpyxl.load_workbook(io.BytesIO(raw_bytes), read_only=True, data_only=True)
+        try:
+            sheet = workbook[sheet_name] if sheet_name else workbook.active
+            rows = sheet.iter_rows(values_only=True)
+            
+            # Dòng tiêu đề = dòng đầu tiên có dữ liệu
+            header = None
+            for row in rows:
+                if any(value is not None for value in row):
+                    header = ["" if value is None else str(value).strip() for value in row]
+                    break
+            if header is None:
+                raise ValueError(f"Sheet '{sheet.title}' không có dữ liệu")
+            
+            positions = cls._column_positions(header)
+            names = list(positions)
+            pick = operator.itemgetter(*positions.values())
+            width = max(positions.values()) + 1
+            
+            records = []
+            for row in rows:
+                if len(row) < width:
+                    row = tuple(row) + (None,) * (width - len(row))
+                values = pick(row)
+                if len(names) == 1:
+                    values = (values,)
+                # Bỏ dòng trống (định dạng thừa cuối sheet)
+                if any(value is not None for value in values):
+                    records.append(values)
+        finally:
+            workbook.close()
+        
+        columns = list(zip(*records)) if records else [()] * len(names)
+        return cls._typed_frame(dict(zip(names, columns)))
+    
+    @classmethod
+    def sheet_names(cls, raw_bytes):
+        """Danh sách sheet của workbook"""
+        if not raw_bytes.startswith(b"PK"):
+            return pd.ExcelFile(io.BytesIO(raw_bytes)).sheet_names
+        workbook = openpyxl.load_workbook(io.BytesIO(raw_bytes), read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    
+    @classmethod
+    def _column_positions(cls, header):
+        """{tên cột: vị trí} cho các cột cần dùng, thiếu cột bắt buộc -> ValueError"""
+        missing = [col for col in cls.required_columns if col not in header]
+        if missing:
+            raise ValueError(f"Thiếu cột bắt buộc: {missing}")
+        return {
+            col: header.index(col)
+            for col in cls.required_columns + cls.optional_columns
+            if col in header
+        }
+    
+    @classmethod
+    def _typed_frame(cls, columns):
+        """Cột số -> số (ô lỗi thành NaN), cột text giữ nguyên, ô trống -> NaN"""
+        data = {}
+        for name, values in columns.items():
+            series = pd.Series(values, dtype=object)
+            if name in cls.numeric_columns:
+                series = pd.to_numeric(series, errors='coerce')
+            else:
+                series = series.where(series.notna(), np.nan)
+            data[name] = series
+        return pd.DataFrame(data)
+    
+    def _cache_path(self, digest, sheet_name):
+        sheet_key = hashlib.sha1(str(sheet_name).encode()).hexdigest()[:8] if sheet_name else "active"
+        return self.cache_dir / f"{digest}_{sheet_key}_v{self.reader_version}.json"
+    
+    def _read_cache(self, path):
+        """DataFrame đã parse từ cache trên đĩa, None nếu chưa có hoặc file hỏng"""
+        try:
+            data, _ = decode_data_package(path.read_bytes())
+            os.utime(path)
+            return data
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def _write_cache(self, path, data):
+        """Ghi cache (ghi file tạm rồi đổi tên), lỗi ghi đĩa không ảnh hưởng việc đọc"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            temp_path.write_bytes(encode_data_package(data, {'reader_version': self.reader_version}))
+            os.replace(temp_path, path)
+            
+            # Giữ max_cache_files file dùng gần nhất
+            cached_files = sorted(self.cache_dir.glob("*.json"), key=lambda f: f.stat().st_mtime, reverse=True)
+            for old_file in cached_files[self.max_cache_files:]:
+                old_file.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+def _parse_excel_item(raw_bytes, sheet_name):
+    """Parse 1 sheet trong process con -> (DataFrame hoặc None, lỗi, số giây)"""
+    started = time.perf_counter()
+    try:
+        return ExcelReader.parse(raw_bytes, sheet_name), None, time.perf_counter() - started
+    except Exception as e:
+        return None, str(e), time.perf_counter() - started
+
+
+class BulkExcelIngest:
+    """
+    Nạp nhiều file / sheet 1 lần: thư mục, file zip chứa workbook, nhiều file upload
+    hoặc tất cả sheet của 1 workbook
+    - Parse song song trên process pool (không tạo được pool -> chạy tuần tự)
+    - Sheet đã parse trước đó lấy từ cache trên đĩa của ExcelReader
+    - Kiểm tra cột / giá trị từng sheet, ghép thành 1 DataFrame để tiền xử lý 1 lần
+    - Báo cáo thời gian và lỗi theo từng file
+    """
+    
+    excel_suffixes = ('.xlsx', '.xlsm', '.xls')
+    
+    def __init__(self, reader=None, max_workers=None, parallel=True):
+        self.reader = reader or ExcelReader()
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.parallel = parallel
+    
+    @classmethod
+    def _is_excel_name(cls, name):
+        base = os.path.basename(name)
+        return base.lower().endswith(cls.excel_suffixes) and not base.startswith('~$')
+    
+    @staticmethod
+    def _is_zip_archive(name, raw_bytes):
+        """File zip chứa workbook (xlsx cũng là zip nên phân biệt theo nội dung)"""
+        if not raw_bytes.startswith(b"PK"):
+            return False
+        if name.lower().endswith('.zip'):
+            return True
+        with zipfile.ZipFile(io.BytesIO(raw_bytes)) as archive:
+            return '[Content_Types].xml' not in archive.namelist()
+    
+    def _workbooks(self, source):
+        """Liệt kê (tên, bytes) của các workbook trong nguồn"""
+        if isinstance(source, (list, tuple)):
+            for item in source:
+                yield from self._workbooks(item)
+            return
+        
+        if isinstance(source, (str, os.PathLike)) and Path(source).is_dir():
+            for path in sorted(Path(source).rglob('*')):
+                if path.is_file() and self._is_excel_name(path.name):
+                    yield str(path), path.read_bytes()
+            return
+        
+        name = str(source) if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', 'upload')
+        raw_bytes = ExcelReader.source_bytes(source)
+        if self._is_zip_archive(name, raw_bytes):
+            with zipfile.ZipFile(io.BytesIO(raw_bytes)) as archive:
+                for member in sorted(archive.namelist()):
+                    if member.startswith('__MACOSX/') or not self._is_excel_name(member):
+                        continue
+                    yield f"{os.path.basename(name)}/{member}", archive.read(member)
+            return
+        
+        yield name, raw_bytes
+    
+    def collect_items(self, source, all_sheets=False):
+        """Danh sách sheet cần parse và danh sách file lỗi (không mở được)"""
+        items, failures = [], []
+        for name, raw_bytes in self._workbooks(source):
+            digest = hashlib.sha256(raw_bytes).hexdigest()
+            try:
+                sheets = ExcelReader.sheet_names(raw_bytes) if all_sheets else [None]
+            except Exception as e:
+                failures.append(self._report_row(name, None, 0, 0.0, error=str(e)))
+                continue
+            items.extend(
+                {'source': name, 'sheet': sheet, 'raw_bytes': raw_bytes, 'digest': digest}
+                for sheet in sheets
+            )
+        return items, failures
+    
+    def _parse_all(self, items):
+        """Parse các sheet chưa có trong cache
+        
+        -> ({vị trí: (DataFrame, lỗi, số giây, lấy từ cache)}, {vị trí: lý do phải parse tuần tự})
+        Chỉ lỗi tạo / hỏng process pool mới chuyển sang parse tuần tự; lỗi của từng sheet
+        được báo như khi parse tuần tự.
+        """
+        results = {}
+        fallback = None
+        pending = []
+        for index, item in enumerate(items):
+            started = time.perf_counter()
+            cached = self.reader.cached(item['digest'], item['sheet'])
+            if cached is not None:
+                results[index] = (cached, None, time.perf_counter() - started, True)
+            else:
+                pending.append(index)
+        
+        if self.parallel and self.max_workers > 1 and len(pending) > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+                    futures = {
+                        index: pool.submit(_parse_excel_item, items[index]['raw_bytes'], items[index]['sheet'])
+                        for index in pending
+                    }
+                    for index, future in futures.items():
+                        started = time.perf_counter()
+                        try:
+                            results[index] = (*future.result(), False)
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            # Lỗi riêng của sheet này (vd. không gửi được sang process con)
+                            results[index] = (None, str(e), time.perf_counter() - started, False)
+            except (OSError, BrokenProcessPool) as e:
+                # Môi trường không cho tạo process (hoặc pool bị hỏng) -> parse tuần tự phần còn lại
+                fallback = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                logger.warning("Không parse song song được (%s), parse tuần tự %d sheet còn lại",
+                               fallback, len([index for index in pending if index not in results]))
+        
+        sequential = {}
+        for index in pending:
+            if index not in results:
+                results[index] = (*_parse_excel_item(items[index]['raw_bytes'], items[index]['sheet']), False)
+                if fallback:
+                    sequential[index] = fallback
+            data, error, _, _ = results[index]
+            if error is None:
+                self.reader.store(items[index]['digest'], items[index]['sheet'], data)
+        return results, sequential
+    
+    @staticmethod
+    def _report_row(source, sheet, rows, seconds, error=None, warnings=None, cached=False):
+        return {
+            'source': source,
+            'sheet': sheet or '',
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'cached': cached,
+            'status': 'failed' if error else 'ok',
+            'error': error or '',
+            'warnings': '; '.join(warnings or [])
+        }
+    
+    @staticmethod
+    def _validate(data):
+        """Cảnh báo giá trị không hợp lệ trong 1 sheet (dòng vẫn được giữ lại)"""
+        warnings = []
+        if data.empty:
+            warnings.append("không có dòng dữ liệu")
+        for column, low, high in (('Tuần', 1, 53), ('Tháng', 1, 12)):
+            invalid = int((~data[column].between(low, high)).sum())
+            if invalid:
+                warnings.append(f"{invalid} dòng {column} không hợp lệ")
+        missing_values = int(data['Số liệu'].isna().sum())
+        if missing_values:
+            warnings.append(f"{missing_values} dòng thiếu Số liệu")
+        return warnings
+    
+    def ingest(self, source, all_sheets=False):
+        """Parse, kiểm tra và ghép toàn bộ sheet -> (DataFrame hoặc None, báo cáo từng file)"""
+        items, report = self.collect_items(source, all_sheets)
+        results, sequential = self._parse_all(items)
+        
+        frames = []
+        has_year = False
+        for index, item in enumerate(items):
+            data, error, seconds, cached = results[index]
+            if error is not None:
+                report.append(self._report_row(item['source'], item['sheet'], 0, seconds, error=error))
+                continue
+            
+            warnings = self._validate(data)
+            if index in sequential:
+                warnings.append(f"parse tuần tự, không chạy song song được ({sequential[index]})")
+            has_year = has_year or 'Năm' in data.columns
+            frames.append((data, warnings, len(report)))
+            report.append(self._report_row(item['source'], item['sheet'], len(data), seconds,
+                                           warnings=warnings, cached=cached))
+        
+        if not frames:
+            return None, report
+        
+        # Sheet không có cột Năm trong khi sheet khác có -> dùng năm hiện tại, ghi cảnh báo
+        if has_year:
+            for position, (data, warnings, row_index) in enumerate(frames):
+                if 'Năm' not in data.columns:
+                    data = data.assign(**{'Năm': datetime.now().year})
+                    warnings.append(f"không có cột Năm - dùng năm {datetime.now().year}")
+                    report[row_index]['warnings'] = '; '.join(warnings)
+                    frames[position] = (data, warnings, row_index)
+        
+        return pd.concat([data for data, _, _ in frames], ignore_index=True), report
+
+
+# ================== GITHUB HTTP CLIENT ==================
+class GitHubClient:
+    """
+    HTTP client dùng chung cho mọi lệnh gọi GitHub API
+    - 1 requests.Session: keep-alive, connection pool
+    - Conditional GET với ETag: dữ liệu không đổi -> 304, không tải lại
+    - Timeout riêng theo từng loại lệnh gọi
+    """
+    
+    api_base = "https://api.github.com"
+    
+    # Timeout (giây) theo loại lệnh gọi: (connect, read)
+    default_timeouts = {
+        'check': (5, 10),
+        'metadata': (5, 15),
+        'list': (5, 15),
+        'download': (5, 60),
+        'upload': (5, 120),
+        'delete': (5, 30),
+    }
+    
+    def __init__(self, token, timeouts=None, pool_size=8):
+        self.timeouts = dict(self.default_timeouts)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        })
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+        
+        # Retry nhẹ cho lỗi tạm thời của GitHub (chỉ GET)
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+        self._adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        
+        # url -> (etag, json body) cho các response nhỏ
+        self._etag_cache = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'not_modified': 0,
+            'bytes_downloaded': 0,
+            'errors': 0,
+        }
+    
+    def _timeout(self, kind):
+        return self.timeouts.get(kind, self.timeouts['metadata'])
+    
+    def request(self, method, url, kind='metadata', etag=None, **kwargs):
+        """Gửi request qua session chung, ghi nhận thống kê"""
+        headers = kwargs.pop('headers', {}) or {}
+        if etag:
+            headers["If-None-Match"] = etag
+        
+        try:
+            response = self.session.request(method, url, headers=headers, timeout=self._timeout(kind), **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._stats['requests'] += 1
+                self._stats['errors'] += 1
+            raise
+        
+        with self._lock:
+            self._stats['requests'] += 1
+            if response.status_code == 304:
+                self._stats['not_modified'] += 1
+            elif not kwargs.get('stream'):
+                self._stats['bytes_downloaded'] += len(response.content)
+        return response
+    
+    def get(self, url, kind='metadata', etag=None, **kwargs):
+        return self.request("GET", url, kind=kind, etag=etag, **kwargs)
+    
+    def put(self, url, kind='upload', **kwargs):
+        return self.request("PUT", url, kind=kind, **kwargs)
+    
+    def delete(self, url, kind='delete', **kwargs):
+        return self.request("DELETE", url, kind=kind, **kwargs)
+    
+    def get_json(self, url, kind='metadata'):
+        """GET có ETag cache: trả về (status_code, json). 304 -> dùng lại body đã cache"""
+        cached = self._etag_cache.get(url)
+        response = self.get(url, kind=kind, etag=cached[0] if cached else None)
+        
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+        
+        if response.status_code != 200:
+            return response.status_code, None
+        
+        body = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            self._etag_cache[url] = (etag, body)
+        return 200, body
+    
+    def invalidate(self, url=None):
+        """Xóa ETag cache (sau khi ghi file)"""
+        if url is None:
+            self._etag_cache.clear()
+        else:
+            self._etag_cache.pop(url, None)
+    
+    def get_stats(self):
+        """Thống kê request và mức tái sử dụng kết nối"""
+        with self._lock:
+            stats = dict(self._stats)
+        
+        connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        
+        stats['connections_opened'] = connections
+        stats['connections_reused'] = max(stats['requests'] - stats['errors'] - connections, 0)
+        stats['timeouts'] = dict(self.timeouts)
+        return stats
+
+# ================== STORAGE BACKENDS ==================
+class StorageBackend:
+    """
+    Interface lưu trữ cho WeeklyUploadManager
+    - Mọi đường dẫn là file ở thư mục gốc của storage
+    - read_file trả về file object để giải mã dạng stream
+    - commit ghi nhiều thay đổi cùng lúc (dữ liệu, metadata, backup, cleanup)
+    
+    Mỗi thay đổi trong commit là 1 dict:
+    - {'path', 'data': bytes}      : ghi nội dung nhị phân
+    - {'path', 'text': str}        : ghi nội dung text
+    - {'path', 'copy_from': path}  : sao chép file (trạng thái TRƯỚC commit)
+    - {'path', 'delete': True}     : xóa file
+    """
+    
+    name = "storage"
+    
+    def check_connection(self):
+        """Trả về (connected, message)"""
+        raise NotImplementedError
+    
+    def read_file(self, path, etag=None):
+        """Đọc file; None nếu không tồn tại
+        
+        Trả về dict {'status': 200|304, 'version', 'etag', 'size', 'body'}.
+        status 304 khi etag khớp (không có body). body cần được close sau khi đọc.
+        """
+        raise NotImplementedError
+    
+    def read_json(self, path):
+        """Đọc file JSON nhỏ (metadata); None nếu không có"""
+        raise NotImplementedError
+    
+    def list_files(self):
+        """Danh sách file: list dict {'name', 'sha', 'size'}"""
+        raise NotImplementedError
+    
+    def commit(self, changes, message):
+        """Ghi các thay đổi; trả về version mới của storage"""
+        raise NotImplementedError
+    
+    def get_stats(self):
+        """Thống kê truy cập storage"""
+        return {}
+
+
+class GitHubStorageBackend(StorageBackend):
+    """
+    Storage trên GitHub repo
+    - Đọc: contents API (ETag), file > 1MB tải blob theo sha dạng stream
+    - Ghi: Git Data API, mọi thay đổi trong 1 commit, ref cập nhật không force
+    - api_url cấu hình được (vd: mock_github_server để đo/kiểm thử offline)
+    """
+    
+    name = "GitHub"
+    
+    def __init__(self, token, owner, repo, api_url=None, branch="main", client=None):
+        self.github_token = token
+        self.github_owner = owner
+        self.github_repo = repo
+        self.branch = branch
+        
+        # HTTP client dùng chung (keep-alive + ETag)
+        self.client = client or GitHubClient(token)
+        self.api_url = (api_url or self.client.api_base).rstrip("/")
+        self.repo_url = f"{self.api_url}/repos/{owner}/{repo}"
+        
+        # (commit sha, tree sha, {path: entry}) đọc lần gần nhất, dùng cho commit kế tiếp
+        self._head = None
+    
+    def _contents_url(self, path=""):
+        return f"{self.repo_url}/contents/{path}" if path else f"{self.repo_url}/contents"
+    
+    def get_stats(self):
+        """Thống kê kết nối HTTP tới GitHub"""
+        return self.client.get_stats()
+    
+    def check_connection(self):
+        """Kiểm tra kết nối GitHub"""
+        if not all([self.github_token, self.github_owner, self.github_repo]):
+            return False, "❌ Chưa cấu hình GitHub credentials"
+        
+        try:
+            status_code, _ = self.client.get_json(self.repo_url, kind='check')
+            
+            if status_code == 200:
+                return True, "✅ GitHub kết nối thành công"
+            else:
+                return False, f"❌ GitHub error: {status_code}"
+                
+        except Exception as e:
+            return False, f"❌ Lỗi kết nối: {str(e)}"
+    
+    def read_file(self, path, etag=None):
+        # Gửi ETag của lần tải trước: file không đổi -> 304, bỏ qua tải
+        response = self.client.get(self._contents_url(path), kind='download', etag=etag)
+        
+        if response.status_code == 304:
+            return {'status': 304, 'etag': etag, 'version': None, 'size': None, 'body': None}
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(f"GitHub error: {response.status_code}")
+        
+        file_data = response.json()
+        if self._has_inline_content(file_data):
+            body = io.BytesIO(base64.b64decode(file_data['content']))
+        else:
+            # File > 1MB: contents API không trả nội dung -> tải blob theo sha
+            body = self._open_blob(file_data['sha'])
+        
+        return {
+            'status': 200,
+            'etag': response.headers.get("ETag"),
+            'version': file_data.get('sha'),
+            'size': file_data.get('size'),
+            'body': body
+        }
+    
+    def read_json(self, path):
+        status_code, file_data = self.client.get_json(self._contents_url(path))
+        if status_code != 200:
+            return None
+        return json.loads(base64.b64decode(file_data['content']).decode())
+    
+    @staticmethod
+    def _has_inline_content(file_data):
+        """Contents API chỉ trả nội dung base64 đầy đủ cho file <= 1MB"""
+        content = file_data.get('content')
+        if file_data.get('encoding') != 'base64' or not content:
+            return False
+        # Nội dung bị cắt: độ dài sau giải mã khác size của file
+        expected = file_data.get('size')
+        if expected is None:
+            return True
+        encoded_len = len(content) - content.count('\n')
+        padding = content.rstrip('\n').endswith('==') + content.rstrip('\n').endswith('=')
+        return encoded_len // 4 * 3 - padding == expected
+    
+    def _open_blob(self, sha):
+        """Mở blob thô theo sha (Git blobs API) dạng stream theo chunk"""
+        response = self.client.get(
+            f"{self.repo_url}/git/blobs/{sha}",
+            kind='download',
+            headers={"Accept": "application/vnd.github.raw"},
+            stream=True
+        )
+        if response.status_code != 200:
+            response.close()
+            raise RuntimeError(f"GitHub blob error: {response.status_code}")
+        return ChunkStream(response.iter_content(chunk_size=256 * 1024), on_close=response.close)
+    
+    def _get_branch_head(self):
+        """Trả về (commit sha, tree sha) của branch, None nếu repo còn trống"""
+        status_code, branch = self.client.get_json(f"{self.repo_url}/branches/{self.branch}")
+        if status_code != 200:
+            return None, None
+        commit = branch['commit']
+        return commit['sha'], commit['commit']['tree']['sha']
+    
+    def _initialize_branch(self):
+        """Repo trống: tạo commit đầu tiên qua contents API để có branch"""
+        payload = {
+            "message": "📝 Initialize dashboard storage",
+            "content": "",
+            "branch": self.branch
+        }
+        response = self.client.put(self._contents_url(".gitkeep"), json=payload)
+        if response.status_code not in [200, 201]:
+            raise RuntimeError(f"Không thể khởi tạo repo: {response.status_code}")
+        self.client.invalidate()
+    
+    def _read_head(self):
+        commit_sha, tree_sha = self._get_branch_head()
+        if commit_sha is None:
+            self._initialize_branch()
+            commit_sha, tree_sha = self._get_branch_head()
+        
+        status_code, tree = self.client.get_json(f"{self.repo_url}/git/trees/{tree_sha}", kind='list')
+        if status_code != 200:
+            raise RuntimeError(f"Không đọc được repo: {status_code}")
+        files = {item['path']: item for item in tree['tree'] if item['type'] == 'blob'}
+        self._head = (commit_sha, tree_sha, files)
+        return self._head
+    
+    def list_files(self):
+        _, _, files = self._read_head()
+        return [{'name': path, 'sha': item['sha'], 'size': item.get('size', 0)} for path, item in files.items()]
+    
+    def commit(self, changes, message):
+        """Ghi nhiều thay đổi trong 1 commit duy nhất (Git Data API)
+        
+        Ref chỉ được cập nhật nếu branch không bị ai đổi kể từ lần đọc gần nhất
+        (không force), nên không bao giờ có trạng thái ghi dở.
+        """
+        commit_sha, tree_sha, files = self._head or self._read_head()
+        
+        tree_entries = []
+        for change in changes:
+            entry = {"path": change['path'], "mode": "100644", "type": "blob"}
+            if 'text' in change:
+                entry["content"] = change['text']
+            elif 'data' in change:
+                blob_response = self.client.request(
+                    "POST", f"{self.repo_url}/git/blobs", kind='upload',
+                    json={"content": base64.b64encode(change['data']).decode(), "encoding": "base64"}
+                )
+                if blob_response.status_code != 201:
+                    raise RuntimeError(f"Lỗi upload: {blob_response.status_code}")
+                entry["sha"] = blob_response.json()['sha']
+            elif 'copy_from' in change:
+                # Backup = trỏ tên mới vào blob có sẵn, không upload lại bytes
+                entry["sha"] = files[change['copy_from']]['sha']
+            else:
+                entry["sha"] = None
+            tree_entries.append(entry)
+        
+        tree_response = self.client.request(
+            "POST", f"{self.repo_url}/git/trees", kind='upload',
+            json={"base_tree": tree_sha, "tree": tree_entries}
+        )
+        if tree_response.status_code != 201:
+            raise RuntimeError(f"Lỗi tạo tree: {tree_response.status_code}")
+        
+        commit_response = self.client.request(
+            "POST", f"{self.repo_url}/git/commits", kind='upload',
+            json={"message": message, "tree": tree_response.json()['sha'], "parents": [commit_sha]}
+        )
+        if commit_response.status_code != 201:
+            raise RuntimeError(f"Lỗi tạo commit: {commit_response.status_code}")
+        new_commit_sha = commit_response.json()['sha']
+        
+        # Mọi response đã cache (contents, metadata, branch) đều cũ
+        self._head = None
+        self.client.invalidate()
+        
+        ref_response = self.client.request(
+            "PATCH", f"{self.repo_url}/git/refs/heads/{self.branch}", kind='upload',
+            json={"sha": new_commit_sha, "force": False}
+        )
+        if ref_response.status_code != 200:
+            raise RuntimeError(f"Dữ liệu trên GitHub vừa thay đổi, vui lòng thử lại ({ref_response.status_code})")
+        
+        return new_commit_sha
+
+
+class LocalDirectoryBackend(StorageBackend):
+    """
+    Storage trên thư mục local (chạy offline, đo hiệu năng, kiểm thử)
+    - Version/ETag của file = mtime + size
+    - Ghi file qua file tạm + os.replace; backup dùng hard link khi có thể
+    """
+    
+    name = "Local"
+    
+    def __init__(self, root):
+        self.root = Path(root)
+        self._stats = {'reads': 0, 'not_modified': 0, 'writes': 0, 'deletes': 0,
+                       'bytes_read': 0, 'bytes_written': 0}
+    
+    def _path(self, path):
+        return self.root / path
+    
+    @staticmethod
+    def _etag(stat):
+        return f'"{stat.st_mtime_ns}-{stat.st_size}"'
+    
+    def get_stats(self):
+        return dict(self._stats)
+    
+    def check_connection(self):
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            return True, f"✅ Local storage: {self.root}"
+        except OSError as e:
+            return False, f"❌ Không truy cập được thư mục {self.root}: {str(e)}"
+    
+    def read_file(self, path, etag=None):
+        file_path = self._path(path)
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            return None
+        
+        current_etag = self._etag(stat)
+        self._stats['reads'] += 1
+        if etag == current_etag:
+            self._stats['not_modified'] += 1
+            return {'status': 304, 'etag': etag, 'version': None, 'size': stat.st_size, 'body': None}
+        
+        self._stats['bytes_read'] += stat.st_size
+        return {
+            'status': 200,
+            'etag': current_etag,
+            'version': current_etag.strip('"'),
+            'size': stat.st_size,
+            'body': open(file_path, 'rb')
+        }
+    
+    def read_json(self, path):
+        try:
+            with open(self._path(path), 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def list_files(self):
+        if not self.root.exists():
+            return []
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append({'name': entry.name, 'sha': self._etag(stat).strip('"'), 'size': stat.st_size})
+        return files
+    
+    def commit(self, changes, message):
+        self.root.mkdir(parents=True, exist_ok=True)
+        staged = []
+        try:
+            # 1. Chuẩn bị toàn bộ file tạm (copy đọc trạng thái trước commit)
+            for n, change in enumerate(changes):
+                if change.get('delete'):
+                    continue
+                tmp_path = self._path(f"{change['path']}.{os.getpid()}.{n}.tmp")
+                if 'copy_from' in change:
+                    try:
+                        os.link(self._path(change['copy_from']), tmp_path)
+                    except OSError:
+                        with open(self._path(change['copy_from']), 'rb') as src, open(tmp_path, 'wb') as dst:
+                            dst.write(src.read())
+                else:
+                    content = change['data'] if 'data' in change else change['text'].encode()
+                    with open(tmp_path, 'wb') as f:
+                        f.write(content)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._stats['bytes_written'] += len(content)
+                staged.append((tmp_path, self._path(change['path'])))
+        except Exception:
+            for tmp_path, _ in staged:
+                tmp_path.unlink(missing_ok=True)
+            raise
+        
+        # 2. Đổi tên nguyên tử từng file, sau đó mới xóa
+        for tmp_path, target in staged:
+            os.replace(tmp_path, target)
+            self._stats['writes'] += 1
+        for change in changes:
+            if change.get('delete'):
+                self._path(change['path']).unlink(missing_ok=True)
+                self._stats['deletes'] += 1
+        
+        return datetime.now().isoformat()
+
+
 # ================== WEEKLY UPLOAD MANAGER CLASS ==================
 class WeeklyUploadManager:
     """
     Quản lý upload hàng tuần với auto-cleanup
-    - 1 file duy nhất mỗi thời điểm
-    - Auto xóa file cũ khi upload mới
-    - Optimized cho storage
+    - Dữ liệu chia theo năm: mỗi năm 1 file (partition)
+    - Upsert theo (Năm, Tuần, Danh mục, Nội dung): upload tuần mới chỉ ghi lại partition bị đổi
+    - Backup + dữ liệu + metadata + cleanup trong 1 commit duy nhất
+    - Storage tách qua StorageBackend (GitHub hoặc thư mục local)
     """
     
-    def __init__(self):
-        self.github_token = st.secrets.get("github_token", None)
-        self.github_owner = st.secrets.get("github_owner", None)
-        self.github_repo = st.secrets.get("github_repo", None)
+    # Khóa của 1 dòng dữ liệu khi upsert
+    upsert_keys = ['Năm', 'Tuần', 'Danh mục', 'Nội dung']
+    # Số dòng liền trước mà biến động tuần / TB 4 tuần của 1 dòng cần tới
+    upsert_context_rows = 4
+    
+    def __init__(self, backend=None):
+        self.backend = backend or self._backend_from_secrets()
         
         # File naming strategy
-        self.current_data_file = "current_dashboard_data.json"
+        self.current_data_file = "current_dashboard_data.json"   # layout cũ: 1 file cho toàn bộ dữ liệu
+        self.partition_prefix = "dashboard_data_"                 # layout mới: dashboard_data_<năm>.json
         self.metadata_file = "upload_metadata.json"
         self.backup_prefix = "backup_"
         
         # Settings
         self.keep_backups = 2
         self.max_file_size_mb = 25
+        
+        # Dữ liệu đã giải mã gần nhất, dùng lại khi storage trả 304
+        self._loaded_data = None
+        self._partition_cache = {}
+        self._upload_lock = threading.Lock()
     
-    def check_github_connection(self):
-        """Kiểm tra kết nối GitHub"""
-        if not all([self.github_token, self.github_owner, self.github_repo]):
-            return False, "❌ Chưa cấu hình GitHub credentials"
+    @staticmethod
+    def _backend_from_secrets():
+        """Chọn storage theo secrets: storage_dir -> local, ngược lại GitHub"""
+        storage_dir = st.secrets.get("storage_dir", None)
+        if storage_dir:
+            return LocalDirectoryBackend(storage_dir)
         
+        return GitHubStorageBackend(
+            st.secrets.get("github_token", None),
+            st.secrets.get("github_owner", None),
+            st.secrets.get("github_repo", None),
+            api_url=st.secrets.get("github_api_url", None)
+        )
+    
+    @property
+    def current_sha(self):
+        """Version của dữ liệu đã tải gần nhất (blob sha, hoặc hash các partition)"""
+        return self._loaded_data['sha'] if self._loaded_data else None
+    
+    @property
+    def partition_versions(self):
+        """{năm: version} của lần tải gần nhất, None nếu storage còn layout 1 file"""
+        return self._loaded_data.get('partitions') if self._loaded_data else None
+    
+    @property
+    def is_enriched(self):
+        """Dữ liệu tải gần nhất đã có cột tiền xử lý (tạo lúc upload) hay chưa"""
+        return bool(self._loaded_data and self._loaded_data.get('enriched'))
+    
+    def get_client_stats(self):
+        """Thống kê truy cập storage"""
+        return self.backend.get_stats()
+    
+    def check_github_connection(self):
+        """Kiểm tra kết nối storage"""
+        return self.backend.check_connection()
+    
+    def get_current_file_info(self):
+        """Lấy thông tin file hiện tại"""
         try:
-            url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}"
-            headers = {"Authorization": f"token {self.github_token}"}
-            response = requests.get(url, headers=headers, timeout=10)
+            return self.backend.read_json(self.metadata_file)
+        except Exception as e:
+            st.warning(f"Không thể đọc metadata: {str(e)}")
+        
+        return None
+    
+    def _partition_filename(self, year):
+        return f"{self.partition_prefix}{int(year)}.json"
+    
+    def _backup_timestamp(self, current_metadata):
+        """Mốc thời gian backup = thời điểm upload của dữ liệu hiện tại"""
+        if current_metadata:
+            upload_time = current_metadata.get('upload_time', datetime.now().isoformat())
+            return upload_time[:19].replace(':', '-').replace(' ', '_')
+        return datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    
+    def _backup_filename(self, timestamp, source):
+        """backup_<thời điểm>.json cho file cũ, backup_<thời điểm>__<partition> cho partition"""
+        if source == self.current_data_file:
+            return f"{self.backup_prefix}{timestamp}.json"
+        return f"{self.backup_prefix}{timestamp}__{source}"
+    
+    def _backup_group(self, name):
+        """Các backup cùng 1 lần upload có chung mốc thời gian"""
+        return name[len(self.backup_prefix):].split('__')[0].replace('.json', '')
+    
+    @staticmethod
+    def _normalize_frame(df):
+        """Chuẩn hóa cột khóa trước khi ghi: Tuần/Tháng/Số liệu dạng số, Năm dạng int"""
+        frame = df.copy()
+        frame.columns = frame.columns.astype(str).str.strip()
+        
+        for col in ('Tuần', 'Tháng', 'Số liệu'):
+            if col in frame.columns:
+                frame[col] = pd.to_numeric(frame[col], errors='coerce')
+        
+        # Thiếu Năm -> năm hiện tại (giống cách dashboard xử lý)
+        current_year = datetime.now().year
+        if 'Năm' not in frame.columns:
+            frame['Năm'] = current_year
+        frame['Năm'] = pd.to_numeric(frame['Năm'], errors='coerce').fillna(current_year).astype(int)
+        
+        return frame
+    
+    @staticmethod
+    def _split_by_year(frame):
+        return {int(year): rows.reset_index(drop=True) for year, rows in frame.groupby('Năm', sort=True)}
+    
+    def _upsert_rows(self, existing, incoming):
+        """Gộp dòng mới vào lịch sử: dòng trùng khóa được thay, dòng mới được thêm"""
+        incoming = incoming.drop_duplicates(self.upsert_keys, keep='last')
+        if existing is None or existing.empty:
+            return incoming.reset_index(drop=True)
+        
+        replaced = pd.MultiIndex.from_frame(existing[self.upsert_keys]).isin(
+            pd.MultiIndex.from_frame(incoming[self.upsert_keys])
+        )
+        return pd.concat([existing.loc[~replaced], incoming], ignore_index=True)
+    
+    @staticmethod
+    def _raw_columns(frame):
+        """Bỏ các cột tiền xử lý, giữ dữ liệu gốc (Danh mục / Nội dung về chuỗi) để upsert"""
+        raw = frame.drop(columns=PivotTableDashboard.derived_columns, errors='ignore')
+        for col in raw.columns:
+            if isinstance(raw[col].dtype, pd.CategoricalDtype):
+                raw[col] = raw[col].astype(object)
+        return raw
+    
+    @staticmethod
+    def _compact_partition(frame, dashboard):
+        """Categories chỉ phụ thuộc dòng của partition: năm không đổi -> partition không đổi"""
+        frame = frame.copy()
+        dashboard._encode_priority(frame)
+        for col in ('Tháng_Năm', 'Tuần_Tháng'):
+            frame[col] = frame[col].cat.remove_unused_categories()
+        return frame
+    
+    @staticmethod
+    def _same_frame(left, right):
+        """So sánh partition mới với bản trên storage (cùng cột, cùng kiểu, cùng giá trị)"""
+        return (list(left.columns) == list(right.columns)
+                and left.reset_index(drop=True).equals(right.reset_index(drop=True)))
+    
+    def _stored_partitions(self, metadata, existing_files):
+        """{năm: tên file} của các partition đang có trên storage"""
+        partitions = (metadata or {}).get('partitions') or {}
+        return {
+            int(year): info['file'] for year, info in partitions.items()
+            if info.get('file') in existing_files
+        }
+    
+    def _read_partition(self, path):
+        """Đọc 1 partition (có ETag) -> (df, version, có thay đổi so với lần đọc trước)"""
+        cached = self._partition_cache.get(path)
+        stored = self.backend.read_file(path, etag=cached['etag'] if cached else None)
+        
+        if stored is None:
+            raise FileNotFoundError(f"Thiếu partition {path}")
+        
+        if stored['status'] == 304 and cached:
+            return cached['df'], cached['version'], False
+        
+        with stored['body'] as body:
+            df, _ = decode_data_package(body)
+        
+        self._partition_cache[path] = {'etag': stored['etag'], 'version': stored['version'], 'df': df}
+        return df, stored['version'], True
+    
+    def _enrich_upsert(self, incoming, stored_partitions, dashboard):
+        """Upsert trên partition đã tiền xử lý: chỉ đọc và tính lại các năm liên quan
+        
+        Đọc partition của các năm trong file mới, thêm partition liền trước (ngữ cảnh cho tuần
+        trước / mức nền) và liền sau (tuần đầu năm sau so với cuối năm nay). Tuần trước và TB 4 tuần
+        tính theo dòng của chuỗi: chuỗi nào chưa đủ upsert_context_rows dòng ở một phía thì đọc
+        thêm 1 partition phía đó. Biến động chỉ tính lại qua replace_years.
+        Trả về (partition đã đọc, {năm: partition đã tiền xử lý} của các năm có thể thay đổi).
+        """
+        changed = sorted(incoming)
+        stored_years = sorted(stored_partitions)
+        below = [year for year in stored_years if year < changed[0]]
+        above = [year for year in stored_years if year > changed[-1]]
+        inside = [year for year in stored_years if changed[0] <= year <= changed[-1]]
+        series_keys = ['Danh mục', 'Nội dung']
+        
+        def short(years, affected):
+            """Có chuỗi bị ảnh hưởng chưa đủ upsert_context_rows dòng trong các năm `years`"""
+            frames = [stored[year][series_keys].astype(object) for year in years]
+            counts = pd.concat(frames).value_counts() if frames else pd.Series(dtype=int)
+            return bool((counts.reindex(affected, fill_value=0) < self.upsert_context_rows).any())
+        
+        stored = {}
+        lower, upper = below[-1:], above[:1]
+        while True:
+            for year in lower + inside + upper:
+                if year not in stored:
+                    stored[year] = self._read_partition(stored_partitions[year])[0]
+            
+            history = {
+                year: self._upsert_rows(self._raw_columns(stored[year]) if year in stored else None, rows)
+                for year, rows in incoming.items()
+            }
+            affected = pd.MultiIndex.from_frame(
+                pd.concat(history.values())[series_keys].astype(object).dropna().drop_duplicates()
+            )
             
-            if response.status_code == 200:
-                return True, "✅ GitHub kết nối thành công"
-            else:
-                return False, f"❌ GitHub error: {response.status_code}"
+            widen_lower = len(lower) < len(below) and short(lower, affected)
+            widen_upper = len(upper) < len(above) and short(upper, affected)
+            if not (widen_lower or widen_upper):
+                break
+            if widen_lower:
+                lower = below[-(len(lower) + 1):]
+            if widen_upper:
+                upper = above[:len(upper) + 1]
+        
+        rows = pd.concat(history.values(), ignore_index=True)
+        if stored:
+            context = pd.concat([stored[year] for year in lower + inside + upper], ignore_index=True)
+            if not (dashboard.load_enriched_data(context) and dashboard.replace_years(changed, rows)):
+                raise ValueError("không tính lại được biến động cho các năm upsert")
+            data = dashboard.data
+        else:
+            data = dashboard.build_enriched(rows, use_cache=False)
+        
+        # Năm trước changed[0] chỉ là ngữ cảnh (dòng đầu thiếu tuần trước), không ghi lại
+        return stored, {
+            year: self._compact_partition(frame, dashboard)
+            for year, frame in self._split_by_year(data).items()
+            if year >= changed[0]
+        }
+    
+    def upload_new_file(self, data, filename, mode="replace"):
+        """Upload ngay trong script (hiển thị tiến trình bằng st.*), dùng khi không chạy nền"""
+        status = st.empty()
+        success, message, summary = self.run_upload(
+            data, filename, mode,
+            progress=lambda stage, fraction, text: status.info(text)
+        )
+        status.empty()
+        
+        if not success:
+            st.error(message)
+            return False
+        
+        if summary:
+            st.success(self.format_upload_summary(summary))
+        else:
+            st.info(message)
+        return True
+    
+    @staticmethod
+    def format_upload_summary(summary):
+        """Nội dung thông báo sau khi upload thành công"""
+        changed = ', '.join(str(y) for y in summary['changed_partitions']) or 'không có'
+        return f"""
+        🎉 **UPLOAD THÀNH CÔNG!**
+        
+        ✅ **File mới:** {summary['filename']}
+        ✅ **Dữ liệu:** {summary['uploaded_rows']:,} dòng upload, tổng {summary['total_rows']:,} dòng
+        ✅ **Partition đã ghi:** {changed} ({summary['written_mb']:.1f}MB)
+        ✅ **Tuần:** {summary['week_number']}/{summary['year']}
+        ✅ **Backup:** {summary['backups'] if summary['backups'] else 'Không có file cũ'} file, xóa {summary['deleted_backups']} backup cũ
+        
+        📱 **Sếp có thể xem ngay trên điện thoại!**
+        """
+    
+    def run_upload(self, data, filename, mode="replace", progress=None):
+        """Backup, partition theo năm, metadata và cleanup trong 1 commit
+        
+        mode="replace": thay toàn bộ dữ liệu bằng file mới
+        mode="upsert": chỉ thay dòng trùng (Năm, Tuần, Danh mục, Nội dung), giữ phần lịch sử còn lại
+        
+        Không gọi st.* (chạy được trong thread nền); tiến trình báo qua
+        progress(stage, fraction, message). Trả về (success, message, summary).
+        """
+        report = progress or (lambda stage, fraction, message: None)
+        
+        # Mỗi lần chỉ 1 upload ghi vào storage
+        with self._upload_lock:
+            try:
+                report('connect', 0.05, "🔄 Bắt đầu upload file mới...")
+                connected, message = self.check_github_connection()
+                if not connected:
+                    return False, message, None
+                
+                report('read_state', 0.15, "📂 Đang đọc trạng thái storage...")
+                existing_files = {f['name'] for f in self.backend.list_files()}
+                current_metadata = self.backend.read_json(self.metadata_file)
+                stored_partitions = self._stored_partitions(current_metadata, existing_files)
+                has_legacy = self.current_data_file in existing_files
+                backup_timestamp = self._backup_timestamp(current_metadata)
+                
+                report('prepare', 0.35, "📊 Đang chuẩn bị dữ liệu...")
+                incoming = self._split_by_year(self._normalize_frame(data))
+                if not incoming:
+                    return False, "❌ File không có dòng dữ liệu nào", None
+                
+                schema_version = PivotTableDashboard.enriched_schema_version
+                previous_partitions = (current_metadata or {}).get('partitions') or {}
+                dashboard = PivotTableDashboard()
+                
+                # Partition đang có đều đã tiền xử lý theo schema hiện tại -> upsert chỉ đọc
+                # và tính lại các năm liên quan; ngược lại xử lý lại toàn bộ lịch sử
+                incremental = mode == "upsert" and stored_partitions and all(
+                    (previous_partitions.get(str(year)) or {}).get('enriched_schema') == schema_version
+                    for year in stored_partitions
+                )
+                
+                if incremental:
+                    report('enrich', 0.5, "🧮 Đang tính lại các năm có dữ liệu mới...")
+                    stored, enriched = self._enrich_upsert(incoming, stored_partitions, dashboard)
+                else:
+                    if mode == "upsert":
+                        # Schema cũ: đọc mọi partition (đã tiền xử lý, hoặc dạng thô của bản cũ)
+                        stored = {year: self._read_partition(path)[0] for year, path in stored_partitions.items()}
+                        if has_legacy and not stored_partitions:
+                            # Chuyển từ layout 1 file: tách toàn bộ lịch sử theo năm
+                            legacy_data, _ = self._read_legacy_data()
+                            history = self._split_by_year(self._normalize_frame(legacy_data)) if legacy_data is not None else {}
+                        else:
+                            history = {year: self._raw_columns(df) for year, df in stored.items()}
+                        
+                        for year, rows in incoming.items():
+                            history[year] = self._upsert_rows(history.get(year), rows)
+                    else:
+                        history = incoming
+                        # Chỉ cần bản trên storage của các năm sẽ ghi, để bỏ qua partition không đổi
+                        stored = {year: self._read_partition(stored_partitions[year])[0]
+                                  for year in incoming if year in stored_partitions}
+                    
+                    # Tiền xử lý toàn bộ lịch sử 1 lần (biến động tuần nối liền qua các năm),
+                    # viewer chỉ cần giải mã là dùng được
+                    report('enrich', 0.5, "🧮 Đang tính cột phụ, thứ tự ưu tiên và biến động...")
+                    enriched = {
+                        year: self._compact_partition(frame, dashboard)
+                        for year, frame in self._split_by_year(
+                            dashboard.build_enriched(pd.concat(history.values(), ignore_index=True), use_cache=False)
+                        ).items()
+                    }
+                
+                # Upsert giữ các năm không có trong file mới
+                final_years = set(enriched) | (set(stored_partitions) if mode == "upsert" else set())
+                
+                # Chỉ ghi partition có nội dung khác bản trên storage
+                to_write = {
+                    year: frame for year, frame in enriched.items()
+                    if year not in stored or not self._same_frame(frame, stored[year])
+                }
+                
+                if not to_write and not has_legacy and final_years == set(stored_partitions):
+                    return True, "ℹ️ Dữ liệu không có gì thay đổi so với storage", None
+                
+                upload_time = datetime.now().isoformat()
+                partitions_meta = {}
+                packages = {}
+                for year in sorted(final_years):
+                    if year in to_write:
+                        package_bytes = encode_data_package(to_write[year], {
+                            'partition': year,
+                            'filename': filename,
+                            'upload_time': upload_time,
+                            'row_count': len(to_write[year]),
+                            'enriched_schema': schema_version
+                        })
+                        size_mb = len(package_bytes) / (1024*1024)
+                        if size_mb > self.max_file_size_mb:
+                            return False, f"❌ Dữ liệu năm {year} quá lớn ({size_mb:.1f}MB). Giới hạn {self.max_file_size_mb}MB", None
+                        
+                        packages[year] = package_bytes
+                        partitions_meta[str(year)] = {
+                            'file': self._partition_filename(year),
+                            'rows': len(to_write[year]),
+                            'updated': upload_time,
+                            'enriched_schema': schema_version
+                        }
+                    else:
+                        partitions_meta[str(year)] = previous_partitions[str(year)]
+                
+                total_rows = sum(info['rows'] for info in partitions_meta.values())
+                written_mb = sum(len(b) for b in packages.values()) / (1024*1024)
+                
+                new_metadata = {
+                    'filename': filename,
+                    'upload_time': upload_time,
+                    'week_number': datetime.now().isocalendar()[1],
+                    'year': datetime.now().year,
+                    'row_count': total_rows,
+                    'file_size_mb': round(written_mb, 2),
+                    'uploader': 'weekly_admin',
+                    'mode': mode,
+                    'uploaded_rows': len(data),
+                    'changed_partitions': sorted(packages),
+                    'enriched_schema': schema_version,
+                    'partitions': partitions_meta,
+                    'storage_format': f"{STORAGE_FORMAT_NAME}-v{STORAGE_FORMAT_VERSION}"
+                }
+                
+                report('commit', 0.7, "☁️ Đang upload file mới...")
+                changes = []
+                backup_names = set()
                 
+                def backup(path):
+                    # Backup = trỏ tên mới vào file hiện tại (GitHub dùng lại blob sha)
+                    backup_name = self._backup_filename(backup_timestamp, path)
+                    changes.append({'path': backup_name, 'copy_from': path})
+                    backup_names.add(backup_name)
+                
+                for year, package_bytes in packages.items():
+                    path = self._partition_filename(year)
+                    if path in existing_files:
+                        backup(path)
+                    changes.append({'path': path, 'data': package_bytes})
+                
+                # Partition bị bỏ (chế độ replace) và file layout cũ: backup rồi xóa
+                removed = [path for year, path in stored_partitions.items() if year not in final_years]
+                if has_legacy:
+                    removed.append(self.current_data_file)
+                for path in removed:
+                    backup(path)
+                    changes.append({'path': path, 'delete': True})
+                
+                new_metadata['replaced_backup'] = sorted(backup_names)
+                changes.append({'path': self.metadata_file,
+                                'text': json.dumps(new_metadata, ensure_ascii=False, indent=2)})
+                
+                # Giữ keep_backups lần upload gần nhất (tính cả lần vừa backup), xóa phần còn lại
+                existing_backups = {name for name in existing_files if name.startswith(self.backup_prefix)}
+                groups = {self._backup_group(name) for name in existing_backups | backup_names}
+                keep_groups = set(sorted(groups, reverse=True)[:self.keep_backups])
+                files_to_delete = sorted(
+                    name for name in existing_backups
+                    if self._backup_group(name) not in keep_groups and name not in backup_names
+                )
+                changes.extend({'path': name, 'delete': True} for name in files_to_delete)
+                
+                self.backend.commit(
+                    changes,
+                    f"📊 Weekly data update - Tuần {new_metadata['week_number']}/{new_metadata['year']}"
+                    f" ({mode}: {', '.join(str(y) for y in sorted(packages)) or 'không đổi'})"
+                )
+                
+                report('done', 1.0, "✅ Upload hoàn tất")
+                summary = {
+                    'filename': filename,
+                    'uploaded_rows': len(data),
+                    'total_rows': total_rows,
+                    'changed_partitions': sorted(packages),
+                    'written_mb': written_mb,
+                    'week_number': new_metadata['week_number'],
+                    'year': new_metadata['year'],
+                    'backups': len(backup_names),
+                    'deleted_backups': len(files_to_delete)
+                }
+                return True, "🎉 Upload thành công!", summary
+            
+            except Exception as e:
+                return False, f"❌ Lỗi upload: {str(e)}", None
+    
+    def load_current_data(self):
+        """Load dữ liệu hiện tại"""
+        try:
+            return self._read_current_data()
         except Exception as e:
-            return False, f"❌ Lỗi kết nối: {str(e)}"
+            st.warning(f"Không thể load dữ liệu: {str(e)}")
+        
+        return None, None
+    
+    def _read_current_data(self):
+        """Đọc dữ liệu hiện tại (partition theo năm hoặc file cũ), lỗi được raise ra ngoài"""
+        metadata = self.backend.read_json(self.metadata_file)
+        if metadata and metadata.get('partitions'):
+            return self._load_partitions(metadata)
+        return self._read_legacy_data()
+    
+    def _read_legacy_data(self):
+        """Đọc file dữ liệu layout cũ (1 file cho toàn bộ dữ liệu)"""
+        cached = self._loaded_data
+        if cached and cached.get('partitions') is not None:
+            cached = None
+        
+        # Gửi ETag của lần tải trước: file không đổi -> 304, bỏ qua tải và giải mã
+        stored = self.backend.read_file(self.current_data_file, etag=cached.get('etag') if cached else None)
+        
+        if stored is None:
+            return None, None
+        
+        if stored['status'] == 304 and cached:
+            return cached['df'], cached['metadata']
+        
+        # Giải mã thẳng thành cột (hỗ trợ cả file JSON records cũ)
+        with stored['body'] as body:
+            df, metadata = decode_data_package(body)
+        
+        self._loaded_data = {'etag': stored['etag'], 'sha': stored['version'], 'df': df,
+                             'metadata': metadata, 'partitions': None}
+        
+        return df, metadata
+    
+    def _load_partitions(self, metadata):
+        """Ghép các partition theo năm; partition không đổi lấy từ cache (304)"""
+        frames = []
+        versions = {}
+        for year, info in sorted(metadata['partitions'].items(), key=lambda item: int(item[0])):
+            df, version, _ = self._read_partition(info['file'])
+            frames.append(df)
+            versions[int(year)] = version
+        
+        # Bỏ cache của partition không còn dùng
+        live_files = {info['file'] for info in metadata['partitions'].values()}
+        self._partition_cache = {path: entry for path, entry in self._partition_cache.items() if path in live_files}
+        
+        sha = hashlib.sha1(
+            json.dumps(sorted(versions.items()), default=str).encode()
+        ).hexdigest()
+        
+        cached = self._loaded_data
+        if cached and cached['sha'] == sha:
+            cached['metadata'] = metadata
+            return cached['df'], metadata
+        
+        # Mọi partition đều đã tiền xử lý theo schema hiện tại -> dashboard dùng thẳng
+        enriched = all(
+            info.get('enriched_schema') == PivotTableDashboard.enriched_schema_version
+            for info in metadata['partitions'].values()
+        )
+        
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        self._loaded_data = {'etag': None, 'sha': sha, 'df': df, 'metadata': metadata,
+                             'partitions': versions, 'enriched': enriched}
+        
+        return df, metadata
+    
+    def get_storage_info(self):
+        """Lấy thông tin storage usage"""
+        try:
+            files = self.backend.list_files()
+            
+            total_size = sum(f.get('size', 0) for f in files)
+            backup_files = [f for f in files if f['name'].startswith(self.backup_prefix)]
+            
+            return {
+                'total_files': len(files),
+                'backup_files': len(backup_files),
+                'total_size_mb': round(total_size / (1024*1024), 2),
+                'files': files
+            }
+        
+        except Exception as e:
+            pass
+        
+        return None
+
+# ================== BACKGROUND UPLOAD JOBS ==================
+class UploadJobQueue:
+    """
+    Chạy upload dưới nền trên 1 pool thread nhỏ
+    - Mỗi job có job_id, stage và progress để UI poll
+    - Cùng dữ liệu + chế độ upload khi job trước còn chạy (hoặc vừa xong) -> dùng lại job đó
+    - Job chạy trong thread: không gọi st.*, chỉ cập nhật trạng thái job
+    """
+    
+    def __init__(self, max_workers=2, dedupe_seconds=60, max_history=20):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="weekly-upload")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.dedupe_seconds = dedupe_seconds
+        self.max_history = max_history
+    
+    @staticmethod
+    def data_digest(data, mode):
+        """Hash nội dung DataFrame + chế độ upload, dùng để gộp các lần bấm trùng"""
+        return hashlib.sha256(f"{mode}:{PreprocessPipeline.frame_digest(data)}".encode()).hexdigest()
+    
+    def submit(self, manager, data, filename, mode="upsert", on_success=None):
+        """Đưa upload vào hàng đợi, trả về job_id (job cũ nếu trùng dữ liệu)"""
+        digest = self.data_digest(data, mode)
+        now = time.time()
+        
+        with self._lock:
+            for job in self._jobs.values():
+                if job['digest'] != digest:
+                    continue
+                if job['status'] in ('queued', 'running'):
+                    return job['id']
+                if job['status'] == 'done' and now - job['finished_at'] < self.dedupe_seconds:
+                    return job['id']
+            
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                'id': job_id,
+                'digest': digest,
+                'filename': filename,
+                'mode': mode,
+                'status': 'queued',
+                'stage': 'queued',
+                'progress': 0.0,
+                'message': "⏳ Đang chờ xử lý...",
+                'summary': None,
+                'submitted_at': now,
+                'finished_at': None
+            }
+            self._prune()
+        
+        self._executor.submit(self._run, job_id, manager, data.copy(), filename, mode, on_success)
+        return job_id
+    
+    def get(self, job_id):
+        """Bản sao trạng thái job (None nếu không còn)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def jobs(self):
+        """Danh sách job, mới nhất trước"""
+        with self._lock:
+            return sorted((dict(job) for job in self._jobs.values()),
+                          key=lambda job: job['submitted_at'], reverse=True)
+    
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+    
+    def _prune(self):
+        """Chỉ giữ max_history job đã kết thúc gần nhất"""
+        finished = sorted(
+            (job for job in self._jobs.values() if job['status'] in ('done', 'failed')),
+            key=lambda job: job['finished_at']
+        )
+        for job in finished[:max(len(finished) - self.max_history, 0)]:
+            del self._jobs[job['id']]
+    
+    def _run(self, job_id, manager, data, filename, mode, on_success):
+        self._update(job_id, status='running')
+        
+        def progress(stage, fraction, message):
+            self._update(job_id, stage=stage, progress=fraction, message=message)
+        
+        try:
+            success, message, summary = manager.run_upload(data, filename, mode, progress=progress)
+            if success and on_success:
+                on_success()
+        except Exception as e:
+            success, message, summary = False, f"❌ Lỗi upload: {str(e)}", None
+        
+        finished = {'status': 'done' if success else 'failed', 'message': message,
+                    'summary': summary, 'finished_at': time.time()}
+        if success:
+            finished['progress'] = 1.0
+        self._update(job_id, **finished)
+
+# ================== PREPROCESSING PIPELINE ==================
+class PreprocessPipeline:
+    """
+    Tiền xử lý theo từng bước: read → clean → coerce → enrich → rank → ratios
+    - Memo theo hash nội dung đầu vào (bytes file Excel, nội dung DataFrame hoặc sha trên GitHub)
+    - Mỗi bước được đo thời gian; bước nằm trong cache_stages được giữ lại để chạy tiếp từ đó
+    - Mở lại cùng file / cùng sha -> trả ngay DataFrame đã xử lý, không chạy lại bước nào
+    
+    Các bước (trừ read) là PivotTableDashboard._stage_<tên>: nhận DataFrame, trả DataFrame mới
+    và không sửa DataFrame đầu vào. DataFrame trong cache dùng chung: chỉ đọc, không sửa tại chỗ.
+    """
+    
+    stages = ('read', 'clean', 'coerce', 'enrich', 'rank', 'ratios')
+    
+    def __init__(self, max_entries=8, cache_stages=('read', 'ratios')):
+        self.max_entries = max_entries
+        self.cache_stages = set(cache_stages)
+        self._lock = threading.Lock()
+        self._cache = {}   # (digest, stage) -> DataFrame, thứ tự chèn = LRU
+        self.stats = {'hits': 0, 'partial_hits': 0, 'misses': 0}
+    
+    @staticmethod
+    def frame_digest(data):
+        """Hash nội dung DataFrame (tên cột + giá trị, bỏ qua index)"""
+        digest = hashlib.sha256("|".join(map(str, data.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    
+    def clear(self):
+        """Xóa toàn bộ kết quả đã memo"""
+        with self._lock:
+            self._cache.clear()
+    
+    def _lookup(self, digest):
+        """Bước cuối cùng có trong cache cho digest -> (frame, vị trí bước kế tiếp)"""
+        with self._lock:
+            for index in range(len(self.stages) - 1, -1, -1):
+                key = (digest, self.stages[index])
+                if key in self._cache:
+                    # Đưa về cuối (mới dùng nhất)
+                    self._cache[key] = self._cache.pop(key)
+                    if index == len(self.stages) - 1:
+                        self.stats['hits'] += 1
+                    else:
+                        self.stats['partial_hits'] += 1
+                    return self._cache[key], index + 1
+            self.stats['misses'] += 1
+        return None, 0
+    
+    def _store(self, key, frame):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = frame
+            while len(self._cache) > self.max_entries:
+                self._cache.pop(next(iter(self._cache)))
+    
+    def run(self, source, dashboard, key=None, use_cache=True):
+        """Chạy pipeline cho DataFrame hoặc file Excel (đường dẫn / file upload)
+        
+        key: định danh nội dung có sẵn (vd. sha dữ liệu trên GitHub) -> không cần hash
+        Trả về (DataFrame đã xử lý, {bước: giây}); bước lấy từ cache không có trong timings.
+        """
+        timings = {}
+        is_frame = isinstance(source, pd.DataFrame)
+        raw_bytes = file_digest = None
+        
+        started = time.perf_counter()
+        if key is not None:
+            digest = f"key:{key}"
+        elif is_frame:
+            digest = f"frame:{self.frame_digest(source)}"
+        else:
+            raw_bytes = ExcelReader.source_bytes(source)
+            file_digest = hashlib.sha256(raw_bytes).hexdigest()
+            digest = f"file:{file_digest}"
+        timings['hash'] = time.perf_counter() - started
+        
+        frame, start_index = self._lookup(digest) if use_cache else (None, 0)
+        
+        for stage in self.stages[start_index:]:
+            started = time.perf_counter()
+            if stage == 'read':
+                if is_frame:
+                    frame = source
+                else:
+                    frame = get_excel_reader().read(source, raw_bytes=raw_bytes, digest=file_digest)
+            else:
+                frame = getattr(dashboard, f"_stage_{stage}")(frame)
+            timings[stage] = time.perf_counter() - started
+            
+            # DataFrame đầu vào không cần giữ lại ở bước read
+            if use_cache and stage in self.cache_stages and not (stage == 'read' and is_frame):
+                self._store((digest, stage), frame)
+        
+        return frame, timings
+    
+    @staticmethod
+    def format_timings(timings):
+        """Chuỗi ngắn gọn thời gian từng bước, vd. 'read 0.41s · clean 0.01s · ...'"""
+        steps = [f"{stage} {seconds:.2f}s" for stage, seconds in timings.items() if stage != 'hash']
+        if not steps:
+            return "♻️ Dùng lại kết quả đã xử lý"
+        return " · ".join(steps)
+
+# ================== FILTER INDEX ==================
+class FilterIndex:
+    """
+    Index cho bộ lọc sidebar, dựng 1 lần cho mỗi DataFrame đã xử lý
+    - Mỗi cột lọc (Năm, Tháng, Tuần, Danh mục, Nội dung): mã từng dòng + vị trí dòng theo giá trị
+    - Mask của mỗi lựa chọn được cache; lọc = AND các mask rồi take, không copy cả DataFrame
+    - Danh sách option cho widget đọc từ index thay vì unique() trên toàn bộ dữ liệu
+    - Khoảng thời gian: số thứ tự tuần ISO / tháng liên tục qua các năm, đã sort sẵn,
+      lọc bằng searchsorted tính ngược từ kỳ mới nhất của các năm đang chọn
+    - Cây Danh mục → Nội dung (thứ tự ưu tiên, số dòng) và tra cứu tên không dấu cho ô tìm kiếm
+    - Dùng được cho bảng đã tổng hợp (ô của RollupCube): chỉ index các cột có trong bảng
+    """
+    
+    columns = ('Năm', 'Tháng', 'Tuần', 'Danh mục', 'Nội dung')
+    
+    # Khoảng thời gian trên slider -> (loại kỳ, số kỳ tính từ kỳ mới nhất); None = tất cả
+    time_ranges = {
+        "1 Tuần": ('week', 1),
+        "1 Tháng": ('month', 1),
+        "3 Tháng": ('month', 3),
+        "6 Tháng": ('month', 6),
+        "1 Năm": ('month', 12),
+        "Tất cả": None
+    }
+    
+    def __init__(self, data, max_masks=32):
+        self.data = data
+        self.row_count = len(data)
+        self.max_masks = max_masks
+        self._masks = {}
+        self._cube = None
+        # Định danh của DataFrame được index (mỗi lần load = 1 phiên bản), dùng trong key PivotCache
+        self.version = uuid.uuid4().hex[:12]
+        self._hierarchy = None
+        self._search_names = None
+        self.indexed_columns = [column for column in self.columns if column in data.columns]
+        self._codes = {}
+        self._values = {}
+        self._lookup = {}
+        self._order = {}
+        self._bounds = {}
+        self._has_missing = {}
+        
+        for column in self.indexed_columns:
+            series = data[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Giữ thứ tự categories (thứ tự ưu tiên)
+                codes = series.cat.codes.to_numpy().astype(np.int64)
+                values = series.cat.categories.tolist()
+            else:
+                codes, uniques = pd.factorize(series, sort=True)
+                codes = codes.astype(np.int64)
+                values = uniques.tolist()
+            
+            # Vị trí dòng theo giá trị: rows[bounds[c]:bounds[c+1]] là các dòng có mã c
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            
+            self._codes[column] = codes
+            self._values[column] = values
+            self._lookup[column] = {value: code for code, value in enumerate(values)}
+            self._order[column] = order
+            self._bounds[column] = bounds
+            self._has_missing[column] = bool((codes < 0).any())
+        
+        # Số thứ tự kỳ: sort 1 lần để lọc khoảng bằng searchsorted
+        years = pd.to_numeric(data['Năm'], errors='coerce').to_numpy(dtype=float)
+        ordinals = pd.DataFrame({'year': years})
+        if 'Tuần' in data.columns:
+            ordinals['week'] = self.week_ordinals(years, data['Tuần'])
+        if 'Tháng' in data.columns:
+            ordinals['month'] = self.month_ordinals(years, data['Tháng'])
+        units = [unit for unit in ('week', 'month') if unit in ordinals.columns]
+        
+        # Mốc của từng năm = dòng có tuần mới nhất; mốc tháng là tháng của dòng đó
+        # (tuần 1 có thể ghi Tháng 12 của năm trước -> không lấy max tháng)
+        latest = (ordinals.dropna(subset=['year'])
+                  .sort_values(units, na_position='first')
+                  .groupby('year').last())
+        
+        self._periods = {}
+        for unit in units:
+            values = ordinals[unit].to_numpy()
+            order = np.argsort(values, kind='stable')
+            self._periods[unit] = (order, values[order], latest[unit].dropna().to_dict())
+    
+    @property
+    def cube(self):
+        """RollupCube của dữ liệu, dựng lần đầu khi cần"""
+        if self._cube is None:
+            self._cube = RollupCube(self)
+        return self._cube
+    
+    @staticmethod
+    def week_ordinals(years, weeks):
+        """Số thứ tự tuần ISO liên tục qua các năm (số tuần tính từ thứ Hai 05/01/1970)"""
+        years = np.asarray(years, dtype=float)
+        weeks = pd.to_numeric(weeks, errors='coerce').to_numpy(dtype=float)
+        ordinals = np.full(len(years), np.nan)
+        for year in np.unique(years[~np.isnan(years)]):
+            # Tuần 1 ISO bắt đầu từ thứ Hai của tuần chứa ngày 4/1
+            jan4 = datetime(int(year), 1, 4)
+            first_monday = jan4 - timedelta(days=jan4.weekday())
+            rows = years == year
+            ordinals[rows] = (first_monday - datetime(1970, 1, 5)).days // 7 + weeks[rows] - 1
+        return ordinals
+    
+    @staticmethod
+    def month_ordinals(years, months):
+        """Số thứ tự tháng liên tục qua các năm (Năm * 12 + Tháng - 1)"""
+        months = pd.to_numeric(months, errors='coerce').to_numpy(dtype=float)
+        return np.asarray(years, dtype=float) * 12 + months - 1
+    
+    @staticmethod
+    def fold_text(text):
+        """Chuỗi không dấu, chữ thường để tìm kiếm ("Văn bản đến" -> "van ban den")"""
+        text = unicodedata.normalize('NFD', str(text).replace('đ', 'd').replace('Đ', 'D'))
+        return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    
+    @property
+    def hierarchy(self):
+        """[(danh mục, số dòng, [(nội dung, số dòng), ...]), ...] theo thứ tự ưu tiên, chỉ mục có dữ liệu"""
+        if self._hierarchy is None:
+            category_codes, content_codes = self._codes['Danh mục'], self._codes['Nội dung']
+            categories, contents = self._values['Danh mục'], self._values['Nội dung']
+            
+            # Đếm số dòng mỗi cặp (danh mục, nội dung) bằng 1 lần bincount
+            valid = (category_codes >= 0) & (content_codes >= 0)
+            pair_counts = np.bincount(
+                category_codes[valid] * len(contents) + content_codes[valid],
+                minlength=len(categories) * len(contents)
+            ).reshape(len(categories), len(contents))
+            
+            category_counts = self.counts('Danh mục')
+            self._hierarchy = [
+                (categories[code], int(category_counts[code]),
+                 [(contents[item], int(pair_counts[code, item])) for item in np.flatnonzero(pair_counts[code])])
+                for code in np.flatnonzero(category_counts)
+            ]
+        return self._hierarchy
+    
+    def search_contents(self, query, categories=None):
+        """Nội dung (thứ tự ưu tiên) thuộc `categories` có tên chứa mọi từ trong `query`, không phân biệt dấu"""
+        if self._search_names is None:
+            self._search_names = {
+                content: self.fold_text(content) for content in self._values['Nội dung']
+            }
+        
+        tokens = self.fold_text(query).split()
+        selected = None if categories is None else set(categories)
+        results = []
+        for category, _, items in self.hierarchy:
+            if selected is not None and category not in selected:
+                continue
+            for content, _ in items:
+                if content not in results and all(token in self._search_names[content] for token in tokens):
+                    results.append(content)
+        return results
+    
+    def time_bounds(self, time_range, years=None):
+        """(loại kỳ, kỳ đầu, kỳ cuối) của `time_range` tính ngược từ kỳ mới nhất của `years` (None = mọi năm)
+        
+        None = không lọc ("Tất cả" hoặc không xác định được kỳ mới nhất)
+        """
+        spec = self.time_ranges.get(time_range)
+        if spec is None or spec[0] not in self._periods:
+            return None
+        unit, span = spec
+        latest_by_year = self._periods[unit][2]
+        
+        anchors = [latest for year, latest in latest_by_year.items() if years is None or year in set(years)]
+        if not anchors:
+            return None
+        anchor = max(anchors)
+        return unit, anchor - span + 1, anchor
+    
+    def time_mask(self, time_range, years=None):
+        """Mask các dòng trong `time_range` (xem time_bounds); None = không lọc"""
+        bounds = self.time_bounds(time_range, years)
+        return None if bounds is None else self.period_mask(*bounds)
+    
+    def period_mask(self, unit, first, last):
+        """Mask các dòng có số thứ tự kỳ trong [first, last]; None = mọi dòng đều thỏa"""
+        order, sorted_ordinals, _ = self._periods[unit]
+        start = np.searchsorted(sorted_ordinals, first, side='left')
+        end = np.searchsorted(sorted_ordinals, last, side='right')
+        if start == 0 and end == self.row_count:
+            return None
+        
+        key = ('time', unit, int(start), int(end))
+        mask = self._masks.pop(key, None)
+        if mask is None:
+            mask = np.zeros(self.row_count, dtype=bool)
+            mask[order[start:end]] = True
+        self._remember(key, mask)
+        return mask
+    
+    def counts(self, column):
+        """Số dòng của từng giá trị (theo thứ tự option)"""
+        return np.diff(self._bounds[column])
+    
+    def options(self, column, within=None, time_range=None):
+        """Các giá trị có trong dữ liệu (Năm/Tháng/Tuần tăng dần, Danh mục/Nội dung theo ưu tiên)
+        
+        within: {cột: giá trị đã chọn} (+ time_range) -> chỉ lấy giá trị xuất hiện trong các dòng thỏa điều kiện
+        """
+        mask = self.combined_mask(within or {}, time_range)
+        if mask is None:
+            present = np.flatnonzero(self.counts(column))
+        else:
+            codes = self._codes[column][mask]
+            present = np.unique(codes[codes >= 0])
+        values = self._values[column]
+        return [values[code] for code in present]
+    
+    def positions(self, column, value):
+        """Vị trí các dòng có column == value"""
+        code = self._lookup[column].get(value)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        bounds = self._bounds[column]
+        return self._order[column][bounds[code]:bounds[code + 1]]
+    
+    def mask(self, column, selected):
+        """Mask dòng có giá trị thuộc selected; None = không cần lọc (đã chọn mọi giá trị có trong dữ liệu)"""
+        lookup = self._lookup[column]
+        codes = sorted({lookup[value] for value in selected if value in lookup})
+        # Dòng thiếu giá trị (NaN) không thuộc lựa chọn nào -> vẫn phải lọc
+        if not self._has_missing[column] and np.isin(np.flatnonzero(self.counts(column)), codes).all():
+            return None
+        
+        key = (column, tuple(codes))
+        mask = self._masks.pop(key, None)
+        if mask is None:
+            mask = np.zeros(self.row_count, dtype=bool)
+            bounds, order = self._bounds[column], self._order[column]
+            for code in codes:
+                mask[order[bounds[code]:bounds[code + 1]]] = True
+        
+        self._remember(key, mask)
+        return mask
+    
+    def _remember(self, key, mask):
+        # LRU: mask vừa dùng đưa về cuối, bỏ mask cũ nhất khi vượt giới hạn
+        self._masks[key] = mask
+        while len(self._masks) > self.max_masks:
+            self._masks.pop(next(iter(self._masks)))
+    
+    def combined_mask(self, selections, time_range=None, period=None):
+        """AND mask của nhiều cột: {cột: giá trị đã chọn} và khoảng thời gian; None = không lọc dòng nào
+        
+        period: (loại kỳ, kỳ đầu, kỳ cuối) đã tính sẵn, dùng thay cho time_range
+        """
+        masks = [self.mask(column, selected) for column, selected in selections.items()]
+        if time_range is not None:
+            masks.append(self.time_mask(time_range, selections.get('Năm')))
+        if period is not None:
+            masks.append(self.period_mask(*period))
+        
+        combined = None
+        for mask in masks:
+            if mask is None:
+                continue
+            combined = mask if combined is None else combined & mask
+        return combined
+    
+    def filter(self, selections, time_range=None):
+        """DataFrame các dòng thỏa mọi lựa chọn (chính self.data nếu không lọc gì)"""
+        mask = self.combined_mask(selections, time_range)
+        if mask is None:
+            return self.data
+        return self.data.take(np.flatnonzero(mask))
+
+# ================== ROLLUP CUBE ==================
+class RollupCube:
+    """
+    Số liệu tổng hợp sẵn theo (Danh mục, Nội dung) ở 4 mức thời gian: tuần → tháng → quý → năm
+    - Mỗi ô giữ sum, count, min, max (mean = sum / count)
+    - Với mỗi mức nền so sánh có trong dữ liệu: tổng số liệu và tổng mức nền của các dòng có cả hai
+      (<key>_value, <key>_base) -> % so với mức nền ở mọi mức gộp
+    - Dựng 1 lần cho mỗi DataFrame (FilterIndex.cube); mức thô hơn gộp từ mức mịn hơn
+    - Pivot của các kiểu báo cáo = lọc ô ở mức thô nhất còn đủ chiều rồi gộp lại,
+      cho kết quả như pd.pivot_table trên dòng thô đã lọc
+    """
+    
+    dimensions = ['Danh mục', 'Nội dung']
+    grains = {
+        'year': ['Năm'],
+        'quarter': ['Năm', 'Quý'],
+        'month': ['Năm', 'Quý', 'Tháng'],
+        'week': ['Năm', 'Quý', 'Tháng', 'Tuần']
+    }
+    aggregations = ('sum', 'mean', 'count', 'min', 'max')
+    # Cột cần có trong mức để lọc theo loại kỳ của time_range
+    period_columns = {'week': 'Tuần', 'month': 'Tháng'}
+    # Cách gộp từng thước đo khi đi từ mức mịn lên mức thô
+    measures = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+    
+    def __init__(self, index):
+        self.index = index
+        self._indexes = {}
+        self.measures = dict(RollupCube.measures)
+        self.baselines = []
+        
+        data = index.data
+        keys = self.dimensions + self.grains['week']
+        value = data['Số liệu']
+        rows = pd.DataFrame({key: data[key] for key in keys})
+        rows['value'] = value
+        rows['has_value'] = value.notna().astype(np.int64)
+        aggregations = dict(sum=('value', 'sum'), count=('has_value', 'sum'), min=('value', 'min'), max=('value', 'max'))
+        
+        for key, (column, _) in PivotTableDashboard.comparison_baselines.items():
+            if column is None or column not in data.columns:
+                continue
+            baseline = data[column].astype(float)
+            both = value.notna() & baseline.notna()
+            rows[f'{key}_value'] = value.where(both)
+            rows[f'{key}_base'] = baseline.where(both)
+            for measure in (f'{key}_value', f'{key}_base'):
+                aggregations[measure] = (measure, 'sum')
+                self.measures[measure] = 'sum'
+            self.baselines.append(key)
+        
+        # dropna=False: giữ cả dòng thiếu Tuần / Tháng để mức thô hơn không mất số liệu
+        self._cells = {'week': rows.groupby(keys, observed=True, sort=True, dropna=False).agg(
+            **aggregations
+        ).reset_index()}
+        
+        finer = self._cells['week']
+        for grain in ('month', 'quarter', 'year'):
+            finer = self._cells[grain] = self._rollup(finer, self.dimensions + self.grains[grain]).reset_index()
+    
+    def _rollup(self, cells, keys, measures=None, dropna=False):
+        """Gộp các ô theo `keys` (index = keys); measures=None -> mọi thước đo để gộp tiếp"""
+        measures = list(self.measures) if measures is None else measures
+        return cells.groupby(keys, observed=True, sort=True, dropna=dropna).agg(
+            {measure: self.measures[measure] for measure in measures}
+        )
+    
+    def cells(self, grain):
+        """Bảng ô của 1 mức (chỉ đọc)"""
+        return self._cells[grain]
+    
+    def supports(self, rows, cols, values, agg_func):
+        """Pivot này lấy được từ cube không (ngược lại: pivot trên dòng thô)"""
+        dims = list(rows) + list(cols)
+        return (values == 'Số liệu' and agg_func in self.aggregations and bool(rows)
+                and len(set(dims)) == len(dims)
+                and set(dims) <= set(self.dimensions + self.grains['week']))
+    
+    def _grain_index(self, grain):
+        if grain not in self._indexes:
+            self._indexes[grain] = FilterIndex(self._cells[grain])
+        return self._indexes[grain]
+    
+    def pivot(self, rows, cols, agg_func, selections=None, time_range=None, fill_value=0):
+        """Pivot giá trị của các dòng thỏa bộ lọc
+        
+        selections / time_range giống FilterIndex.filter; không có cols -> trả về Series
+        """
+        # Chỉ gộp các thước đo cần cho phép tính này
+        measures = ['sum', 'count'] if agg_func == 'mean' else [agg_func]
+        grouped = self._slice(rows, cols, measures, selections, time_range)
+        if agg_func == 'mean':
+            value = grouped['sum'] / grouped['count'].where(grouped['count'] > 0)
+        else:
+            value = grouped[agg_func]
+        return self.reshape(value.rename('Số liệu'), cols, fill_value)
+    
+    def compare(self, rows, cols, baseline, selections=None, time_range=None):
+        """(tổng số liệu, tổng mức nền) của các dòng có mức nền `baseline`, cùng hình dạng pivot (ô thiếu = NaN)"""
+        grouped = self._slice(rows, cols, [f'{baseline}_value', f'{baseline}_base'], selections, time_range)
+        current = self.reshape(grouped[f'{baseline}_value'].rename('Số liệu'), cols, None)
+        base = self.reshape(grouped[f'{baseline}_base'].rename('Số liệu'), cols, None)
+        return current, base
+    
+    def _slice(self, rows, cols, measures, selections=None, time_range=None):
+        """Các thước đo `measures` của ô thỏa bộ lọc, gộp theo (rows + cols)"""
+        selections = selections or {}
+        
+        # Chiều cần có: chiều pivot + cột đang thực sự lọc + cột của loại kỳ trong time_range
+        needed = set(rows) | set(cols)
+        needed.update(column for column, selected in selections.items()
+                      if self.index.mask(column, selected) is not None)
+        period = self.index.time_bounds(time_range, selections.get('Năm')) if time_range else None
+        if period is not None:
+            needed.add(self.period_columns[period[0]])
+        needed -= set(self.dimensions)
+        grain = next(name for name in ('year', 'quarter', 'month', 'week') if needed <= set(self.grains[name]))
+        
+        cells = self._cells[grain]
+        grain_index = self._grain_index(grain)
+        mask = grain_index.combined_mask(
+            {column: selected for column, selected in selections.items() if column in grain_index.indexed_columns},
+            period=period
+        )
+        if mask is not None:
+            cells = cells.take(np.flatnonzero(mask))
+        
+        # Như pd.pivot_table: ô thiếu giá trị ở chiều pivot không được tính
+        return self._rollup(cells, list(rows) + list(cols), measures, dropna=True)
+    
+    @staticmethod
+    def reshape(value, cols, fill_value=0):
+        """Series theo (rows + cols) -> bảng như pd.pivot_table"""
+        if cols:
+            # Như pd.pivot_table: bỏ ô không có giá trị rồi mới xoay cột
+            value = value.dropna().unstack(list(cols)).sort_index(axis=1)
+            if fill_value is not None:
+                value = value.fillna(fill_value)
+        return value
+
+# ================== PIVOT RESULT ==================
+class PivotResult:
+    """
+    Kết quả pivot dạng số, tách khỏi chuỗi hiển thị
+    - values: ma trận giá trị (hàng × cột); changes: ma trận % biến động (NaN = không có) hoặc None
+    - totals: tổng từng hàng; index / columns: nhãn hàng / cột (giữ tên chiều)
+    - Chuỗi hiển thị (số + biến động HTML, cột Tổng) chỉ tạo khi gọi formatted(), 1 lần
+    - Sparkline, biểu đồ và file xuất đọc thẳng các mảng số
+    - subtotals / grand_total: PivotResult các dòng tổng từng Danh mục / Tổng cộng (hoặc None),
+      gộp từ chính ma trận số này và được cache cùng pivot
+    
+    Bất biến: mảng chỉ đọc, không có setter -> dùng chung được giữa các session (PivotCache).
+    Pivot không có chiều cột: 1 cột giá trị, has_columns = False, không có cột Tổng.
+    """
+    
+    # Ước tính dung lượng 1 ô chuỗi hiển thị (cho PivotCache)
+    view_bytes_per_cell = 64
+    
+    # Nhãn dòng Tổng cộng
+    grand_total_label = 'Tổng cộng'
+    
+    def __init__(self, values, index, columns, changes=None, has_columns=True, subtotals=None, grand_total=None):
+        self.values = self._frozen(values)
+        self.changes = None if changes is None else self._frozen(changes)
+        self.totals = self._frozen(np.nansum(self.values, axis=1))
+        self.index = index
+        self.columns = columns
+        self.has_columns = has_columns
+        self.subtotals = subtotals
+        self.grand_total = grand_total
+        self._view = None
+    
+    @staticmethod
+    def _frozen(array):
+        array = np.array(array, dtype=float)
+        array.flags.writeable = False
+        return array
+    
+    @classmethod
+    def from_frames(cls, pivot, ratio=None, subtotals=None, grand_total=None):
+        """Từ pivot số (DataFrame, hoặc Series khi không có chiều cột) và pivot tỷ lệ cùng hình dạng"""
+        if isinstance(pivot, pd.Series):
+            changes = None if ratio is None else ratio.to_numpy(dtype=float)[:, None]
+            return cls(pivot.to_numpy(dtype=float)[:, None], pivot.index, pd.Index([pivot.name]),
+                       changes, has_columns=False, subtotals=subtotals, grand_total=grand_total)
+        changes = None if ratio is None else ratio.to_numpy(dtype=float)
+        return cls(pivot.to_numpy(dtype=float), pivot.index, pivot.columns, changes,
+                   subtotals=subtotals, grand_total=grand_total)
+    
+    @property
+    def shape(self):
+        return self.values.shape
+    
+    @property
+    def empty(self):
+        return self.values.size == 0
+    
+    @property
+    def column_labels(self):
+        """Nhãn cột để hiển thị"""
+        if not self.has_columns:
+            return ['Giá trị']
+        return [str(column) for column in self.columns]
+    
+    @property
+    def nbytes(self):
+        """Dung lượng ước tính (mảng số, nhãn, chuỗi hiển thị)"""
+        size = self.values.nbytes + self.totals.nbytes
+        if self.changes is not None:
+            size += self.changes.nbytes
+        size += self.index.memory_usage(deep=True) + self.columns.memory_usage(deep=True)
+        size += (self.values.size + len(self.totals)) * self.view_bytes_per_cell
+        for rollup in (self.subtotals, self.grand_total):
+            if rollup is not None:
+                size += rollup.nbytes
+        return int(size)
     
-    def get_current_file_info(self):
-        """Lấy thông tin file hiện tại"""
-        try:
-            metadata_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{self.metadata_file}"
-            headers = {"Authorization": f"token {self.github_token}"}
-            
-            response = requests.get(metadata_url, headers=headers)
-            
-            if response.status_code == 200:
-                file_data = response.json()
-                content = base64.b64decode(file_data['content']).decode()
-                metadata = json.loads(content)
-                return metadata
-            
-        except Exception as e:
-            st.warning(f"Không thể đọc metadata: {str(e)}")
-        
-        return None
+    def to_frame(self):
+        """Pivot số như pd.pivot_table (Series nếu không có chiều cột), không có cột Tổng"""
+        if not self.has_columns:
+            return pd.Series(self.values[:, 0].copy(), index=self.index, name=self.columns[0])
+        return pd.DataFrame(self.values.copy(), index=self.index, columns=self.columns)
     
-    def create_backup_of_current_file(self):
-        """Backup file hiện tại trước khi xóa"""
-        try:
-            current_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{self.current_data_file}"
-            headers = {"Authorization": f"token {self.github_token}"}
-            
-            response = requests.get(current_url, headers=headers)
-            
-            if response.status_code == 200:
-                file_data = response.json()
-                
-                current_metadata = self.get_current_file_info()
-                if current_metadata:
-                    upload_time = current_metadata.get('upload_time', datetime.now().isoformat())
-                    backup_timestamp = upload_time[:19].replace(':', '-').replace(' ', '_')
-                else:
-                    backup_timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-                
-                backup_filename = f"{self.backup_prefix}{backup_timestamp}.json"
-                
-                backup_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{backup_filename}"
-                
-                backup_payload = {
-                    "message": f"📦 Backup before new upload - {backup_timestamp}",
-                    "content": file_data['content'],
-                    "branch": "main"
-                }
-                
-                backup_response = requests.put(backup_url, headers=headers, json=backup_payload)
-                
-                if backup_response.status_code == 201:
-                    st.info(f"📦 Đã backup file cũ: {backup_filename}")
-                    return backup_filename
-                    
-        except Exception as e:
-            st.warning(f"Không thể backup file cũ: {str(e)}")
+    def to_report_frame(self):
+        """Pivot số kèm dòng tổng sau mỗi Danh mục và dòng Tổng cộng ở cuối (cho file xuất)"""
+        frame = self.to_frame()
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame()
+        names = list(frame.index.names)
         
-        return None
+        def total_label(first, second):
+            # Nhãn dòng tổng theo số cấp của index: (Danh mục, "Tổng ...", "", ...)
+            if len(names) == 1:
+                return first
+            return (first, second) + ('',) * (len(names) - 2)
+        
+        def labeled(values, label):
+            index = pd.MultiIndex.from_tuples([label], names=names) if len(names) > 1 else pd.Index([label], name=names[0])
+            return pd.DataFrame(values[None, :], index=index, columns=frame.columns)
+        
+        parts = []
+        if self.subtotals is not None:
+            categories = frame.index.get_level_values('Danh mục')
+            for position, category in enumerate(self.subtotals.index):
+                parts.append(frame[categories == category])
+                parts.append(labeled(self.subtotals.values[position],
+                                     total_label(category, f"Tổng {category}")))
+        else:
+            parts.append(frame)
+        
+        if self.grand_total is not None:
+            parts.append(labeled(self.grand_total.values[0], total_label(self.grand_total_label, '')))
+        return pd.concat(parts)
     
-    def cleanup_old_backups(self):
-        """Xóa các backup cũ, chỉ giữ lại số lượng nhất định"""
-        try:
-            contents_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents"
-            headers = {"Authorization": f"token {self.github_token}"}
-            
-            response = requests.get(contents_url, headers=headers)
-            
-            if response.status_code == 200:
-                files = response.json()
-                
-                backup_files = [f for f in files if f['name'].startswith(self.backup_prefix)]
-                backup_files.sort(key=lambda x: x['name'], reverse=True)
-                files_to_delete = backup_files[self.keep_backups:]
-                
-                deleted_count = 0
-                for file_to_delete in files_to_delete:
-                    try:
-                        delete_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{file_to_delete['name']}"
-                        
-                        delete_payload = {
-                            "message": f"🗑️ Auto cleanup old backup: {file_to_delete['name']}",
-                            "sha": file_to_delete['sha'],
-                            "branch": "main"
-                        }
-                        
-                        delete_response = requests.delete(delete_url, headers=headers, json=delete_payload)
-                        
-                        if delete_response.status_code == 200:
-                            deleted_count += 1
-                            
-                    except Exception as e:
-                        continue
-                
-                if deleted_count > 0:
-                    st.info(f"🗑️ Đã xóa {deleted_count} backup cũ")
-                    
-        except Exception as e:
-            st.warning(f"Không thể cleanup backups: {str(e)}")
+    def select(self, level, value):
+        """Các hàng có `level` == value, bỏ cấp đó khỏi index (vd. 1 danh mục)"""
+        positions = np.flatnonzero(self.index.get_level_values(level) == value)
+        index = self.index[positions]
+        if isinstance(index, pd.MultiIndex):
+            index = index.droplevel(level)
+        changes = None if self.changes is None else self.changes[positions]
+        return PivotResult(self.values[positions], index, self.columns, changes, self.has_columns)
     
-    def upload_new_file(self, data, filename):
-        """Upload file mới với auto-cleanup"""
+    def formatted(self):
+        """Bảng chuỗi hiển thị: số (+ biến động HTML nếu có) và cột Tổng"""
+        if self._view is None:
+            if self.changes is not None and not np.isnan(self.changes).all():
+                cells = PivotTableDashboard.format_values_with_change(self.values, self.changes)
+            else:
+                cells = PivotTableDashboard.format_numbers(self.values)
+            if self.has_columns:
+                cells = np.column_stack([cells, PivotTableDashboard.format_numbers(self.totals)])
+            cells.flags.writeable = False
+            self._view = cells
         
-        try:
-            connected, message = self.check_github_connection()
-            if not connected:
-                st.error(message)
-                return False
-            
-            st.info("🔄 Bắt đầu upload file mới...")
-            
-            with st.spinner("📦 Đang backup file cũ..."):
-                backup_filename = self.create_backup_of_current_file()
-            
-            with st.spinner("📊 Đang chuẩn bị dữ liệu..."):
-                new_data_package = {
-                    'data': data.to_dict('records'),
-                    'columns': list(data.columns),
-                    'metadata': {
-                        'filename': filename,
-                        'upload_time': datetime.now().isoformat(),
-                        'week_number': datetime.now().isocalendar()[1],
-                        'year': datetime.now().year,
-                        'row_count': len(data),
-                        'file_size_mb': round(len(str(data)) / (1024*1024), 2),
-                        'uploader': 'weekly_admin',
-                        'replaced_backup': backup_filename
-                    }
-                }
-                
-                json_content = json.dumps(new_data_package, ensure_ascii=False, indent=2)
-                size_mb = len(json_content.encode()) / (1024*1024)
-                
-                if size_mb > self.max_file_size_mb:
-                    st.error(f"❌ File quá lớn ({size_mb:.1f}MB). Giới hạn {self.max_file_size_mb}MB")
-                    return False
-            
-            with st.spinner("☁️ Đang upload file mới..."):
-                content_encoded = base64.b64encode(json_content.encode()).decode()
-                
-                current_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{self.current_data_file}"
-                headers = {"Authorization": f"token {self.github_token}"}
-                
-                current_response = requests.get(current_url, headers=headers)
-                current_sha = None
-                if current_response.status_code == 200:
-                    current_sha = current_response.json()['sha']
-                
-                upload_payload = {
-                    "message": f"📊 Weekly data update - Tuần {new_data_package['metadata']['week_number']}/{new_data_package['metadata']['year']}",
-                    "content": content_encoded,
-                    "branch": "main"
-                }
-                
-                if current_sha:
-                    upload_payload["sha"] = current_sha
-                
-                upload_response = requests.put(current_url, headers=headers, json=upload_payload)
-                
-                if upload_response.status_code not in [200, 201]:
-                    st.error(f"❌ Lỗi upload: {upload_response.status_code}")
-                    return False
-            
-            with st.spinner("📝 Đang cập nhật metadata..."):
-                self.update_metadata(new_data_package['metadata'])
-            
-            with st.spinner("🗑️ Đang dọn dẹp backup cũ..."):
-                self.cleanup_old_backups()
-            
-            st.success(f"""
-            🎉 **UPLOAD THÀNH CÔNG!**
-            
-            ✅ **File mới:** {filename}
-            ✅ **Dữ liệu:** {len(data):,} dòng ({size_mb:.1f}MB)
-            ✅ **Tuần:** {new_data_package['metadata']['week_number']}/{new_data_package['metadata']['year']}
-            ✅ **Backup:** {backup_filename if backup_filename else 'Không có file cũ'}
-            
-            📱 **Sếp có thể xem ngay trên điện thoại!**
-            """)
-            
-            return True
-            
-        except Exception as e:
-            st.error(f"❌ Lỗi upload: {str(e)}")
-            return False
+        labels = self.column_labels + (['Tổng'] if self.has_columns else [])
+        return pd.DataFrame(self._view.copy(), index=self.index, columns=labels)
+
+
+# ================== PIVOT CACHE ==================
+class PivotCache:
+    """
+    Cache LRU PivotResult, dùng chung cho mọi session trong process
+    - Key: (phiên bản dữ liệu, bộ lọc, rows, cols, values, agg_func, show_ratio_inline)
+    - Mỗi entry là 1 PivotResult: ma trận số + bảng hiển thị (tạo lần đầu rồi giữ lại)
+    - Giới hạn theo dung lượng bộ nhớ ước tính: vượt max_bytes -> bỏ entry ít dùng nhất
     
-    def update_metadata(self, metadata):
-        """Cập nhật file metadata"""
-        try:
-            metadata_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{self.metadata_file}"
-            headers = {"Authorization": f"token {self.github_token}"}
-            
-            current_response = requests.get(metadata_url, headers=headers)
-            current_sha = None
-            if current_response.status_code == 200:
-                current_sha = current_response.json()['sha']
-            
-            metadata_content = json.dumps(metadata, ensure_ascii=False, indent=2)
-            content_encoded = base64.b64encode(metadata_content.encode()).decode()
-            
-            payload = {
-                "message": f"📝 Update metadata - Tuần {metadata['week_number']}/{metadata['year']}",
-                "content": content_encoded,
-                "branch": "main"
-            }
-            
-            if current_sha:
-                payload["sha"] = current_sha
-            
-            requests.put(metadata_url, headers=headers, json=payload)
-            
-        except Exception as e:
-            st.warning(f"Không thể update metadata: {str(e)}")
+    PivotResult bất biến nên được trả thẳng cho các session, không cần copy.
+    """
     
-    def load_current_data(self):
-        """Load dữ liệu hiện tại"""
-        try:
-            current_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents/{self.current_data_file}"
-            headers = {"Authorization": f"token {self.github_token}"}
-            
-            response = requests.get(current_url, headers=headers)
-            
-            if response.status_code == 200:
-                file_data = response.json()
-                content = base64.b64decode(file_data['content']).decode()
-                data_package = json.loads(content)
-                
-                df = pd.DataFrame(data_package['data'], columns=data_package['columns'])
-                
-                return df, data_package['metadata']
-            
-        except Exception as e:
-            st.warning(f"Không thể load dữ liệu: {str(e)}")
-        
-        return None, None
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> (PivotResult, số byte), thứ tự chèn = LRU
+        self._bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
     
-    def get_storage_info(self):
-        """Lấy thông tin storage usage"""
-        try:
-            contents_url = f"https://api.github.com/repos/{self.github_owner}/{self.github_repo}/contents"
-            headers = {"Authorization": f"token {self.github_token}"}
-            
-            response = requests.get(contents_url, headers=headers)
-            
-            if response.status_code == 200:
-                files = response.json()
-                
-                total_size = sum(f.get('size', 0) for f in files)
-                backup_files = [f for f in files if f['name'].startswith(self.backup_prefix)]
-                
-                return {
-                    'total_files': len(files),
-                    'backup_files': len(backup_files),
-                    'total_size_mb': round(total_size / (1024*1024), 2),
-                    'files': files
-                }
-                
-        except Exception as e:
-            pass
+    @property
+    def size_bytes(self):
+        return self._bytes
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def get(self, key):
+        """PivotResult đã lưu, None nếu chưa có"""
+        with self._lock:
+            stored = self._entries.pop(key, None)
+            if stored is None:
+                self.stats['misses'] += 1
+                return None
+            # Đưa về cuối (mới dùng nhất)
+            self._entries[key] = stored
+            self.stats['hits'] += 1
+            return stored[0]
+    
+    def put(self, key, result):
+        """Lưu PivotResult; kết quả lớn hơn max_bytes không được lưu"""
+        size = result.nbytes
+        if size > self.max_bytes:
+            return
         
-        return None
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._bytes -= self._entries.pop(oldest)[1]
+                self.stats['evictions'] += 1
+    
+    def format_stats(self):
+        """Chuỗi ngắn gọn trạng thái cache cho sidebar"""
+        return (f"{self.stats['hits']} hit · {self.stats['misses']} miss · "
+                f"{len(self._entries)} bảng ({self._bytes / (1024*1024):.1f}MB)")
+
 
 # ================== PIVOT TABLE DASHBOARD CLASS (FULL ORIGINAL) ==================
 class PivotTableDashboard:
+    # Phiên bản cột tiền xử lý lưu trên storage - tăng khi đổi cột phụ hoặc cách tính
+    enriched_schema_version = 4
+    derived_columns = ['Quý', 'Tháng_Năm', 'Tuần_Tháng', 'Tỷ_lệ_tuần_trước', 'Thay_đổi_tuần_trước',
+                       'Nền_TB_4_tuần', 'Nền_cùng_tuần_năm_trước', 'Nền_tháng_trước']
+    
+    # Mức nền so sánh cho mũi tên biến động: key -> (cột nền theo dòng, nhãn hiển thị)
+    # 'previous' không có cột: so với kỳ liền trước trên trục thời gian của pivot (period_changes)
+    comparison_baselines = {
+        'previous': (None, 'Kỳ liền trước'),
+        'rolling_4w': ('Nền_TB_4_tuần', 'Trung bình 4 tuần trước'),
+        'last_year_week': ('Nền_cùng_tuần_năm_trước', 'Cùng tuần năm trước'),
+        'previous_month': ('Nền_tháng_trước', 'Tháng trước (TB/tuần)')
+    }
+    # Cách tính dùng được mức nền theo dòng (tổng số liệu so với tổng mức nền)
+    baseline_aggregations = ('sum', 'mean')
+    
+    # Nhãn kỳ đã format, dùng chung cho mọi lần load trong process
+    _period_label_cache = {}
+    
+    # FilterIndex theo DataFrame (id + weakref): dùng chung giữa các session / rerun
+    _filter_index_cache = {}
+    
     def __init__(self):
         self.data = None
+        self.preprocess_timings = {}
+        self.ingest_report = []
+        # Lần lọc gần nhất (kết quả + lựa chọn): pivot của kết quả này cắt thẳng từ rollup cube
+        self._last_filter = None
         
         # CẤU HÌNH THỨ TỰ ƯU TIÊN CỐ ĐỊNH THEO YÊU CẦU MỚI
         self.category_priority = {
@@ -604,132 +2733,400 @@ class PivotTableDashboard:
     def load_data(self, file_path):
         """Đọc dữ liệu từ file Excel và áp dụng thứ tự ưu tiên"""
         try:
-            # Đọc file từ đường dẫn local
-            if isinstance(file_path, str):
-                self.data = pd.read_excel(file_path)
-            else:
-                # Nếu là uploaded file
-                self.data = pd.read_excel(file_path)
-                
-            self.data.columns = self.data.columns.str.strip()
-            
-            # Chuyển đổi kiểu dữ liệu
-            self.data['Tuần'] = pd.to_numeric(self.data['Tuần'], errors='coerce')
-            self.data['Tháng'] = pd.to_numeric(self.data['Tháng'], errors='coerce')
-            self.data['Số liệu'] = pd.to_numeric(self.data['Số liệu'], errors='coerce')
-            
-            # Thêm cột năm (có thể điều chỉnh theo dữ liệu thực tế)
-            if 'Năm' not in self.data.columns:
-                self.data['Năm'] = datetime.now().year
-            
-            # Tạo cột Quý từ Tháng
-            self.data['Quý'] = ((self.data['Tháng'] - 1) // 3) + 1
-            
-            # Tạo cột kết hợp để dễ filter
-            self.data['Tháng_Năm'] = self.data.apply(lambda x: f"T{int(x['Tháng'])}/{int(x['Năm'])}", axis=1)
-            self.data['Tuần_Tháng'] = self.data.apply(lambda x: f"W{int(x['Tuần'])}-T{int(x['Tháng'])}", axis=1)
+            # Đường dẫn local hoặc uploaded file - mở lại cùng file thì lấy kết quả đã xử lý
+            self.build_enriched(file_path)
             
-            # ÁP DỤNG THỨ TỰ ƯU TIÊN
-            self._apply_priority_order()
+            return True
+        except Exception as e:
+            st.error(f"Lỗi khi đọc file: {str(e)}")
+            return False
+    
+    def load_bulk(self, source, all_sheets=False):
+        """Nạp nhiều file / sheet (thư mục, zip, nhiều file upload) rồi tiền xử lý 1 lần
+        
+        Thời gian và lỗi của từng file lưu ở self.ingest_report
+        """
+        try:
+            data, self.ingest_report = BulkExcelIngest(get_excel_reader()).ingest(source, all_sheets)
+            if data is None:
+                st.error("Không đọc được file nào trong nguồn dữ liệu")
+                return False
             
-            # TÍNH TỶ LỆ SO VỚI TUẦN TRƯỚC
-            self._calculate_week_over_week_ratio()
+            self.build_enriched(data)
             
             return True
         except Exception as e:
-            st.error(f"Lỗi khi đọc file: {str(e)}")
+            st.error(f"Lỗi khi đọc nhiều file: {str(e)}")
             return False
     
-    def load_data_from_dataframe(self, df):
-        """Load dữ liệu từ DataFrame đã có (cho weekly upload)"""
+    def load_data_from_dataframe(self, df, key=None):
+        """Load dữ liệu từ DataFrame đã có (cho weekly upload)
+        
+        key: định danh nội dung (sha trên GitHub) để dùng lại kết quả mà không cần hash
+        """
         try:
             if df is None or df.empty:
                 return False
             
-            self.data = df.copy()
-            self.data.columns = self.data.columns.str.strip()
+            self.build_enriched(df, key=key)
             
-            # Chuyển đổi kiểu dữ liệu
-            self.data['Tuần'] = pd.to_numeric(self.data['Tuần'], errors='coerce')
-            self.data['Tháng'] = pd.to_numeric(self.data['Tháng'], errors='coerce')
-            self.data['Số liệu'] = pd.to_numeric(self.data['Số liệu'], errors='coerce')
+            return True
             
-            # Thêm cột năm nếu chưa có
-            if 'Năm' not in self.data.columns:
-                self.data['Năm'] = datetime.now().year
+        except Exception as e:
+            st.error(f"Lỗi khi xử lý DataFrame: {str(e)}")
+            return False
+    
+    def build_enriched(self, source, key=None, use_cache=True):
+        """Tiền xử lý đầy đủ qua PreprocessPipeline (lỗi được raise ra ngoài)
+        
+        source: DataFrame hoặc file Excel. use_cache=False: không memo (dữ liệu dùng 1 lần, vd. upload)
+        """
+        pipeline = get_preprocess_pipeline() if use_cache else PreprocessPipeline()
+        self.data, self.preprocess_timings = pipeline.run(source, self, key=key, use_cache=use_cache)
+        return self.data
+    
+    def load_enriched_data(self, df):
+        """Load dữ liệu đã tiền xử lý lúc upload: không tính lại, chỉ nối thứ tự ưu tiên giữa các năm"""
+        try:
+            if df is None or df.empty:
+                return False
             
-            # Tạo cột Quý từ Tháng
-            self.data['Quý'] = ((self.data['Tháng'] - 1) // 3) + 1
+            # Ghép nhiều năm có categories khác nhau -> pandas trả về object, mã hóa lại
+            data = df
+            if not (isinstance(df['Danh mục'].dtype, pd.CategoricalDtype)
+                    and isinstance(df['Nội dung'].dtype, pd.CategoricalDtype)):
+                data = df.copy()
+                self._encode_priority(data)
+            if not isinstance(data['Tháng_Năm'].dtype, pd.CategoricalDtype):
+                data = data.copy() if data is df else data
+                self._add_period_labels(data)
+            
+            # Mỗi partition đã sort sẵn; sort ổn định để ghép các năm theo đúng thứ tự ưu tiên
+            self.data = data.sort_values([
+                'Danh mục',
+                'Nội dung',
+                'Năm',
+                'Tháng',
+                'Tuần'
+            ], kind='stable').reset_index(drop=True)
             
-            # Tạo cột kết hợp để dễ filter
-            self.data['Tháng_Năm'] = self.data.apply(lambda x: f"T{int(x['Tháng'])}/{int(x['Năm'])}", axis=1)
-            self.data['Tuần_Tháng'] = self.data.apply(lambda x: f"W{int(x['Tuần'])}-T{int(x['Tháng'])}", axis=1)
+            return True
             
-            # ÁP DỤNG THỨ TỰ ƯU TIÊN
+        except Exception as e:
+            st.error(f"Lỗi khi đọc dữ liệu đã xử lý: {str(e)}")
+            return False
+    
+    def load_stored_data(self, df, enriched, key=None):
+        """Dữ liệu từ storage: dùng thẳng bản đã tiền xử lý, file cũ thì xử lý lại"""
+        if enriched:
+            return self.load_enriched_data(df)
+        return self.load_data_from_dataframe(df, key=key)
+    
+    def _prepare_frame(self, df):
+        """Chuẩn hóa kiểu dữ liệu và tạo cột phụ (Năm, Quý, Tháng_Năm, Tuần_Tháng)"""
+        return self._stage_enrich(self._stage_coerce(self._stage_clean(df)))
+    
+    # ---------- Các bước của PreprocessPipeline: trả DataFrame mới, không sửa đầu vào ----------
+    def _stage_clean(self, df):
+        """Bỏ khoảng trắng ở tên cột, bỏ dòng trống hoàn toàn (dòng thừa cuối file Excel)"""
+        # Copy nông: dùng chung mảng dữ liệu, cột mới / cột gán lại không ảnh hưởng df
+        data = df.copy(deep=False)
+        data.columns = data.columns.str.strip()
+        
+        empty_rows = data.isna().all(axis=1).to_numpy()
+        if empty_rows.any():
+            data = data.loc[~empty_rows]
+        return data
+    
+    def _stage_coerce(self, df):
+        """Chuyển đổi kiểu dữ liệu, thêm cột Năm nếu chưa có"""
+        data = df.copy(deep=False)
+        data['Tuần'] = pd.to_numeric(data['Tuần'], errors='coerce')
+        data['Tháng'] = pd.to_numeric(data['Tháng'], errors='coerce')
+        data['Số liệu'] = pd.to_numeric(data['Số liệu'], errors='coerce')
+        
+        if 'Năm' not in data.columns:
+            data['Năm'] = datetime.now().year
+        return data
+    
+    def _stage_enrich(self, df):
+        """Cột Quý và nhãn kỳ (Tháng_Năm, Tuần_Tháng) để dễ filter"""
+        data = df.copy(deep=False)
+        data['Quý'] = ((data['Tháng'] - 1) // 3) + 1
+        self._add_period_labels(data)
+        return data
+    
+    def _stage_rank(self, df):
+        """Danh mục / Nội dung theo thứ tự ưu tiên, sắp xếp dữ liệu theo thứ tự đó"""
+        data = df.copy(deep=False)
+        self._encode_priority(data)
+        return data.sort_values([
+            'Danh mục',
+            'Nội dung',
+            'Năm',
+            'Tháng',
+            'Tuần'
+        ]).reset_index(drop=True)
+    
+    def _stage_ratios(self, df):
+        """Tỷ lệ, thay đổi so với tuần trước và các mức nền so sánh cho mọi dòng"""
+        data = df.copy(deep=False)
+        for column, values in self._comparison_arrays(data).items():
+            data[column] = values
+        return data
+    
+    def _add_period_labels(self, data):
+        """Tháng_Năm (T3/2025) và Tuần_Tháng (W12-T3) dạng Categorical, thứ tự theo kỳ"""
+        data['Tháng_Năm'] = self._period_label_column(data['Năm'], data['Tháng'], "T{minor}/{major}")
+        data['Tuần_Tháng'] = self._period_label_column(data['Tháng'], data['Tuần'], "W{minor}-T{major}")
+    
+    @classmethod
+    def _period_label_column(cls, major, minor, template):
+        """Nhãn kỳ vector hóa: chỉ format chuỗi cho từng cặp (major, minor) khác nhau
+        
+        Categories sắp theo (major, minor) thay vì theo chữ cái; thiếu giá trị -> NaN.
+        Nhãn đã format được giữ trong _period_label_cache cho các lần load sau.
+        """
+        major = pd.to_numeric(major, errors='coerce').to_numpy(dtype=float)
+        minor = pd.to_numeric(minor, errors='coerce').to_numpy(dtype=float)
+        valid = ~(np.isnan(major) | np.isnan(minor))
+        
+        # int() như bản cũ (cắt phần thập phân); 1 khóa số nguyên cho mỗi kỳ
+        major_int = major[valid].astype(np.int64)
+        minor_int = minor[valid].astype(np.int64)
+        # factorize (hash) rồi chỉ sort các kỳ khác nhau, không sort cả cột
+        keys, unique_keys = pd.factorize(major_int * 1000 + minor_int)
+        order = np.argsort(unique_keys)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        # 1 dòng đại diện cho mỗi kỳ (dòng nào cũng được, cùng giá trị)
+        first = np.empty(len(unique_keys), dtype=np.int64)
+        first[keys] = np.arange(len(keys))
+        
+        labels = []
+        for major_value, minor_value in zip(major_int[first[order]].tolist(), minor_int[first[order]].tolist()):
+            cache_key = (template, major_value, minor_value)
+            label = cls._period_label_cache.get(cache_key)
+            if label is None:
+                label = template.format(major=major_value, minor=minor_value)
+                cls._period_label_cache[cache_key] = label
+            labels.append(label)
+        
+        codes = np.full(len(major), -1, dtype=np.int64)
+        codes[valid] = rank[keys]
+        return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+    
+    def replace_years(self, years, rows):
+        """Thay dữ liệu của các năm `years` bằng `rows` (partition vừa đổi trên storage)
+        
+        Chỉ tính lại biến động cho các chuỗi (Danh mục, Nội dung) có dòng bị thay.
+        self.data được thay bằng DataFrame mới, không sửa DataFrame cũ tại chỗ.
+        """
+        try:
+            series_keys = ['Danh mục', 'Nội dung']
+            in_years = self.data['Năm'].isin(years)
+            affected = [self.data.loc[in_years, series_keys]]
+            frames = [self.data.loc[~in_years]]
+            
+            if rows is not None and not rows.empty:
+                new_rows = self._prepare_frame(rows)
+                affected.append(new_rows[series_keys])
+                frames.append(new_rows)
+            
+            self.data = pd.concat(frames, ignore_index=True)
+            self._add_period_labels(self.data)
             self._apply_priority_order()
             
-            # TÍNH TỶ LỆ SO VỚI TUẦN TRƯỚC
-            self._calculate_week_over_week_ratio()
+            affected = pd.concat(affected).drop_duplicates()
+            series_mask = pd.MultiIndex.from_frame(self.data[series_keys]).isin(
+                pd.MultiIndex.from_frame(affected)
+            )
+            self._calculate_week_over_week_ratio(series_mask)
             
             return True
             
         except Exception as e:
-            st.error(f"Lỗi khi xử lý DataFrame: {str(e)}")
+            st.error(f"Lỗi khi cập nhật dữ liệu theo năm: {str(e)}")
             return False
     
     def _apply_priority_order(self):
         """Áp dụng thứ tự ưu tiên cho danh mục và nội dung"""
-        # Thêm cột thứ tự ưu tiên cho danh mục
-        self.data['Danh_mục_thứ_tự'] = self.data['Danh mục'].map(self.category_priority)
-        
-        # Thêm cột thứ tự ưu tiên cho nội dung
-        self.data['Nội_dung_thứ_tự'] = self.data['Nội dung'].map(self.content_priority)
-        
-        # Gán thứ tự cao (999) cho các danh mục/nội dung không có trong danh sách ưu tiên
-        self.data['Danh_mục_thứ_tự'] = self.data['Danh_mục_thứ_tự'].fillna(999)
-        self.data['Nội_dung_thứ_tự'] = self.data['Nội_dung_thứ_tự'].fillna(999)
-        
-        # Sắp xếp dữ liệu theo thứ tự ưu tiên
-        self.data = self.data.sort_values([
-            'Danh_mục_thứ_tự', 
-            'Nội_dung_thứ_tự', 
-            'Năm', 
-            'Tháng', 
-            'Tuần'
-        ]).reset_index(drop=True)
+        self.data = self._stage_rank(self.data)
     
-    def _calculate_week_over_week_ratio(self):
-        """Tính tỷ lệ so với tuần trước - LOGIC MỚI"""
-        # Khởi tạo cột
-        self.data['Tỷ_lệ_tuần_trước'] = None
-        self.data['Thay_đổi_tuần_trước'] = None
-        
-        # Group theo danh mục và nội dung, sau đó tính biến động
-        for (category, content), group in self.data.groupby(['Danh mục', 'Nội dung']):
-            # Sắp xếp theo năm, tháng, tuần
-            group_sorted = group.sort_values(['Năm', 'Tháng', 'Tuần']).reset_index()
-            
-            # Bỏ qua tuần đầu tiên (không có tuần trước để so sánh)
-            for i in range(1, len(group_sorted)):
-                current_idx = group_sorted.loc[i, 'index']  # index gốc trong data
-                current_value = group_sorted.loc[i, 'Số liệu']
-                previous_value = group_sorted.loc[i-1, 'Số liệu']
-                
-                # Tính biến động
-                if pd.notna(current_value) and pd.notna(previous_value):
-                    if previous_value != 0:
-                        # Công thức: (tuần hiện tại - tuần trước) / tuần trước * 100
-                        ratio = ((current_value - previous_value) / previous_value) * 100
-                        change = current_value - previous_value
-                        
-                        self.data.loc[current_idx, 'Tỷ_lệ_tuần_trước'] = ratio
-                        self.data.loc[current_idx, 'Thay_đổi_tuần_trước'] = change
-                    elif previous_value == 0 and current_value > 0:
-                        # Tăng từ 0 lên số dương
-                        self.data.loc[current_idx, 'Tỷ_lệ_tuần_trước'] = 999.0  # Vô hạn
-                        self.data.loc[current_idx, 'Thay_đổi_tuần_trước'] = current_value
-                    # Trường hợp khác (0->0, hoặc giá trị âm) giữ None
+    def _encode_priority(self, data):
+        """Danh mục / Nội dung thành Categorical có thứ tự = thứ tự ưu tiên
+        
+        sort, groupby, pivot_table (observed=True) sẽ tự ra đúng thứ tự ưu tiên.
+        """
+        data['Danh mục'] = self._priority_categorical(data['Danh mục'], self.category_priority)
+        data['Nội dung'] = self._priority_categorical(data['Nội dung'], self.content_priority)
+    
+    @staticmethod
+    def _priority_categorical(values, priority):
+        """Categories = các mục trong danh sách ưu tiên, sau đó là mục lạ (xếp theo ABC)"""
+        known = sorted(priority, key=priority.get)
+        present = PivotTableDashboard.ordered_values(values) if isinstance(values.dtype, pd.CategoricalDtype) else values.dropna().unique()
+        unknown = sorted((item for item in present if item not in priority), key=str)
+        return pd.Categorical(values, categories=known + unknown, ordered=True)
+    
+    @property
+    def filter_index(self):
+        """FilterIndex của self.data, dựng 1 lần cho mỗi DataFrame"""
+        cache = PivotTableDashboard._filter_index_cache
+        entry = cache.get(id(self.data))
+        if entry is None or entry[0]() is not self.data:
+            # Bỏ index của DataFrame đã được giải phóng
+            for key in [key for key, (ref, _) in cache.items() if ref() is None]:
+                cache.pop(key, None)
+            entry = (weakref.ref(self.data), FilterIndex(self.data))
+            cache[id(self.data)] = entry
+        return entry[1]
+    
+    @staticmethod
+    def ordered_values(values):
+        """Các giá trị có trong cột, theo thứ tự categories (thứ tự ưu tiên)"""
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            return sorted(values.dropna().unique(), key=str)
+        codes = np.unique(values.cat.codes.to_numpy())
+        return values.cat.categories[codes[codes >= 0]].tolist()
+    
+    def _calculate_week_over_week_ratio(self, series_mask=None):
+        """Tính tỷ lệ so với tuần trước và các mức nền so sánh - vector hóa, 1 lần sort cho toàn bộ chuỗi
+        
+        series_mask: chỉ tính lại các dòng được chọn (phải gồm trọn chuỗi), giữ nguyên phần còn lại
+        """
+        columns = self.comparison_columns()
+        if series_mask is not None and all(column in self.data.columns for column in columns):
+            rows = np.flatnonzero(series_mask)
+            results = {column: self.data[column].to_numpy(copy=True) for column in columns}
+            for column, values in self._comparison_arrays(self.data.iloc[rows]).items():
+                results[column][rows] = values
+        else:
+            results = self._comparison_arrays(self.data)
+        
+        # Ô không có biến động / mức nền (tuần đầu tiên, 0->0, 0->âm, thiếu số liệu) để NaN
+        for column, values in results.items():
+            self.data[column] = values
+    
+    @classmethod
+    def comparison_columns(cls):
+        """Các cột do _comparison_arrays tính"""
+        baselines = [column for column, _ in cls.comparison_baselines.values() if column]
+        return ['Tỷ_lệ_tuần_trước', 'Thay_đổi_tuần_trước'] + baselines
+    
+    @staticmethod
+    def _comparison_arrays(data):
+        """Tỷ lệ %, thay đổi so với tuần liền trước và các mức nền so sánh cho mọi dòng
+        
+        Mỗi chuỗi là một cặp (Danh mục, Nội dung), sắp xếp 1 lần theo Năm, Tháng, Tuần; mọi mức nền
+        tính trên các mảng đã sắp đó:
+        - Nền_TB_4_tuần: trung bình 4 dòng (tuần) liền trước của chuỗi (tổng trượt bằng cumsum)
+        - Nền_cùng_tuần_năm_trước: số liệu cùng số tuần của năm trước
+        - Nền_tháng_trước: trung bình 1 tuần của tháng liền trước
+        Kết quả là dict cột -> mảng theo đúng thứ tự dòng của `data` (mức nền: float32).
+        """
+        n = len(data)
+        ratio = np.full(n, np.nan)
+        change = np.full(n, np.nan)
+        baselines = {
+            'Nền_TB_4_tuần': np.full(n, np.nan, dtype=np.float32),
+            'Nền_cùng_tuần_năm_trước': np.full(n, np.nan, dtype=np.float32),
+            'Nền_tháng_trước': np.full(n, np.nan, dtype=np.float32)
+        }
+        results = {'Tỷ_lệ_tuần_trước': ratio, 'Thay_đổi_tuần_trước': change, **baselines}
+        if n == 0:
+            return results
+
+        # Sort 1 lần (stable) theo chuỗi rồi theo thời gian
+        series_id = data.groupby(['Danh mục', 'Nội dung'], sort=False, observed=True).ngroup().to_numpy()
+        years = pd.to_numeric(data['Năm'], errors='coerce').to_numpy(dtype=float)
+        months = data['Tháng'].to_numpy(dtype=float)
+        weeks = data['Tuần'].to_numpy(dtype=float)
+        order = np.lexsort((weeks, months, years, series_id))
+
+        sorted_series = series_id[order]
+        current = data['Số liệu'].to_numpy(dtype=float)[order]
+        previous = np.empty(n)
+        previous[0] = np.nan
+        previous[1:] = current[:-1]
+
+        # Dòng đầu mỗi chuỗi (và dòng thiếu Danh mục/Nội dung) không có tuần trước
+        same_series = np.zeros(n, dtype=bool)
+        same_series[1:] = sorted_series[1:] == sorted_series[:-1]
+        previous[~same_series | (sorted_series < 0)] = np.nan
+
+        valid = ~np.isnan(current) & ~np.isnan(previous)
+        nonzero = valid & (previous != 0)
+        # Tăng từ 0 lên số dương -> vô hạn (999)
+        from_zero = valid & (previous == 0) & (current > 0)
+
+        sorted_ratio = np.full(n, np.nan)
+        sorted_change = np.full(n, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Công thức: (tuần hiện tại - tuần trước) / tuần trước * 100
+            sorted_ratio[nonzero] = (current[nonzero] - previous[nonzero]) / previous[nonzero] * 100
+        sorted_change[nonzero] = current[nonzero] - previous[nonzero]
+        sorted_ratio[from_zero] = 999.0
+        sorted_change[from_zero] = current[from_zero]
+
+        ratio[order] = sorted_ratio
+        change[order] = sorted_change
+        
+        # Trung bình 4 tuần trước: tổng / số dòng có số liệu trong cửa sổ, không vượt qua đầu chuỗi
+        position = np.arange(n)
+        present = ~np.isnan(current)
+        series_start = np.maximum.accumulate(np.where(same_series, 0, position))
+        cum_sum = np.concatenate(([0.0], np.cumsum(np.where(present, current, 0.0))))
+        cum_count = np.concatenate(([0], np.cumsum(present)))
+        window_start = np.maximum(position - 4, series_start)
+        window_count = cum_count[position] - cum_count[window_start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rolling = (cum_sum[position] - cum_sum[window_start]) / window_count
+        rolling[(window_count == 0) | (sorted_series < 0)] = np.nan
+        baselines['Nền_TB_4_tuần'][order] = rolling
+        
+        # Cùng tuần năm trước / tháng trước: trung bình theo khóa (chuỗi, kỳ), tra khóa của kỳ so sánh
+        sorted_years = years[order]
+        keyed = (sorted_series >= 0) & ~np.isnan(sorted_years)
+        series_key = np.where(keyed, sorted_series, 0).astype(np.int64) * 100000
+        year_number = np.where(keyed, sorted_years, 0).astype(np.int64)
+        
+        sorted_weeks = weeks[order]
+        week_keyed = keyed & ~np.isnan(sorted_weeks)
+        week_key = (series_key + year_number) * 100 + np.where(week_keyed, sorted_weeks, 0).astype(np.int64)
+        baselines['Nền_cùng_tuần_năm_trước'][order] = PivotTableDashboard._lookup_period_mean(
+            week_key, week_key - 100, current, week_keyed
+        )
+        
+        sorted_months = months[order]
+        month_keyed = keyed & ~np.isnan(sorted_months)
+        month_number = year_number * 12 + np.where(month_keyed, sorted_months, 1).astype(np.int64) - 1
+        month_key = series_key * 1000 + month_number
+        baselines['Nền_tháng_trước'][order] = PivotTableDashboard._lookup_period_mean(
+            month_key, month_key - 1, current, month_keyed
+        )
+        return results
     
+    @staticmethod
+    def _lookup_period_mean(keys, targets, values, valid):
+        """Trung bình `values` của các dòng có khóa = targets[i] (NaN nếu không có dòng nào)"""
+        result = np.full(len(keys), np.nan)
+        if not valid.any():
+            return result
+        
+        unique_keys, inverse = np.unique(keys[valid], return_inverse=True)
+        present = ~np.isnan(values[valid])
+        sums = np.bincount(inverse, weights=np.where(present, values[valid], 0.0), minlength=len(unique_keys))
+        counts = np.bincount(inverse, weights=present, minlength=len(unique_keys))
+        
+        wanted = targets[valid]
+        positions = np.minimum(np.searchsorted(unique_keys, wanted), len(unique_keys) - 1)
+        found = (unique_keys[positions] == wanted) & (counts[positions] > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(found, sums[positions] / counts[positions], np.nan)
+        result[valid] = means
+        return result
+
     def create_pivot_settings(self):
         """Tạo cài đặt cho pivot table"""
         st.sidebar.header("⚙️ Cài đặt Pivot Table")
@@ -780,7 +3177,18 @@ class PivotTableDashboard:
         # Hiển thị biến động gộp vào giá trị
         show_ratio_inline = st.sidebar.checkbox("Hiển thị biến động trong giá trị", value=True)
         
-        return report_type, rows, cols, values, agg_func, show_ratio_inline
+        # Mức nền cho mũi tên biến động
+        comparison = 'previous'
+        if show_ratio_inline:
+            comparison = st.sidebar.selectbox(
+                "So sánh biến động với",
+                list(self.comparison_baselines),
+                format_func=lambda key: self.comparison_baselines[key][1],
+                help="Mức nền theo dòng (4 tuần, năm trước, tháng trước) áp dụng cho phép tính Tổng / Trung bình; "
+                     "phép tính khác so với kỳ liền trước"
+            )
+        
+        return report_type, rows, cols, values, agg_func, show_ratio_inline, comparison
     
     def _get_default_rows(self, report_type):
         """Lấy dòng mặc định theo kiểu báo cáo"""
@@ -806,15 +3214,18 @@ class PivotTableDashboard:
         """Tạo bộ lọc dữ liệu"""
         st.sidebar.header("🔍 Lọc dữ liệu")
         
-        # Lọc theo thời gian
+        # Lọc theo thời gian: tính ngược từ kỳ mới nhất của các năm đang chọn
         time_range = st.sidebar.select_slider(
             "Khoảng thời gian",
-            options=["1 Tuần", "1 Tháng", "3 Tháng", "6 Tháng", "1 Năm", "Tất cả"],
+            options=list(FilterIndex.time_ranges),
             value="1 Tháng"
         )
         
+        # Option của các bộ lọc đọc từ index (không quét lại dữ liệu)
+        index = self.filter_index
+        
         # Lọc theo năm
-        years = sorted(self.data['Năm'].unique())
+        years = index.options('Năm')
         selected_years = st.sidebar.multiselect(
             "Chọn năm",
             years,
@@ -823,7 +3234,7 @@ class PivotTableDashboard:
         
         # Lọc theo tháng
         if len(selected_years) == 1:
-            months = sorted(self.data[self.data['Năm'].isin(selected_years)]['Tháng'].unique())
+            months = index.options('Tháng', {'Năm': selected_years}, time_range)
             selected_months = st.sidebar.multiselect(
                 "Chọn tháng",
                 months,
@@ -834,10 +3245,7 @@ class PivotTableDashboard:
         
         # Lọc theo tuần
         if len(selected_years) == 1 and len(selected_months) == 1:
-            available_weeks = sorted(self.data[
-                (self.data['Năm'].isin(selected_years)) & 
-                (self.data['Tháng'].isin(selected_months))
-            ]['Tuần'].unique())
+            available_weeks = index.options('Tuần', {'Năm': selected_years, 'Tháng': selected_months}, time_range)
             
             selected_weeks = st.sidebar.multiselect(
                 "Chọn tuần",
@@ -845,59 +3253,252 @@ class PivotTableDashboard:
                 default=available_weeks
             )
         else:
-            selected_weeks = list(range(1, 53))
+            selected_weeks = list(range(1, 53))
+        
+        # Lọc theo danh mục - cây Danh mục → Nội dung dựng sẵn theo thứ tự ưu tiên
+        hierarchy = index.hierarchy
+        
+        selected_categories = []
+        
+        with st.sidebar.expander("📂 Chọn danh mục", expanded=True):
+            select_all = st.checkbox("Chọn tất cả danh mục", value=True)
+            
+            if select_all:
+                selected_categories = [category for category, _, _ in hierarchy]
+            else:
+                for category, category_rows, contents in hierarchy:
+                    # Checkbox cho danh mục cha
+                    category_selected = st.checkbox(
+                        f"📁 {category} ({category_rows:,} dòng)", 
+                        value=False,
+                        key=f"cat_{category}"
+                    )
+                    
+                    if category_selected:
+                        selected_categories.append(category)
+                        
+                        # Hiển thị nội dung con theo thứ tự ưu tiên
+                        st.markdown(f"**Nội dung trong {category}:**")
+                        for content, content_rows in contents:
+                            st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;📄 {content} ({content_rows:,})", unsafe_allow_html=True)
+        
+        # Lọc theo nội dung: tìm không dấu, chọn vài mục trước khi tính pivot
+        with st.sidebar.expander("📄 Chọn nội dung", expanded=False):
+            query = st.text_input("🔎 Tìm nội dung (gõ không dấu cũng được)", key="content_search")
+            matches = index.search_contents(query, selected_categories)
+            # Mục đã chọn luôn nằm trong option dù không khớp từ khóa mới
+            previous = [content for content in st.session_state.get('content_filter', []) if content not in matches]
+            selected_contents = st.multiselect(
+                f"Nội dung ({len(matches)} mục khớp, để trống = tất cả)",
+                previous + matches,
+                key="content_filter"
+            )
+        
+        return time_range, selected_years, selected_months, selected_weeks, selected_categories, selected_contents
+    
+    def filter_data(self, time_range, years, months, weeks, categories, contents=None):
+        """Áp dụng bộ lọc - AND các mask đã cache trong FilterIndex
+        
+        Không lọc gì -> trả về chính self.data (chỉ đọc, không sửa tại chỗ)
+        """
+        # Lọc theo khoảng thời gian, năm, tháng, tuần, danh mục (+ nội dung nếu có chọn)
+        selections = {
+            'Năm': years,
+            'Tháng': months,
+            'Tuần': weeks,
+            'Danh mục': categories
+        }
+        if contents:
+            selections['Nội dung'] = contents
+        filtered = self.filter_index.filter(selections, time_range)
+        self._last_filter = {'data': filtered, 'selections': selections, 'time_range': time_range}
+        return filtered
+    
+    def _filter_query(self, data):
+        """Bộ lọc đã cho ra `data` ({'selections', 'time_range'}); None nếu không phải dữ liệu của dashboard"""
+        if self.data is None:
+            return None
+        if data is self.data:
+            return {'selections': {}, 'time_range': None}
+        if self._last_filter is not None and data is self._last_filter['data']:
+            return self._last_filter
+        return None
+    
+    def pivot_cache_key(self, data, rows, cols, values, agg_func, show_ratio_inline, comparison='previous'):
+        """Key PivotCache cho pivot của `data`; None = không cache được (dữ liệu không rõ nguồn gốc)"""
+        query = self._filter_query(data)
+        if query is None:
+            return None
+        # Thứ tự chọn trong widget không đổi kết quả -> so sánh như tập hợp
+        selections = tuple(sorted(
+            (column, frozenset(selected)) for column, selected in query['selections'].items()
+        ))
+        return (self.filter_index.version, selections, query['time_range'],
+                tuple(rows), tuple(cols), values, agg_func, bool(show_ratio_inline), comparison)
+    
+    def aggregate(self, data, rows, cols, values='Số liệu', agg_func='sum', contents=None, fill_value=0):
+        """Pivot số của `data` như pd.pivot_table (không có cols -> Series theo rows)
+        
+        data là self.data hoặc kết quả filter_data gần nhất -> cắt từ rollup cube theo bộ lọc đã chọn;
+        chiều / phép tính khác (Tùy chỉnh) -> pivot trên dòng thô
+        contents: chỉ lấy các Nội dung này
+        """
+        query = self._filter_query(data)
+        if query is not None and self.filter_index.cube.supports(rows, cols, values, agg_func):
+            selections = dict(query['selections'])
+            if contents is not None:
+                chosen = set(selections.get('Nội dung', contents))
+                selections['Nội dung'] = [content for content in contents if content in chosen]
+            return self.filter_index.cube.pivot(rows, cols, agg_func, selections, query['time_range'], fill_value)
+        
+        if contents is not None:
+            data = data[data['Nội dung'].isin(contents)]
+        if rows:
+            grouped = data.groupby(list(rows) + list(cols), observed=True)[values].agg(agg_func)
+            return RollupCube.reshape(grouped, cols, fill_value)
+        
+        # Chỉ có chiều cột: pivot_table ra 1 dòng
+        return pd.pivot_table(data, columns=cols, values=values, aggfunc=agg_func,
+                              fill_value=fill_value, observed=True)
+    
+    def period_context(self, data, visible, rows, cols, values='Số liệu', agg_func='sum'):
+        """Pivot cùng bộ lọc nhưng bỏ khoảng thời gian (ô thiếu = NaN), lấy từ rollup cube
+        
+        Dùng cho period_changes: kỳ đầu tiên đang hiển thị vẫn so được với kỳ liền trước.
+        visible: pivot đang hiển thị (aggregate của data, ô thiếu = NaN)
+        None nếu data không bị giới hạn theo khoảng thời gian, pivot không lấy được từ cube, hoặc
+        các kỳ đang hiển thị không trọn vẹn (vd. 1 tháng của quý: không so với cả quý trước).
+        """
+        query = self._filter_query(data)
+        if query is None or not self.filter_index.cube.supports(rows, cols, values, agg_func):
+            return None
+        if self.filter_index.time_bounds(query['time_range'], query['selections'].get('Năm')) is None:
+            return None
+        
+        context = self.filter_index.cube.pivot(rows, cols, agg_func, self._context_selections(query), None,
+                                               fill_value=None)
+        if isinstance(visible, pd.Series):
+            aligned = context.reindex(visible.index)
+        else:
+            aligned = context.reindex(index=visible.index, columns=visible.columns)
+        if not np.array_equal(aligned.to_numpy(dtype=float), visible.to_numpy(dtype=float), equal_nan=True):
+            return None
+        return context
+    
+    def _context_selections(self, query):
+        """Bộ lọc cho period_context: bỏ lọc Tháng / Tuần chỉ do khoảng thời gian sinh ra
+        
+        create_filters mặc định chọn đúng các tháng / tuần nằm trong time_range (vd. "1 Tháng" -> tuần 49..52);
+        giữ nguyên lọc đó thì kỳ liền trước kỳ đầu tiên bị loại khỏi context. Lọc hẹp hơn do người dùng chọn được giữ.
+        """
+        index = self.filter_index
+        selections = dict(query['selections'])
+        within = {'Năm': selections['Năm']} if 'Năm' in selections else {}
+        for column in ('Tháng', 'Tuần'):
+            selected = selections.get(column)
+            if selected is None or column not in index.indexed_columns:
+                continue
+            implied = index.options(column, within, query['time_range'])
+            if set(implied) <= set(selected):
+                selections.pop(column)
+            else:
+                within[column] = selected
+        return selections
+    
+    @staticmethod
+    def _previous_periods(labels, time_levels):
+        """Vị trí nhãn của kỳ liền trước cho từng nhãn trên 1 trục pivot (-1 = không có)
+        
+        Nhãn giống nhau ở các chiều không phải thời gian tạo thành 1 chuỗi, sắp theo các chiều thời gian
+        """
+        frame = labels.to_frame(index=False)
+        names = list(frame.columns)
+        time = [name for name in names if name in time_levels]
+        other = [name for name in names if name not in time_levels]
+        frame['_position'] = np.arange(len(frame))
+        
+        ordered = frame.sort_values(other + time, kind='stable')
+        if other:
+            previous = ordered.groupby(other, observed=True, sort=False, dropna=False)['_position'].shift(1)
+        else:
+            previous = ordered['_position'].shift(1)
         
-        # Lọc theo danh mục - Hiển thị theo thứ tự ưu tiên
-        unique_categories = self.data['Danh mục'].unique()
+        result = np.full(len(frame), -1, dtype=np.int64)
+        result[ordered['_position'].to_numpy()] = previous.fillna(-1).to_numpy(dtype=np.int64)
+        return result
+    
+    @classmethod
+    def period_changes(cls, pivot, context=None):
+        """% thay đổi của từng ô so với kỳ liền trước trên trục thời gian của pivot (NaN = không có)
         
-        # Sắp xếp danh mục theo thứ tự ưu tiên
-        sorted_categories = sorted(unique_categories, 
-                                 key=lambda x: self.category_priority.get(x, 999))
+        pivot: pivot số, ô thiếu = NaN (không fill 0, để kỳ không có số liệu không thành "tăng từ 0")
+        Trục thời gian: trục cột nếu có chiều thời gian, ngược lại trục dòng; không có -> None.
+        Dịch 1 kỳ trên chính ma trận đã gộp nên đúng cho mọi agg_func: tuần / tháng / quý / năm
+        cho ra WoW, MoM, QoQ, YoY. Công thức như Tỷ_lệ_tuần_trước: tăng từ 0 lên số dương -> 999.
+        context: pivot cùng chiều phủ nhiều kỳ hơn (period_context) để tìm kỳ trước kỳ đầu tiên
+        """
+        time_levels = set(RollupCube.grains['week'])
+        frame = pivot.to_frame() if isinstance(pivot, pd.Series) else pivot
+        if any(name in time_levels for name in frame.columns.names):
+            transpose = False
+        elif any(name in time_levels for name in frame.index.names):
+            transpose = True
+        else:
+            return None
         
-        selected_categories = []
+        # Trục thời gian đặt theo chiều cột
+        frame = frame.T if transpose else frame
+        base = frame
+        if context is not None:
+            context = context.to_frame() if isinstance(context, pd.Series) else context
+            context = (context.T if transpose else context).reindex(index=frame.index)
+            if context.columns.get_indexer(frame.columns).min(initial=0) >= 0:
+                base = context
         
-        with st.sidebar.expander("📂 Chọn danh mục", expanded=True):
-            select_all = st.checkbox("Chọn tất cả danh mục", value=True)
-            
-            if select_all:
-                selected_categories = list(sorted_categories)
-            else:
-                for category in sorted_categories:
-                    # Lấy danh sách nội dung trong danh mục này (đã sắp xếp)
-                    contents_in_category = self.data[self.data['Danh mục'] == category]['Nội dung'].unique()
-                    sorted_contents = sorted(contents_in_category, 
-                                           key=lambda x: self.content_priority.get(x, 999))
-                    
-                    # Checkbox cho danh mục cha
-                    category_selected = st.checkbox(
-                        f"📁 {category}", 
-                        value=False,
-                        key=f"cat_{category}"
-                    )
-                    
-                    if category_selected:
-                        selected_categories.append(category)
-                        
-                        # Hiển thị nội dung con theo thứ tự ưu tiên
-                        st.markdown(f"**Nội dung trong {category}:**")
-                        for content in sorted_contents:
-                            st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;📄 {content}", unsafe_allow_html=True)
+        previous_of = cls._previous_periods(base.columns, time_levels)[base.columns.get_indexer(frame.columns)]
+        base_values = base.to_numpy(dtype=float)
+        previous = np.where(previous_of >= 0, base_values[:, np.maximum(previous_of, 0)], np.nan)
+        ratio = cls.percent_change(frame.to_numpy(dtype=float), previous)
         
-        return time_range, selected_years, selected_months, selected_weeks, selected_categories
+        changes = pd.DataFrame(ratio, index=frame.index, columns=frame.columns)
+        changes = changes.T if transpose else changes
+        return changes.iloc[:, 0] if isinstance(pivot, pd.Series) else changes
     
-    def filter_data(self, time_range, years, months, weeks, categories):
-        """Áp dụng bộ lọc"""
-        filtered = self.data.copy()
+    @staticmethod
+    def percent_change(current, previous):
+        """% thay đổi current so với previous (mảng cùng hình dạng), công thức như Tỷ_lệ_tuần_trước
         
-        # Lọc theo năm, tháng, tuần, danh mục
-        filtered = filtered[
-            (filtered['Năm'].isin(years)) &
-            (filtered['Tháng'].isin(months)) &
-            (filtered['Tuần'].isin(weeks)) &
-            (filtered['Danh mục'].isin(categories))
-        ]
+        NaN khi thiếu 1 trong 2 hoặc 0 -> 0 / âm; tăng từ 0 lên số dương -> 999
+        """
+        valid = ~np.isnan(current) & ~np.isnan(previous)
+        nonzero = valid & (previous != 0)
+        from_zero = valid & (previous == 0) & (current > 0)
+        ratio = np.full(current.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio[nonzero] = (current[nonzero] - previous[nonzero]) / previous[nonzero] * 100
+        ratio[from_zero] = 999.0
+        return ratio
+    
+    def baseline_pivots(self, data, rows, cols, baseline):
+        """(tổng số liệu, tổng mức nền) theo (rows, cols) của các dòng có cả số liệu và mức nền `baseline`
         
-        return filtered
+        Cắt từ rollup cube khi được (như aggregate), ngược lại gộp trên dòng thô.
+        None nếu dữ liệu không có cột mức nền này hoặc pivot không có chiều dòng.
+        """
+        column = self.comparison_baselines[baseline][0]
+        if not rows or column is None or column not in data.columns:
+            return None
+        
+        query = self._filter_query(data)
+        cube = self.filter_index.cube if query is not None else None
+        if cube is not None and baseline in cube.baselines and cube.supports(rows, cols, 'Số liệu', 'sum'):
+            return cube.compare(rows, cols, baseline, query['selections'], query['time_range'])
+        
+        both = data['Số liệu'].notna() & data[column].notna()
+        grouped = data.loc[both].groupby(list(rows) + list(cols), observed=True)[['Số liệu', column]].sum()
+        current = RollupCube.reshape(grouped['Số liệu'], cols, None)
+        base = RollupCube.reshape(grouped[column].astype(float).rename('Số liệu'), cols, None)
+        return current, base
     
     def format_value_with_change(self, value, ratio, change):
         """Định dạng giá trị với biến động inline - CẢI TIẾN ĐỂ HIỂN THỊ RÕ RÀNG HƠN"""
@@ -925,130 +3526,174 @@ class PivotTableDashboard:
         # FORMAT RÕ RÀNG: số (biến động)
         return f"{value_str} <span class='{color_class}'>({symbol}{ratio_text})</span>"
     
-    def create_hierarchical_pivot_table_with_ratio(self, data, rows, cols, values, agg_func, show_ratio_inline):
-        """Tạo pivot table với hiển thị phân cấp và biến động inline"""
+    @staticmethod
+    def format_numbers(values):
+        """Định dạng cả mảng số như f"{v:,.0f}" với dấu chấm ngăn nghìn: 1234567.4 -> '1.234.567'
+        
+        Vector hóa: chữ số được nhóm 3 bằng thao tác trên mảng ký tự, không lặp từng ô
+        """
+        values = np.asarray(values, dtype=float)
+        flat = values.ravel()
+        if flat.size == 0:
+            return np.empty(values.shape, dtype=object)
+        
+        finite = np.isfinite(flat)
+        rounded = np.round(np.where(finite, flat, 0))
+        digits = np.abs(rounded).astype(np.int64).astype(str)
+        
+        # Thêm số 0 bên trái cho đủ bội số của 3 rồi chèn '.' sau mỗi nhóm
+        groups = -(-(digits.dtype.itemsize // 4) // 3)
+        chars = np.char.zfill(digits, groups * 3).astype(f'<U{groups * 3}').view('<U1').reshape(-1, groups, 3)
+        dotted = np.full((flat.size, groups, 4), '.', dtype='<U1')
+        dotted[:, :, :3] = chars
+        text = np.ascontiguousarray(dotted.reshape(flat.size, groups * 4)[:, :-1]).view(f'<U{groups * 4 - 1}').ravel()
+        text = np.char.lstrip(text, '0.')
+        text = np.where(text == '', '0', text)
+        
+        # Dấu âm (kể cả -0 như f-string) và nan / inf
+        text = np.where(np.signbit(rounded), np.char.add('-', text), text)
+        text = np.where(finite, text, np.char.mod('%.0f', flat))
+        return text.astype(object).reshape(values.shape)
+    
+    @classmethod
+    def format_values_with_change(cls, values, ratios):
+        """format_value_with_change cho cả mảng giá trị và mảng tỷ lệ biến động cùng hình dạng"""
+        value_text = cls.format_numbers(values).astype(str)
+        ratios = np.asarray(ratios, dtype=float)
+        
+        percent = np.char.mod('%.1f', np.abs(ratios))
+        opening = np.where(ratios > 0, " <span class='positive-change'>(↑", " <span class='negative-change'>(↓")
+        changed = np.char.add(np.char.add(np.char.add(value_text, opening), percent), "%)</span>")
+        infinite = np.char.add(value_text, " <span class='positive-change'>↑∞%</span>")
+        
+        has_change = ~np.isnan(ratios) & (ratios != 0)
+        text = np.where(ratios == 999, infinite, np.where(has_change, changed, value_text))
+        return text.astype(object)
+    
+    def create_hierarchical_pivot_table_with_ratio(self, data, rows, cols, values, agg_func, show_ratio_inline,
+                                                   comparison='previous'):
+        """Tạo pivot (PivotResult: ma trận số + biến động, chuỗi hiển thị tạo khi cần)
+        
+        Kết quả dùng chung qua PivotCache: cùng dữ liệu + bộ lọc + cài đặt pivot -> không tính lại
+        """
         try:
             if not rows and not cols:
                 st.warning("Vui lòng chọn ít nhất một chiều cho dòng hoặc cột")
                 return None
             
-            # Đảm bảo dữ liệu đã được sắp xếp theo thứ tự ưu tiên
-            if 'Danh mục' in rows:
-                data = data.sort_values(['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'])
-            
-            # Tạo pivot table cho giá trị chính (KHÔNG margins=True để bỏ tổng chung)
-            if cols:
-                pivot = pd.pivot_table(
-                    data,
-                    index=rows if rows else None,
-                    columns=cols,
-                    values=values,
-                    aggfunc=agg_func,
-                    fill_value=0,
-                    margins=False  # BỎ TỔNG CHUNG
-                )
-                
-                # Sửa lỗi mixed column types
-                if isinstance(pivot.columns, pd.MultiIndex):
-                    pivot.columns = pivot.columns.map(str)
-                else:
-                    pivot.columns = [str(col) for col in pivot.columns]
-                    
-            else:
-                pivot = data.groupby(rows)[values].agg(agg_func)
+            cache = get_pivot_cache()
+            key = self.pivot_cache_key(data, rows, cols, values, agg_func, show_ratio_inline, comparison)
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached
             
-            # Nếu cần hiển thị biến động inline
-            if show_ratio_inline and cols:
-                # Lọc dữ liệu có biến động (không phải tuần đầu tiên)
-                ratio_data = data[pd.notna(data['Tỷ_lệ_tuần_trước'])].copy()
-                
-                st.sidebar.success(f"🔍 Debug: {len(ratio_data)} dòng có biến động từ {len(data)} dòng tổng")
-                
-                if not ratio_data.empty:
-                    try:
-                        # Tạo pivot table cho giá trị gốc
-                        main_pivot = pd.pivot_table(
-                            data,
-                            index=rows if rows else None,
-                            columns=cols,
-                            values='Số liệu',
-                            aggfunc=agg_func,
-                            fill_value=0,
-                            margins=False
-                        )
-                        
-                        # Tạo pivot table cho tỷ lệ biến động
-                        ratio_pivot = pd.pivot_table(
-                            ratio_data,
-                            index=rows if rows else None,
-                            columns=cols,
-                            values='Tỷ_lệ_tuần_trước',
-                            aggfunc='mean',  # Trung bình nếu có nhiều giá trị
-                            fill_value=None
-                        )
-                        
-                        st.sidebar.success(f"🔍 Ratio pivot: {ratio_pivot.shape}, Main pivot: {main_pivot.shape}")
-                        
-                        # Tạo combined pivot với biến động
-                        combined_pivot = main_pivot.copy()
-                        
-                        # Áp dụng biến động cho từng ô
-                        for idx in main_pivot.index:
-                            for col in main_pivot.columns:
-                                main_value = main_pivot.loc[idx, col]
-                                
-                                # Kiểm tra có biến động không
-                                if idx in ratio_pivot.index and col in ratio_pivot.columns:
-                                    ratio_val = ratio_pivot.loc[idx, col]
-                                    if pd.notna(ratio_val):
-                                        # Có biến động - format với %
-                                        combined_pivot.loc[idx, col] = self.format_value_with_change(main_value, ratio_val, 0)
-                                        continue
-                                
-                                # Không có biến động - chỉ hiển thị số
-                                combined_pivot.loc[idx, col] = f"{main_value:,.0f}".replace(',', '.')
-                        
-                        # THÊM CỘT TỔNG
-                        combined_pivot['Tổng'] = ""
-                        for idx in combined_pivot.index:
-                            row_total = 0
-                            for col in main_pivot.columns:  # Dùng main_pivot để tính tổng
-                                val = main_pivot.loc[idx, col]
-                                if pd.notna(val):
-                                    row_total += float(val)
-                            combined_pivot.loc[idx, 'Tổng'] = f"{row_total:,.0f}".replace(',', '.')
-                        
-                        return combined_pivot
-                        
-                    except Exception as e:
-                        st.sidebar.error(f"Lỗi tạo biến động: {str(e)}")
-                        st.sidebar.error(f"Chi tiết: {type(e).__name__}")
-                        pass
-            
-            # Nếu không có biến động, vẫn thêm cột tổng
-            if isinstance(pivot, pd.DataFrame):
-                pivot_with_total = pivot.copy()
-                pivot_with_total['Tổng'] = 0
-                for idx in pivot_with_total.index:
-                    row_total = 0
-                    for col in pivot_with_total.columns:
-                        if col != 'Tổng':
-                            val = pivot.loc[idx, col]
-                            if pd.notna(val):
-                                row_total += float(val)
-                    pivot_with_total.loc[idx, 'Tổng'] = f"{row_total:,.0f}".replace(',', '.')
-                return pivot_with_total
-            
-            return pivot
+            result = self._build_pivot(data, rows, cols, values, agg_func, show_ratio_inline, comparison)
+            if key is not None:
+                cache.put(key, result)
+            return result
             
         except Exception as e:
             st.error(f"Lỗi tạo pivot table: {str(e)}")
             return None
     
-    def display_category_sparklines(self, category_data, category_name, report_type):
-        """Hiển thị sparklines cho từng nội dung trong danh mục"""
+    def _build_pivot(self, data, rows, cols, values, agg_func, show_ratio_inline, comparison='previous'):
+        """PivotResult của pivot - lỗi được raise ra ngoài
+        
+        Biến động so với kỳ liền trước trên trục thời gian của chính pivot (period_changes), hoặc
+        với mức nền theo dòng `comparison` (tổng số liệu / tổng mức nền, cho sum và mean)
+        """
+        # Danh mục / Nội dung là Categorical theo thứ tự ưu tiên: pivot tự sắp đúng thứ tự
+        # (KHÔNG margins=True: dòng tổng từng danh mục / tổng cộng gộp từ pivot số ở dưới)
+        pivot = self.aggregate(data, rows, cols, values, agg_func, fill_value=None)
+        
+        baseline = None
+        if show_ratio_inline and comparison != 'previous' and values == 'Số liệu' and agg_func in self.baseline_aggregations:
+            baseline = self.baseline_pivots(data, rows, cols, comparison)
+        context = None
+        if show_ratio_inline and baseline is None:
+            context = self.period_context(data, pivot, rows, cols, values, agg_func)
+        
+        # Dòng tổng của mean gộp từ pivot tổng và pivot đếm (cùng ô với pivot hiển thị)
+        if agg_func == 'mean':
+            parts = [self.aggregate(data, rows, cols, values, measure, fill_value=None) for measure in ('sum', 'count')]
+            context_parts = None
+            if context is not None:
+                context_parts = [self.period_context(data, part, rows, cols, values, measure)
+                                 for part, measure in zip(parts, ('sum', 'count'))]
+                if any(part is None for part in context_parts):
+                    context_parts = None
+        else:
+            parts = [pivot]
+            context_parts = None if context is None else [context]
+        
+        def changes_of(frame, level=False):
+            # level=False: chính pivot; ngược lại: dòng tổng gộp theo level (None = tổng cộng)
+            if baseline is not None:
+                # Tổng số liệu / tổng mức nền cộng được qua mọi mức gộp
+                current, base = baseline if level is False else (
+                    self.rollup_rows(part, level, 'sum') for part in baseline
+                )
+                ratio = self.percent_change(current.reindex_like(frame).to_numpy(dtype=float),
+                                            base.reindex_like(frame).to_numpy(dtype=float))
+                if isinstance(frame, pd.Series):
+                    return pd.Series(ratio, index=frame.index)
+                return pd.DataFrame(ratio, index=frame.index, columns=frame.columns)
+            if level is False or context_parts is None:
+                frame_context = context if level is False else None
+            else:
+                frame_context = self.rollup_rows(context_parts[0], level, agg_func, *context_parts[1:])
+            return self.period_changes(frame, frame_context)
+        
+        def numeric_result(frame, level=False, **rollups):
+            changes = None
+            if show_ratio_inline:
+                changes = changes_of(frame, level)
+                # Không ô nào có biến động (vd. chỉ có 1 kỳ) -> chỉ hiển thị số
+                if changes is not None and not changes.notna().to_numpy().any():
+                    changes = None
+            return PivotResult.from_frames(frame.fillna(0), changes, **rollups)
+        
+        def rollup_result(level):
+            return numeric_result(self.rollup_rows(parts[0], level, agg_func, *parts[1:]), level)
+        
+        # Dòng tổng gộp từ chính pivot số (không tính lại trên dữ liệu dòng)
+        subtotals = None
+        if isinstance(pivot.index, pd.MultiIndex) and 'Danh mục' in pivot.index.names:
+            subtotals = rollup_result('Danh mục')
+        grand_total = rollup_result(None) if len(pivot) > 1 else None
+        
+        return numeric_result(pivot, subtotals=subtotals, grand_total=grand_total)
+    
+    @classmethod
+    def rollup_rows(cls, pivot, level, agg_func, counts=None):
+        """Gộp các dòng của pivot số (ô thiếu = NaN) theo 1 cấp index, level=None -> 1 dòng Tổng cộng
+        
+        sum / count -> cộng, min / max -> nhỏ nhất / lớn nhất (đúng như tính trên dữ liệu dòng);
+        mean: pivot là pivot tổng (sum), counts là pivot đếm (count) -> tổng gộp / số dòng gộp,
+        không lấy trung bình của các trung bình
+        """
+        if agg_func == 'mean':
+            totals = cls.rollup_rows(pivot, level, 'sum')
+            rows = cls.rollup_rows(counts, level, 'count')
+            return totals / rows.where(rows > 0)
+        
+        how = RollupCube.measures[agg_func]
+        options = {'min_count': 1} if how == 'sum' else {}
+        if level is None:
+            grouped = pivot.groupby(np.zeros(len(pivot), dtype=np.int8))
+        else:
+            grouped = pivot.groupby(level=level, observed=True, sort=True)
+        
+        rolled = getattr(grouped, how)(**options)
+        if level is None:
+            rolled.index = pd.Index([PivotResult.grand_total_label])
+        return rolled
+    
+    def display_category_sparklines(self, category_result, category_name, report_type):
+        """Hiển thị sparklines cho từng nội dung trong danh mục (PivotResult.select của danh mục)"""
         try:
-            if not isinstance(category_data, pd.DataFrame):
+            if category_result is None or not category_result.has_columns:
                 return
             
             # Tạo sparklines cho từng nội dung trong danh mục
@@ -1060,21 +3705,9 @@ class PivotTableDashboard:
             with col3:
                 st.markdown("**Tổng hàng**")
             
-            for content in category_data.index:
-                # Lấy dữ liệu cho nội dung này
-                content_values = []
-                for col in category_data.columns:
-                    val = category_data.loc[content, col]
-                    if isinstance(val, str):
-                        # Extract số từ HTML
-                        import re
-                        numbers = re.findall(r'[\d.]+', val.replace('.', ''))
-                        if numbers:
-                            content_values.append(int(numbers[0].replace('.', '')))
-                        else:
-                            content_values.append(0)
-                    else:
-                        content_values.append(val if pd.notna(val) else 0)
+            for position, content in enumerate(category_result.index):
+                # Lấy dữ liệu số cho nội dung này
+                content_values = np.nan_to_num(category_result.values[position]).tolist()
                 
                 # Tạo sparkline
                 fig = go.Figure()
@@ -1128,7 +3761,10 @@ class PivotTableDashboard:
             st.error(f"Lỗi tạo sparkline cho {category_name}: {str(e)}")
     
     def display_hierarchical_pivot_improved(self, pivot, data):
-        """Hiển thị pivot table với cấu trúc phân cấp cải tiến - Sparkline ở dưới cùng"""
+        """Hiển thị pivot (PivotResult) với cấu trúc phân cấp cải tiến - Sparkline ở dưới cùng
+        
+        Bảng dùng chuỗi hiển thị của PivotResult; sparkline và tổng đọc thẳng ma trận số
+        """
         if pivot is None:
             return
         
@@ -1136,9 +3772,10 @@ class PivotTableDashboard:
         if isinstance(pivot.index, pd.MultiIndex) and 'Danh mục' in pivot.index.names:
             # Hiển thị theo cấu trúc phân cấp
             
-            # Lấy danh sách các danh mục theo thứ tự ưu tiên
-            categories = pivot.index.get_level_values('Danh mục').unique()
-            sorted_categories = sorted(categories, key=lambda x: self.category_priority.get(x, 999))
+            # Lấy danh sách các danh mục theo thứ tự ưu tiên (pivot đã sắp theo categories)
+            sorted_categories = pivot.index.get_level_values('Danh mục').unique().tolist()
+            category_results = {category: pivot.select('Danh mục', category) for category in sorted_categories}
+            subtotal_view = pivot.subtotals.formatted() if pivot.subtotals is not None else None
             
             # PHẦN 1: HIỂN THỊ PIVOT TABLE CHO TỪNG DANH MỤC (KHÔNG CÓ SPARKLINE)
             for category in sorted_categories:
@@ -1146,250 +3783,178 @@ class PivotTableDashboard:
                 with st.expander("", expanded=True):
                     # Category title: bigger, bold, subtle background
                     st.markdown(f"<div class='category-header'>📁 {category}</div>", unsafe_allow_html=True)
-                    # Lọc dữ liệu cho danh mục này
-                    category_data = pivot.xs(category, level='Danh mục')
-                    
-                    # Sắp xếp theo thứ tự ưu tiên nội dung
-                    if isinstance(category_data.index, pd.Index):
-                        # Lấy danh sách nội dung và sắp xếp
-                        contents = category_data.index.tolist()
-                        sorted_contents = sorted(contents, key=lambda x: self.content_priority.get(x, 999))
-                        category_data = category_data.reindex(sorted_contents)
+                    # Chuỗi hiển thị của danh mục này
+                    category_view = category_results[category].formatted()
                     
                     # CHỈ HIỂN THỊ BẢNG DỮ LIỆU (KHÔNG CÓ SPARKLINE)
-                    if isinstance(category_data, pd.DataFrame):
-                        # Tạo HTML table để hiển thị đầy đủ số và biến động
-                        html_table = "<div class='full-width-table'>"
-                        html_table += "<table style='width:100%; border-collapse: collapse; font-size: 15px;'>"
+                    # Tạo HTML table để hiển thị đầy đủ số và biến động
+                    html_table = "<div class='full-width-table'>"
+                    html_table += "<table style='width:100%; border-collapse: collapse; font-size: 15px;'>"
+                    
+                    # Header
+                    html_table += "<tr style='background-color: #f0f2f6;'>"
+                    html_table += "<th style='border: 1px solid #ddd; padding: 8px; text-align: left; min-width: 250px; position: sticky; left: 0; background-color: #f0f2f6; z-index: 10;'>Nội dung</th>"
+                    for col in category_view.columns:
+                        if col == 'Tổng':
+                            html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center; min-width: 120px; position: sticky; right: 0; background-color: #f0f2f6; z-index: 10; font-weight: bold;'>{col}</th>"
+                        else:
+                            html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center; min-width: 150px;'>{col}</th>"
+                    html_table += "</tr>"
+                    
+                    # Data rows
+                    for content, cells in zip(category_view.index, category_view.to_numpy()):
+                        html_table += "<tr>"
+                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; font-weight: bold; position: sticky; left: 0; background-color: #f8f9fa; z-index: 10;'>{content}</td>"
                         
-                        # Header
-                        html_table += "<tr style='background-color: #f0f2f6;'>"
-                        html_table += "<th style='border: 1px solid #ddd; padding: 8px; text-align: left; min-width: 250px; position: sticky; left: 0; background-color: #f0f2f6; z-index: 10;'>Nội dung</th>"
-                        for col in category_data.columns:
+                        for col, formatted_value in zip(category_view.columns, cells):
                             if col == 'Tổng':
-                                html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center; min-width: 120px; position: sticky; right: 0; background-color: #f0f2f6; z-index: 10; font-weight: bold;'>{col}</th>"
+                                html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right; position: sticky; right: 0; background-color: #e9ecef; z-index: 10; font-weight: bold;' class='number-cell'>{formatted_value}</td>"
                             else:
-                                html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center; min-width: 150px;'>{col}</th>"
-                        html_table += "</tr>"
-                        
-                        # Data rows
-                        for content in category_data.index:
-                            html_table += "<tr>"
-                            html_table += f"<td style='border: 1px solid #ddd; padding: 8px; font-weight: bold; position: sticky; left: 0; background-color: #f8f9fa; z-index: 10;'>{content}</td>"
-                            
-                            for col in category_data.columns:
-                                value = category_data.loc[content, col]
-                                if col == 'Tổng':
-                                    formatted_value = f"{value:,.0f}".replace(",", ".") if isinstance(value, (int, float, np.integer, np.floating)) else str(value)
-                                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right; position: sticky; right: 0; background-color: #e9ecef; z-index: 10; font-weight: bold;' class='number-cell'>{formatted_value}</td>"
-                                else:
-                                    formatted_value = f"{valdisplay_hierarchical_pivot_improvedue:,.0f}".replace(",", ".") if isinstance(value, (int, float, np.integer, np.floating)) else str(value)
-                                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
-                            
-                            html_table += "</tr>"
+                                html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
                         
-                        html_table += "</table></div>"
-                        st.markdown(html_table, unsafe_allow_html=True)
-                    
-                    else:
-                        # Nếu là Series
-                        html_table = "<div class='full-width-table'>"
-                        html_table += "<table style='width:100%; border-collapse: collapse; font-size: 12px;'>"
-                        html_table += "<tr style='background-color: #f0f2f6;'>"
-                        html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Danh mục</th>"
-                        html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Giá trị</th>"
                         html_table += "</tr>"
-                        html_table += "<tr>"
-                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{category}</td>"
-                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{category_data}</td>"
+                    
+                    # Dòng tổng của danh mục
+                    if subtotal_view is not None:
+                        html_table += "<tr style='background-color: #e9ecef; font-weight: bold;'>"
+                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; position: sticky; left: 0; background-color: #e9ecef; z-index: 10;'>Tổng {category}</td>"
+                        for col, formatted_value in zip(subtotal_view.columns, subtotal_view.loc[category]):
+                            if col == 'Tổng':
+                                html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right; position: sticky; right: 0; background-color: #dee2e6; z-index: 10;' class='number-cell'>{formatted_value}</td>"
+                            else:
+                                html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
                         html_table += "</tr>"
-                        html_table += "</table></div>"
-                        st.markdown(html_table, unsafe_allow_html=True)
+                    
+                    html_table += "</table></div>"
+                    st.markdown(html_table, unsafe_allow_html=True)
+            
+            self.display_grand_total(pivot)
+            
+            # Pivot không có chiều cột: không có chuỗi theo kỳ để vẽ sparkline
+            if not pivot.has_columns:
+                return
             
             # PHẦN 2: HIỂN THỊ SPARKLINE Ở DƯỚI CÙNG RIÊNG BIỆT
             st.markdown("---")  # Đường phân cách
             st.subheader("📈 Biểu đồ xu hướng tổng hợp theo từng nội dung")
             st.markdown("*Xu hướng biến động qua các tuần cho mỗi nội dung công việc*")
             
-            # Tạo container cho sparklines
-            sparkline_data_all = {}
-            
-            # Thu thập dữ liệu sparkline cho tất cả danh mục
+            # Hiển thị sparklines theo danh mục
             for category in sorted_categories:
-                try:
-                    category_data = pivot.xs(category, level='Danh mục')
+                with st.expander(f"📊 Xu hướng: {category}", expanded=False):
+                    category_result = category_results[category]
                     
-                    if isinstance(category_data, pd.DataFrame):
-                        # Sắp xếp theo thứ tự ưu tiên nội dung
-                        contents = category_data.index.tolist()
-                        sorted_contents = sorted(contents, key=lambda x: self.content_priority.get(x, 999))
-                        category_data = category_data.reindex(sorted_contents)
+                    try:
+                        # Header cho bảng sparkline
+                        st.markdown("**📊 Xu hướng biến động cho từng nội dung:**")
                         
-                        # Lưu vào dict chung
-                        sparkline_data_all[category] = {
-                            'data': category_data,
-                            'contents': sorted_contents
-                        }
-                except Exception as e:
-                    continue
-            
-            # Hiển thị sparklines theo danh mục
-            for category in sorted_categories:
-                if category in sparkline_data_all:
-                    with st.expander(f"📊 Xu hướng: {category}", expanded=False):
-                        category_info = sparkline_data_all[category]
-                        category_data = category_info['data']
+                        # Tạo bảng sparkline cho danh mục này
+                        sparkline_rows = []
+                        row_totals = self.format_numbers(category_result.totals)
                         
-                        try:
-                            # Header cho bảng sparkline
-                            st.markdown("**📊 Xu hướng biến động cho từng nội dung:**")
+                        for position, content in enumerate(category_result.index):
+                            # Dữ liệu số của nội dung này (không gồm cột Tổng)
+                            content_values = np.nan_to_num(category_result.values[position]).tolist()
                             
-                            # Tạo bảng sparkline cho danh mục này
-                            sparkline_rows = []
+                            # Tạo sparkline
+                            fig = go.Figure()
+                            fig.add_trace(go.Scatter(
+                                y=content_values,
+                                mode='lines+markers',
+                                line=dict(width=2, color='royalblue'),
+                                marker=dict(size=3),
+                                showlegend=False
+                            ))
                             
-                            for content in category_info['contents']:
-                                # Lấy dữ liệu cho nội dung này
-                                content_values = []
-                                for col in category_data.columns:
-                                    if col != 'Tổng':  # Bỏ qua cột Tổng khi tính sparkline
-                                        val = category_data.loc[content, col]
-                                        if isinstance(val, str):
-                                            # Extract số từ HTML
-                                            import re
-                                            numbers = re.findall(r'[\d.]+', val.replace('.', ''))
-                                            if numbers:
-                                                content_values.append(int(numbers[0].replace('.', '')))
-                                            else:
-                                                content_values.append(0)
-                                        else:
-                                            content_values.append(val if pd.notna(val) else 0)
+                            # Highlight max/min
+                            if content_values and max(content_values) > 0:
+                                max_idx = np.argmax(content_values)
+                                min_idx = np.argmin(content_values)
                                 
-                                # Tạo sparkline
-                                fig = go.Figure()
                                 fig.add_trace(go.Scatter(
-                                    y=content_values,
-                                    mode='lines+markers',
-                                    line=dict(width=2, color='royalblue'),
-                                    marker=dict(size=3),
+                                    x=[max_idx], y=[content_values[max_idx]],
+                                    mode='markers', marker=dict(size=5, color='green'),
+                                    showlegend=False
+                                ))
+                                fig.add_trace(go.Scatter(
+                                    x=[min_idx], y=[content_values[min_idx]],
+                                    mode='markers', marker=dict(size=5, color='red'),
                                     showlegend=False
                                 ))
-                                
-                                # Highlight max/min
-                                if content_values and max(content_values) > 0:
-                                    max_idx = np.argmax(content_values)
-                                    min_idx = np.argmin(content_values)
-                                    
-                                    fig.add_trace(go.Scatter(
-                                        x=[max_idx], y=[content_values[max_idx]],
-                                        mode='markers', marker=dict(size=5, color='green'),
-                                        showlegend=False
-                                    ))
-                                    fig.add_trace(go.Scatter(
-                                        x=[min_idx], y=[content_values[min_idx]],
-                                        mode='markers', marker=dict(size=5, color='red'),
-                                        showlegend=False
-                                    ))
-                                
-                                fig.update_layout(
-                                    margin=dict(l=0, r=0, t=0, b=0),
-                                    height=40, width=200,
-                                    paper_bgcolor='rgba(0,0,0,0)',
-                                    plot_bgcolor='rgba(0,0,0,0)',
-                                    xaxis=dict(showticklabels=False, showgrid=False, zeroline=False),
-                                    yaxis=dict(showticklabels=False, showgrid=False, zeroline=False),
-                                    hovermode=False
-                                )
-                                
-                                # Lấy tổng hàng từ cột Tổng
-                                row_total = category_data.loc[content, 'Tổng'] if 'Tổng' in category_data.columns else sum(content_values)
-                                
-                                # Lưu vào danh sách
-                                sparkline_rows.append({
-                                    'content': content,
-                                    'fig': fig,
-                                    'total': row_total,
-                                    'values': content_values
-                                })
                             
-                            # Hiển thị từng row với sparkline trong layout 3 cột
-                            for row_data in sparkline_rows:
-                                col1, col2, col3 = st.columns([3, 2, 1])
-                                
-                                with col1:
-                                    st.markdown(f"📄 {row_data['content']}")
-                                
-                                with col2:
-                                    st.plotly_chart(row_data['fig'], use_container_width=True, 
-                                                key=f"spark_{category}_{row_data['content']}")
-                                
-                                with col3:
-                                    if isinstance(row_data['total'], str):
-                                        st.markdown(f"**{row_data['total']}**")
-                                    else:
-                                        st.markdown(f"**{row_data['total']:,.0f}**".replace(',', '.'))
+                            fig.update_layout(
+                                margin=dict(l=0, r=0, t=0, b=0),
+                                height=40, width=200,
+                                paper_bgcolor='rgba(0,0,0,0)',
+                                plot_bgcolor='rgba(0,0,0,0)',
+                                xaxis=dict(showticklabels=False, showgrid=False, zeroline=False),
+                                yaxis=dict(showticklabels=False, showgrid=False, zeroline=False),
+                                hovermode=False
+                            )
                             
-                            # Thống kê tổng quan cho danh mục
-                            total_category = sum([sum(row['values']) for row in sparkline_rows])
-                            avg_per_content = total_category / len(sparkline_rows) if sparkline_rows else 0
+                            # Lưu vào danh sách
+                            sparkline_rows.append({
+                                'content': content,
+                                'fig': fig,
+                                'total': row_totals[position]
+                            })
+                        
+                        # Hiển thị từng row với sparkline trong layout 3 cột
+                        for row_data in sparkline_rows:
+                            col1, col2, col3 = st.columns([3, 2, 1])
                             
-                            st.info(f"""
-                            📊 **Tổng quan {category}:**
-                            - 📈 Tổng cộng: {total_category:,.0f}
-                            - 📊 Trung bình/nội dung: {avg_per_content:,.0f}
-                            - 📋 Số nội dung: {len(sparkline_rows)}
-                            """.replace(',', '.'))
-                                    
-                        except Exception as e:
-                            st.error(f"Lỗi tạo sparkline cho {category}: {str(e)}")
+                            with col1:
+                                st.markdown(f"📄 {row_data['content']}")
+                            
+                            with col2:
+                                st.plotly_chart(row_data['fig'], use_container_width=True, 
+                                            key=f"spark_{category}_{row_data['content']}")
+                            
+                            with col3:
+                                st.markdown(f"**{row_data['total']}**")
+                        
+                        # Thống kê tổng quan cho danh mục
+                        total_category = float(np.nansum(category_result.totals))
+                        avg_per_content = total_category / len(sparkline_rows) if sparkline_rows else 0
+                        
+                        st.info(f"""
+                        📊 **Tổng quan {category}:**
+                        - 📈 Tổng cộng: {total_category:,.0f}
+                        - 📊 Trung bình/nội dung: {avg_per_content:,.0f}
+                        - 📋 Số nội dung: {len(sparkline_rows)}
+                        """.replace(',', '.'))
+                                
+                    except Exception as e:
+                        st.error(f"Lỗi tạo sparkline cho {category}: {str(e)}")
         
         elif 'Danh mục' in pivot.index.names:
-            # Hiển thị pivot table đơn giản với Danh mục (giữ nguyên)
+            # Hiển thị pivot table đơn giản với Danh mục: mỗi danh mục 1 dòng
+            view = pivot.formatted()
             
-            
-            # Nhóm theo danh mục và sắp xếp theo thứ tự ưu tiên
-            categories = pivot.index.unique()
-            sorted_categories = sorted(categories, key=lambda x: self.category_priority.get(x, 999))
-            
-            for category in sorted_categories:
+            # Nhóm theo danh mục (pivot đã sắp theo thứ tự ưu tiên)
+            for category, cells in zip(view.index, view.to_numpy()):
                 with st.expander(f"📁 {category}", expanded=True):
-                    category_data = pivot.loc[category]
-                    
-                    if isinstance(category_data, pd.Series):
-                        html_table = "<table style='width:100%; border-collapse: collapse;'>"
-                        html_table += "<tr style='background-color: #f0f2f6;'>"
-                        html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Danh mục</th>"
-                        html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Giá trị</th>"
-                        html_table += "</tr>"
-                        html_table += "<tr>"
-                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{category}</td>"
-                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{category_data:,.0f}".replace(',', '.') + "</td>"
-                        html_table += "</tr>"
-                        html_table += "</table>"
-                        st.markdown(html_table, unsafe_allow_html=True)
-                    else:
-                        # DataFrame case
-                        html_table = "<div class='full-width-table'>"
-                        html_table += "<table style='width:100%; border-collapse: collapse; font-size: 12px;'>"
-                        html_table += "<tr style='background-color: #f0f2f6;'>"
-                        html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Nội dung</th>"
-                        for col in category_data.columns:
-                            html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center;'>{col}</th>"
-                        html_table += "</tr>"
-                        
-                        for idx in category_data.index:
-                            html_table += "<tr>"
-                            html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{idx}</td>"
-                            for col in category_data.columns:
-                                value = category_data.loc[idx, col]
-                                html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{value}</td>"
-                            html_table += "</tr>"
-                        
-                        html_table += "</table></div>"
-                        st.markdown(html_table, unsafe_allow_html=True)
+                    html_table = "<div class='full-width-table'>"
+                    html_table += "<table style='width:100%; border-collapse: collapse; font-size: 12px;'>"
+                    html_table += "<tr style='background-color: #f0f2f6;'>"
+                    html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Danh mục</th>"
+                    for col in view.columns:
+                        html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center;'>{col}</th>"
+                    html_table += "</tr>"
+                    html_table += "<tr>"
+                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{category}</td>"
+                    for formatted_value in cells:
+                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
+                    html_table += "</tr>"
+                    html_table += "</table></div>"
+                    st.markdown(html_table, unsafe_allow_html=True)
+            
+            self.display_grand_total(pivot)
         
         else:
             # Hiển thị pivot table thông thường (giữ nguyên)
             st.subheader("📊 Pivot Table")
+            view = pivot.formatted()
             
             # Tạo HTML table cho pivot thông thường
             html_table = "<div class='full-width-table'>"
@@ -1398,86 +3963,61 @@ class PivotTableDashboard:
             # Header
             html_table += "<tr style='background-color: #f0f2f6;'>"
             html_table += "<th style='border: 1px solid #ddd; padding: 8px;'>Index</th>"
-            if isinstance(pivot, pd.DataFrame):
-                for col in pivot.columns:
-                    html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center;'>{col}</th>"
-            else:
-                html_table += "<th style='border: 1px solid #ddd; padding: 8px; text-align: center;'>Giá trị</th>"
+            for col in view.columns:
+                html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center;'>{col}</th>"
             html_table += "</tr>"
             
             # Data
-            if isinstance(pivot, pd.DataFrame):
-                for idx in pivot.index:
-                    html_table += "<tr>"
-                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{idx}</td>"
-                    for col in pivot.columns:
-                        value = pivot.loc[idx, col]
-                        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{value}</td>"
-                    html_table += "</tr>"
-            else:
-                for idx in pivot.index:
-                    html_table += "<tr>"
-                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{idx}</td>"
-                    value_formatted = f"{pivot.loc[idx]:,.0f}".replace(',', '.')
-                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{value_formatted}</td>"
-                    html_table += "</tr>"
+            for idx, cells in zip(view.index, view.to_numpy()):
+                html_table += "<tr>"
+                html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{idx}</td>"
+                for formatted_value in cells:
+                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
+                html_table += "</tr>"
+            
+            # Dòng tổng cộng
+            if pivot.grand_total is not None:
+                html_table += "<tr style='background-color: #e9ecef; font-weight: bold;'>"
+                html_table += f"<td style='border: 1px solid #ddd; padding: 8px;'>{pivot.grand_total_label}</td>"
+                for formatted_value in pivot.grand_total.formatted().to_numpy()[0]:
+                    html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
+                html_table += "</tr>"
             
             html_table += "</table></div>"
             st.markdown(html_table, unsafe_allow_html=True)
     
+    def display_grand_total(self, pivot):
+        """Bảng 1 dòng Tổng cộng dưới các bảng danh mục"""
+        if pivot.grand_total is None:
+            return
+        
+        view = pivot.grand_total.formatted()
+        html_table = "<div class='full-width-table'>"
+        html_table += "<table style='width:100%; border-collapse: collapse; font-size: 15px;'>"
+        html_table += "<tr style='background-color: #f0f2f6;'>"
+        html_table += "<th style='border: 1px solid #ddd; padding: 8px; text-align: left; min-width: 250px; position: sticky; left: 0; background-color: #f0f2f6; z-index: 10;'></th>"
+        for col in view.columns:
+            html_table += f"<th style='border: 1px solid #ddd; padding: 8px; text-align: center; min-width: 150px;'>{col}</th>"
+        html_table += "</tr>"
+        html_table += "<tr style='background-color: #e9ecef; font-weight: bold;'>"
+        html_table += f"<td style='border: 1px solid #ddd; padding: 8px; position: sticky; left: 0; background-color: #e9ecef; z-index: 10;'>📊 {pivot.grand_total_label}</td>"
+        for formatted_value in view.to_numpy()[0]:
+            html_table += f"<td style='border: 1px solid #ddd; padding: 8px; text-align: right;' class='number-cell'>{formatted_value}</td>"
+        html_table += "</tr>"
+        html_table += "</table></div>"
+        st.markdown(html_table, unsafe_allow_html=True)
+    
     def create_sparkline_charts(self, pivot, report_type):
-        """Tạo biểu đồ sparkline cho mỗi dòng trong pivot table"""
-        if pivot is None or not isinstance(pivot, pd.DataFrame):
+        """Tạo biểu đồ sparkline cho mỗi dòng trong pivot (PivotResult), đọc thẳng ma trận số"""
+        if pivot is None or not pivot.has_columns:
             return None
         
-        # Xác định cột thời gian dựa vào report_type
-        time_column_name = {
-            "Theo Tuần": "Tuần",
-            "Theo Tháng": "Tháng",
-            "Theo Quý": "Quý",
-            "Theo Năm": "Năm"
-        }.get(report_type, "Tháng")
-        
-        # Tạo dataframe cho biểu đồ
+        # Figure theo key của dòng
         sparklines_data = {}
         
-        # Reset index để dễ dàng xử lý
-        if isinstance(pivot.index, pd.MultiIndex):
-            pivot_reset = pivot.reset_index()
-        else:
-            pivot_reset = pivot.reset_index()
-            
-        # Lấy tên của các cột chứa giá trị
-        value_columns = [col for col in pivot.columns 
-                         if not isinstance(col, tuple) or time_column_name in col]
-        
         # Tạo sparkline cho mỗi dòng
-        for idx, row in pivot_reset.iterrows():
-                
-            # Lấy tên hàng
-            if isinstance(pivot.index, pd.MultiIndex):
-                row_key = tuple(row[list(pivot.index.names)])
-            else:
-                row_key = row[pivot.index.name]
-                
-            # Lấy giá trị cho sparkline (extract từ HTML nếu cần)
-            values = []
-            for col in value_columns:
-                try:
-                    if col in pivot.columns:
-                        val = pivot.loc[row_key, col]
-                        # Nếu là chuỗi HTML, lấy số đầu tiên
-                        if isinstance(val, str):
-                            import re
-                            numbers = re.findall(r'[\d.]+', val.replace('.', ''))
-                            if numbers:
-                                values.append(int(numbers[0].replace('.', '')))
-                            else:
-                                values.append(0)
-                        else:
-                            values.append(val)
-                except:
-                    values.append(0)
+        for position, row_key in enumerate(pivot.index):
+            values = np.nan_to_num(pivot.values[position]).tolist()
             
             # Tạo sparkline figure
             fig = go.Figure()
@@ -1538,27 +4078,37 @@ class PivotTableDashboard:
         return sparklines_data
     
     def create_individual_trend_chart(self, data, content_item, time_col, chart_type="Đường", normalize=False):
-        """Tạo biểu đồ xu hướng riêng cho một nội dung cụ thể"""
+        """Tạo biểu đồ xu hướng riêng cho một nội dung cụ thể
+        
+        data: dữ liệu dòng, hoặc Series đã tổng hợp sẵn của nội dung này (index = kỳ, NaN = không có số liệu)
+        """
         try:
-            # Lọc dữ liệu cho nội dung được chọn
-            content_data = data[data['Nội dung'] == content_item]
+            if isinstance(data, pd.Series):
+                series = data.dropna()
+            else:
+                # Lọc dữ liệu cho nội dung được chọn
+                content_data = data[data['Nội dung'] == content_item]
+                
+                if content_data.empty:
+                    return None
+                    
+                # Tạo pivot table cho nội dung này
+                series = pd.pivot_table(
+                    content_data,
+                    index='Nội dung',
+                    columns=time_col,
+                    values='Số liệu',
+                    aggfunc='sum',
+                    fill_value=0,
+                    observed=True
+                ).iloc[0]
             
-            if content_data.empty:
+            if series.empty:
                 return None
-                
-            # Tạo pivot table cho nội dung này
-            pivot_data = pd.pivot_table(
-                content_data,
-                index='Nội dung',
-                columns=time_col,
-                values='Số liệu',
-                aggfunc='sum',
-                fill_value=0
-            )
             
             # Lấy giá trị cho biểu đồ
-            time_values = list(pivot_data.columns)
-            data_values = pivot_data.iloc[0].values
+            time_values = list(series.index)
+            data_values = series.values
             
             # Chuẩn hóa dữ liệu nếu cần
             if normalize and max(data_values) > 0:
@@ -1689,6 +4239,131 @@ class PivotTableDashboard:
             st.error(f"Lỗi khi tạo biểu đồ cho {content_item}: {str(e)}")
             return None
 
+# ================== SHARED DATASET CACHE ==================
+class DatasetCache:
+    """
+    Cache dữ liệu đã xử lý, dùng chung cho mọi session trong process
+    - Key theo blob sha của file dữ liệu trên GitHub
+    - Partition đã tiền xử lý lúc upload: chỉ giải mã, không tính lại
+    - Partition thô (bản cũ): chỉ xử lý lại các năm có partition thay đổi
+    - Giữ DataFrame đã tiền xử lý (cột phụ, thứ tự ưu tiên, biến động)
+    - Chỉ kiểm tra lại GitHub khi hết TTL hoặc khi bấm "🔄 Làm mới dữ liệu"
+    
+    DataFrame trong cache được chia sẻ giữa các session: chỉ đọc, không sửa tại chỗ.
+    """
+    
+    def __init__(self, ttl_seconds=300):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entry = None
+        self._checked_at = 0.0
+        self.stats = {'hits': 0, 'revalidations': 0, 'loads': 0, 'partial_loads': 0}
+    
+    def invalidate(self):
+        """Buộc lần truy cập kế tiếp kiểm tra lại GitHub"""
+        with self._lock:
+            self._checked_at = 0.0
+    
+    def get(self, manager, force=False):
+        """Trả về (connected, status_msg, entry)
+        
+        entry = {'sha', 'partitions', 'data', 'metadata', 'loaded_at'} hoặc None nếu chưa có dữ liệu
+        """
+        with self._lock:
+            if (not force and self._entry is not None
+                    and time.time() - self._checked_at < self.ttl_seconds):
+                self.stats['hits'] += 1
+                return True, "✅ GitHub kết nối thành công", self._entry
+            
+            connected, status_msg = manager.check_github_connection()
+            if not connected:
+                return False, status_msg, None
+            
+            self.stats['revalidations'] += 1
+            raw_data, metadata = manager.load_current_data()
+            sha = manager.current_sha
+            self._checked_at = time.time()
+            
+            if raw_data is None:
+                self._entry = None
+                return True, status_msg, None
+            
+            if self._entry is not None and self._entry['sha'] == sha:
+                return True, status_msg, self._entry
+            
+            # sha mới -> tiền xử lý 1 lần cho mọi session
+            dashboard = PivotTableDashboard()
+            partitions = manager.partition_versions
+            previous = self._entry.get('partitions') if self._entry is not None else None
+            
+            if manager.is_enriched:
+                # Đã tiền xử lý lúc upload -> giải mã là dùng
+                loaded = dashboard.load_enriched_data(raw_data)
+                self.stats['loads'] += 1
+            elif partitions and previous:
+                # Chỉ xử lý lại các năm có partition đổi version
+                changed_years = sorted(
+                    year for year in set(partitions) | set(previous)
+                    if partitions.get(year) != previous.get(year)
+                )
+                dashboard.data = self._entry['data']
+                loaded = dashboard.replace_years(
+                    changed_years, raw_data[raw_data['Năm'].isin(changed_years)]
+                )
+                self.stats['partial_loads'] += 1
+            else:
+                loaded = dashboard.load_data_from_dataframe(raw_data, key=sha)
+                self.stats['loads'] += 1
+            
+            if not loaded:
+                self._entry = None
+                return True, status_msg, None
+            
+            self._entry = {
+                'sha': sha,
+                'partitions': partitions,
+                'data': dashboard.data,
+                'metadata': metadata,
+                'loaded_at': datetime.now().isoformat()
+            }
+            return True, status_msg, self._entry
+
+
+@st.cache_resource
+def get_weekly_manager():
+    """WeeklyUploadManager dùng chung (session HTTP + ETag cache) cho cả process"""
+    return WeeklyUploadManager()
+
+
+@st.cache_resource
+def get_dataset_cache():
+    """DatasetCache dùng chung cho mọi session"""
+    return DatasetCache()
+
+
+@st.cache_resource
+def get_excel_reader():
+    """ExcelReader dùng chung (cache parse trên đĩa theo digest file)"""
+    return ExcelReader()
+
+
+@st.cache_resource
+def get_preprocess_pipeline():
+    """Pipeline tiền xử lý dùng chung: kết quả memo theo nội dung cho mọi session"""
+    return PreprocessPipeline()
+
+
+@st.cache_resource
+def get_pivot_cache():
+    """Cache pivot dùng chung: cùng dữ liệu + bộ lọc + cài đặt pivot -> không tính lại"""
+    return PivotCache()
+
+
+@st.cache_resource
+def get_upload_jobs():
+    """Hàng đợi upload nền dùng chung: job vẫn chạy khi đóng tab hoặc rerun"""
+    return UploadJobQueue()
+
 def main():
     # HEADER: logo + title on one line (flexbox)
     try:
@@ -1761,47 +4436,39 @@ def main():
     # Khởi tạo dashboard và WeeklyUploadManager
     dashboard = PivotTableDashboard()
     
-    # Initialize weekly manager để load dữ liệu từ GitHub
-    if 'weekly_manager' not in st.session_state:
-        st.session_state.weekly_manager = WeeklyUploadManager()
-    
-    manager = st.session_state.weekly_manager
+    # Manager và cache dữ liệu dùng chung cho mọi session
+    manager = get_weekly_manager()
+    dataset_cache = get_dataset_cache()
     
     # PHẦN MỚI: Tự động load dữ liệu từ GitHub
     st.sidebar.header("📁 Nguồn dữ liệu")
     
-    # Kiểm tra kết nối GitHub
-    connected, status_msg = manager.check_github_connection()
+    # Trong TTL: dùng dữ liệu đã xử lý sẵn, không gọi GitHub
+    try:
+        connected, status_msg, cache_entry = dataset_cache.get(manager)
+    except Exception as github_error:
+        st.sidebar.error(f"❌ Lỗi load GitHub: {str(github_error)}")
+        connected, cache_entry = False, None
     
     if connected:
         st.sidebar.success("☁️ Kết nối GitHub thành công")
         
-        # Thử load dữ liệu từ GitHub trước
-        try:
-            github_data, metadata = manager.load_current_data()
+        if cache_entry is not None:
+            metadata = cache_entry['metadata'] or {}
+            # Có dữ liệu từ GitHub
+            st.sidebar.info(f"""
+            📊 **Dữ liệu từ GitHub:**
+            - 📄 {metadata.get('filename', 'Unknown')}
+            - 📅 Tuần {metadata.get('week_number', '?')}/{metadata.get('year', '?')}
+            - 📈 {metadata.get('row_count', 0):,} dòng
+            """)
             
-            if github_data is not None and metadata:
-                # Có dữ liệu từ GitHub
-                st.sidebar.info(f"""
-                📊 **Dữ liệu từ GitHub:**
-                - 📄 {metadata.get('filename', 'Unknown')}
-                - 📅 Tuần {metadata.get('week_number', '?')}/{metadata.get('year', '?')}
-                - 📈 {metadata.get('row_count', 0):,} dòng
-                """)
-                
-                # Load vào dashboard
-                if dashboard.load_data_from_dataframe(github_data):
-                    st.sidebar.success("✅ Đã tải dữ liệu từ GitHub!")
-                    file_loaded = True
-                else:
-                    st.sidebar.warning("⚠️ Lỗi xử lý dữ liệu GitHub")
-                    file_loaded = False
-            else:
-                st.sidebar.warning("📭 Chưa có dữ liệu trên GitHub")
-                file_loaded = False
-                
-        except Exception as github_error:
-            st.sidebar.error(f"❌ Lỗi load GitHub: {str(github_error)}")
+            # Dữ liệu đã được tiền xử lý trong cache
+            dashboard.data = cache_entry['data']
+            st.sidebar.success("✅ Đã tải dữ liệu từ GitHub!")
+            file_loaded = True
+        else:
+            st.sidebar.warning("📭 Chưa có dữ liệu trên GitHub")
             file_loaded = False
     else:
         st.sidebar.warning("⚠️ Không kết nối được GitHub")
@@ -1814,10 +4481,43 @@ def main():
         # Chọn cách nhập dữ liệu
         data_source = st.sidebar.radio(
             "Chọn nguồn dữ liệu",
-            ["Upload file", "Nhập đường dẫn file"]
+            ["Upload file", "Nhập đường dẫn file", "Nhiều file / thư mục / zip"]
         )
         
-        if data_source == "Upload file":
+        if data_source == "Nhiều file / thư mục / zip":
+            # Mỗi tháng 1 file hoặc 1 sheet -> nạp tất cả, tiền xử lý 1 lần
+            bulk_files = st.sidebar.file_uploader(
+                "Chọn các file Excel hoặc file zip",
+                type=['xlsx', 'xls', 'zip'],
+                accept_multiple_files=True
+            )
+            bulk_folder = st.sidebar.text_input(
+                "Hoặc đường dẫn thư mục / file zip / workbook",
+                value=st.session_state.get('bulk_folder', "")
+            )
+            all_sheets = st.sidebar.checkbox("Đọc tất cả sheet trong mỗi workbook", value=True)
+            
+            if bulk_files:
+                file_loaded = dashboard.load_bulk(bulk_files, all_sheets)
+            elif st.sidebar.button("Tải dữ liệu", use_container_width=True) or st.session_state.get('bulk_folder'):
+                if os.path.exists(bulk_folder):
+                    file_loaded = dashboard.load_bulk(bulk_folder, all_sheets)
+                    st.session_state['bulk_folder'] = bulk_folder
+                elif bulk_folder:
+                    st.sidebar.error(f"❌ Không tìm thấy: {bulk_folder}")
+            
+            if dashboard.ingest_report:
+                failed = [row for row in dashboard.ingest_report if row['status'] == 'failed']
+                if file_loaded:
+                    st.sidebar.success(f"✅ Đã tải {len(dashboard.ingest_report) - len(failed)} file/sheet")
+                if failed:
+                    st.sidebar.warning(f"⚠️ {len(failed)} file/sheet lỗi, xem chi tiết bên dưới")
+                with st.sidebar.expander("📑 Chi tiết từng file"):
+                    st.dataframe(pd.DataFrame(dashboard.ingest_report).rename(columns={
+                        'source': 'File', 'sheet': 'Sheet', 'rows': 'Số dòng', 'seconds': 'Giây',
+                        'cached': 'Cache', 'status': 'Trạng thái', 'error': 'Lỗi', 'warnings': 'Cảnh báo'
+                    }), hide_index=True)
+        elif data_source == "Upload file":
             uploaded_file = st.sidebar.file_uploader("Chọn file Excel", type=['xlsx', 'xls'])
             if uploaded_file is not None:
                 if dashboard.load_data(uploaded_file):
@@ -1850,15 +4550,18 @@ def main():
     # Phần còn lại của dashboard (chỉ hiển thị khi có dữ liệu)
     if file_loaded and dashboard.data is not None:
         # Tạo các cài đặt và bộ lọc
-        report_type, rows, cols, values, agg_func, show_ratio_inline = dashboard.create_pivot_settings()
-        time_range, years, months, weeks, categories = dashboard.create_filters()
+        report_type, rows, cols, values, agg_func, show_ratio_inline, comparison = dashboard.create_pivot_settings()
+        time_range, years, months, weeks, categories, contents = dashboard.create_filters()
         
         # Áp dụng bộ lọc
-        filtered_data = dashboard.filter_data(time_range, years, months, weeks, categories)
+        filtered_data = dashboard.filter_data(time_range, years, months, weeks, categories, contents)
         
         # Hiển thị thông tin debug
         st.sidebar.info(f"📊 Dữ liệu: {len(filtered_data):,} dòng")
-        
+        if dashboard.preprocess_timings:
+            st.sidebar.caption(f"⏱️ Tiền xử lý: {PreprocessPipeline.format_timings(dashboard.preprocess_timings)}")
+        st.sidebar.caption(f"🗃️ Cache pivot: {get_pivot_cache().format_stats()}")
+
         # THÊM DEBUG CHI TIẾT VỀ BIẾN ĐỘNG
         if dashboard.data is not None:
             total_rows = len(dashboard.data)
@@ -1887,14 +4590,9 @@ def main():
         # Nút làm mới dữ liệu
         if st.sidebar.button("🔄 Làm mới dữ liệu", use_container_width=True):
             if connected:
-                # Reload từ GitHub
-                try:
-                    github_data, metadata = manager.load_current_data()
-                    if github_data is not None:
-                        dashboard.load_data_from_dataframe(github_data)
-                        st.rerun()
-                except:
-                    pass
+                # Kiểm tra lại GitHub ở lần chạy kế tiếp (bỏ qua TTL)
+                dataset_cache.invalidate()
+                st.rerun()
             elif 'file_path' in st.session_state:
                 dashboard.load_data(st.session_state['file_path'])
                 st.rerun()
@@ -1905,7 +4603,7 @@ def main():
         with tab1:
             # Tạo pivot table với biến động
             pivot = dashboard.create_hierarchical_pivot_table_with_ratio(
-                filtered_data, rows, cols, values, agg_func, show_ratio_inline
+                filtered_data, rows, cols, values, agg_func, show_ratio_inline, comparison
             )
             
             if pivot is not None:
@@ -1919,16 +4617,8 @@ def main():
                     if show_ratio_inline:
                         st.info("💡 Xuất CSV sẽ chứa dữ liệu gốc (không có biến động HTML)")
                     
-                    # Tạo pivot đơn giản cho CSV
-                    simple_pivot = pd.pivot_table(
-                        filtered_data,
-                        index=rows if rows else None,
-                        columns=cols if cols else None,
-                        values=values,
-                        aggfunc=agg_func,
-                        fill_value=0,
-                        margins=False  # BỎ TỔNG CHUNG
-                    )
+                    # Pivot số cho CSV: lấy từ kết quả vừa hiển thị, không tính lại
+                    simple_pivot = pivot.to_frame()
                     
                     csv = simple_pivot.to_csv(encoding='utf-8-sig')
                     st.download_button(
@@ -1969,8 +4659,7 @@ def main():
                 )
             
             # Lọc dữ liệu cho các Nội dung (hiển thị theo thứ tự ưu tiên)
-            unique_contents = filtered_data['Nội dung'].unique()
-            sorted_contents = sorted(unique_contents, key=lambda x: dashboard.content_priority.get(x, 999))
+            sorted_contents = dashboard.ordered_values(filtered_data['Nội dung'])
             
             content_filter = st.multiselect(
                 "Chọn Nội dung cần hiển thị (theo thứ tự ưu tiên)",
@@ -1978,41 +4667,35 @@ def main():
                 default=sorted_contents[:10]  # Mặc định hiển thị 10 nội dung đầu tiên
             )
             
-            filtered_for_charts = filtered_data[filtered_data['Nội dung'].isin(content_filter)]
+            # Chuỗi theo kỳ của mọi (Danh mục, Nội dung) đã chọn: 1 lần cắt từ rollup cube
+            # (NaN = kỳ không có số liệu, không vẽ điểm)
+            trend_pivot = dashboard.aggregate(
+                filtered_data, ['Danh mục', 'Nội dung'], [time_col], contents=content_filter, fill_value=None
+            )
             
-            if filtered_for_charts.empty:
+            if trend_pivot.empty:
                 st.warning("Không có dữ liệu phù hợp với bộ lọc đã chọn!")
             else:
                 # Hiển thị biểu đồ cho từng nội dung riêng biệt
                 st.subheader(f"Biểu đồ xu hướng theo {time_col} cho từng Nội dung")
                 
-                # Sắp xếp dữ liệu theo thứ tự ưu tiên
-                sorted_data = filtered_for_charts.copy()
-                sorted_data = sorted_data.sort_values(['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'])
-                
-                # Tạo container cho các danh mục
-                categories = sorted_data['Danh mục'].unique()
-                sorted_categories = sorted(categories, key=lambda x: dashboard.category_priority.get(x, 999))
+                # Index đã theo thứ tự ưu tiên (Danh mục / Nội dung là Categorical)
+                sorted_categories = trend_pivot.index.get_level_values('Danh mục').unique()
                 
                 for category in sorted_categories:
                     # Hiển thị Danh mục với expander (BỎ HIỂN THỊ SỐ ƯU TIÊN)
                     with st.expander(f"📁 {category}", expanded=True):
-                        # Lọc dữ liệu cho danh mục này
-                        category_data = sorted_data[sorted_data['Danh mục'] == category]
-                        
-                        # Lấy danh sách nội dung trong danh mục (đã sắp xếp)
-                        category_contents = category_data['Nội dung'].unique()
-                        sorted_category_contents = sorted(category_contents, 
-                                                        key=lambda x: dashboard.content_priority.get(x, 999))
+                        # Chuỗi của các nội dung trong danh mục (đã sắp xếp)
+                        category_trends = trend_pivot.xs(category, level='Danh mục')
                         
                         # Tạo grid hiển thị biểu đồ
                         cols_container = st.columns(num_cols)
                         
                         # Duyệt qua từng nội dung và tạo biểu đồ riêng
-                        for i, content_item in enumerate(sorted_category_contents):
+                        for i, content_item in enumerate(category_trends.index):
                             # Tạo biểu đồ cho nội dung này
                             fig = dashboard.create_individual_trend_chart(
-                                category_data, content_item, time_col, chart_type, normalize
+                                category_trends.loc[content_item], content_item, time_col, chart_type, normalize
                             )
                             
                             if fig is not None:
@@ -2024,21 +4707,10 @@ def main():
                 # Hiển thị bảng dữ liệu
                 with st.expander("Xem dữ liệu chi tiết (theo thứ tự ưu tiên)"):
                     # Tạo pivot cho xem dữ liệu chi tiết
-                    detail_pivot = pd.pivot_table(
-                        filtered_for_charts,
-                        index=['Danh mục', 'Nội dung'],
-                        columns=time_col,
-                        values='Số liệu',
-                        aggfunc='sum',
-                        fill_value=0
-                    )
+                    detail_pivot = trend_pivot.fillna(0)
                     
-                    # Sắp xếp theo thứ tự ưu tiên
-                    detail_pivot_sorted = detail_pivot.copy()
-                    detail_pivot_sorted['Danh_mục_thứ_tự'] = detail_pivot_sorted.index.get_level_values('Danh mục').map(dashboard.category_priority).fillna(999)
-                    detail_pivot_sorted['Nội_dung_thứ_tự'] = detail_pivot_sorted.index.get_level_values('Nội dung').map(dashboard.content_priority).fillna(999)
-                    detail_pivot_sorted = detail_pivot_sorted.sort_values(['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'])
-                    detail_pivot_sorted = detail_pivot_sorted.drop(columns=['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'])
+                    # Pivot đã theo thứ tự ưu tiên (index Categorical)
+                    detail_pivot_sorted = detail_pivot
                     
                     # Hiển thị với HTML table để đảm bảo hiển thị đầy đủ số
                     html_table = "<div class='full-width-table'>"
@@ -2078,44 +4750,33 @@ def main():
                     output_file = f'bao_cao_phong_hanh_chinh_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
                     with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
                         # Sheet 1: Dữ liệu gốc (đã sắp xếp)
-                        filtered_data_export = filtered_data.drop(columns=['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'], errors='ignore')
+                        filtered_data_export = filtered_data
                         filtered_data_export.to_excel(writer, sheet_name='Dữ liệu gốc', index=False)
                         
                         # Sheet 2: Pivot table (dữ liệu số, không có HTML)
-                        simple_pivot = pd.pivot_table(
-                            filtered_data,
-                            index=rows if rows else None,
-                            columns=cols if cols else None,
-                            values=values,
-                            aggfunc=agg_func,
-                            fill_value=0,
-                            margins=False  # BỎ TỔNG CHUNG
-                        )
+                        if pivot is not None:
+                            # Kèm dòng tổng từng danh mục và tổng cộng
+                            simple_pivot = pivot.to_report_frame()
+                        else:
+                            simple_pivot = dashboard.aggregate(filtered_data, rows, cols, values, agg_func)
                         simple_pivot.to_excel(writer, sheet_name='Pivot Table')
                         
                         # Sheet 3: Tổng hợp theo danh mục (theo thứ tự ưu tiên)
-                        category_summary = filtered_data.groupby('Danh mục')['Số liệu'].agg(['sum', 'mean', 'count'])
-                        category_summary['Thứ_tự'] = category_summary.index.map(dashboard.category_priority).fillna(999)
-                        category_summary = category_summary.sort_values('Thứ_tự').drop(columns=['Thứ_tự'])
+                        category_summary = pd.DataFrame({
+                            agg: dashboard.aggregate(filtered_data, ['Danh mục'], [], agg_func=agg)
+                            for agg in ('sum', 'mean', 'count')
+                        })
                         category_summary.to_excel(writer, sheet_name='Theo danh mục')
                         
                         # Sheet 4: Tổng hợp theo thời gian
-                        time_summary = filtered_data.pivot_table(
-                            index=time_col,
-                            columns='Danh mục',
-                            values='Số liệu',
-                            aggfunc='sum',
-                            fill_value=0
-                        )
+                        time_summary = dashboard.aggregate(filtered_data, [time_col], ['Danh mục'])
                         time_summary.to_excel(writer, sheet_name='Theo thời gian')
                         
                         # Sheet 5: Tổng hợp theo nội dung (theo thứ tự ưu tiên)
-                        content_summary = filtered_data.pivot_table(
-                            index=['Danh mục', 'Nội dung'],
-                            values='Số liệu',
-                            aggfunc=['sum', 'mean', 'count'],
-                            fill_value=0
-                        )
+                        content_summary = pd.concat({
+                            agg: dashboard.aggregate(filtered_data, ['Danh mục', 'Nội dung'], [], agg_func=agg).to_frame('Số liệu')
+                            for agg in ('sum', 'mean', 'count')
+                        }, axis=1).fillna(0)
                         content_summary.to_excel(writer, sheet_name='Theo nội dung')
                         
                         # Sheet 6: Tỷ lệ thay đổi
@@ -2126,7 +4787,8 @@ def main():
                                 columns='Tuần',
                                 values=['Tỷ_lệ_tuần_trước', 'Thay_đổi_tuần_trước'],
                                 aggfunc='mean',
-                                fill_value=None
+                                fill_value=None,
+                                observed=True
                             )
                             ratio_summary.to_excel(writer, sheet_name='Tỷ lệ thay đổi')
                         
@@ -2155,7 +4817,7 @@ def main():
                     # Tạo file Excel đơn giản
                     output_file = f'bao_cao_don_gian_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
                     with pd.ExcelWriter(output_file) as writer:
-                        filtered_data_export = filtered_data.drop(columns=['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'], errors='ignore')
+                        filtered_data_export = filtered_data
                         filtered_data_export.to_excel(writer, index=False)
                     
                     with open(output_file, 'rb') as f:
@@ -2169,7 +4831,7 @@ def main():
                     st.success("✅ Đã tạo báo cáo đơn giản thành công!")
                 
                 else:  # CSV
-                    filtered_data_export = filtered_data.drop(columns=['Danh_mục_thứ_tự', 'Nội_dung_thứ_tự'], errors='ignore')
+                    filtered_data_export = filtered_data
                     csv = filtered_data_export.to_csv(index=False, encoding='utf-8-sig')
                     st.download_button(
                         "📥 Tải CSV",
@@ -2273,14 +4935,53 @@ def main():
                    - Sync với Weekly Upload system
                 """)
 
+def display_upload_job_status(poll_seconds=1.0):
+    """Hiển thị tiến trình job upload nền của session hiện tại
+    
+    Tiến trình vẽ trong 1 fragment tự chạy lại mỗi poll_seconds: mỗi lần chỉ đọc trạng thái job 1 lần,
+    không chặn lần chạy script -> người dùng vẫn thao tác được trong lúc upload.
+    """
+    
+    # Kết quả job vừa xong (lưu lại qua lần rerun để tải dữ liệu mới)
+    finished_job = st.session_state.pop('upload_job_result', None)
+    if finished_job:
+        if finished_job['status'] == 'done':
+            st.balloons()
+            if finished_job['summary']:
+                st.success(WeeklyUploadManager.format_upload_summary(finished_job['summary']))
+            else:
+                st.info(finished_job['message'])
+        else:
+            st.error(finished_job['message'])
+            st.info("💡 Vui lòng thử lại hoặc kiểm tra kết nối mạng")
+    
+    if not st.session_state.get('upload_job_id'):
+        return
+    
+    st.fragment(_upload_job_progress, run_every=poll_seconds)()
+
+
+def _upload_job_progress():
+    """1 lần kiểm tra trạng thái job (thân fragment); job kết thúc -> rerun cả app để hiện kết quả"""
+    job_id = st.session_state.get('upload_job_id')
+    if not job_id:
+        return
+    
+    job = get_upload_jobs().get(job_id)
+    if job and job['status'] in ('queued', 'running'):
+        st.progress(job['progress'], text=f"{job['message']} • job {job_id}")
+        return
+    
+    st.session_state['upload_job_id'] = None
+    if job is not None:
+        st.session_state['upload_job_result'] = job
+    st.rerun()
+
 def weekly_dashboard_main():
     """Main function cho weekly upload dashboard - Robust version"""
     
-    # Initialize manager
-    if 'weekly_manager' not in st.session_state:
-        st.session_state.weekly_manager = WeeklyUploadManager()
-    
-    manager = st.session_state.weekly_manager
+    # Manager dùng chung cho cả process
+    manager = get_weekly_manager()
     
     # Header
     st.markdown("""
@@ -2324,7 +5025,7 @@ def weekly_dashboard_main():
                     else:
                         # Sử dụng hàm load_data_from_dataframe
                         if hasattr(dashboard, 'load_data_from_dataframe'):
-                            if dashboard.load_data_from_dataframe(current_data):
+                            if dashboard.load_stored_data(current_data, manager.is_enriched, key=manager.current_sha):
                                 st.markdown("### 📊 Dashboard Báo Cáo Hành Chính")
                                 
                                 # Basic pivot table
@@ -2355,7 +5056,11 @@ def weekly_dashboard_main():
         except Exception as data_error:
             st.error(f"❌ Lỗi tải dữ liệu hiện tại: {str(data_error)}")
             st.info("💡 Bạn vẫn có thể upload file mới bên dưới")
-        
+
+        with st.expander(f"🔌 Thống kê kết nối {manager.backend.name}"):
+            for stat_name, stat_value in manager.get_client_stats().items():
+                st.write(f"- {stat_name}: {stat_value}")
+
         # Upload section - LUÔN HIỂN THỊ
         st.markdown("---")
         st.markdown("### 📤 Upload File Excel")
@@ -2364,8 +5069,8 @@ def weekly_dashboard_main():
         
         if uploaded_file is not None:
             try:
-                # Đọc file
-                data = pd.read_excel(uploaded_file)
+                # Đọc file (streaming, chỉ các cột cần dùng) - rerun / upload dùng lại kết quả đã parse
+                data = get_excel_reader().read(uploaded_file)
                 st.success(f"✅ Đọc thành công {len(data):,} dòng dữ liệu")
                 
                 # Hiển thị cấu trúc dữ liệu
@@ -2384,27 +5089,28 @@ def weekly_dashboard_main():
                 else:
                     st.success("✅ Dữ liệu hợp lệ, có thể upload!")
                     
+                    # Upsert: chỉ gộp tuần mới vào lịch sử; Replace: thay toàn bộ dữ liệu
+                    upload_mode = st.radio(
+                        "Chế độ upload",
+                        ["upsert", "replace"],
+                        format_func=lambda x: {
+                            'upsert': '➕ Cập nhật tuần mới (giữ lịch sử)',
+                            'replace': '♻️ Thay thế toàn bộ dữ liệu'
+                        }.get(x, x),
+                        horizontal=True,
+                        key="weekly_upload_mode"
+                    )
+                    
                     # Nút upload
                     col1, col2 = st.columns([1, 1])
                     
                     with col1:
                         if st.button("🚀 UPLOAD VÀ LƯU", type="primary", use_container_width=True):
-                            try:
-                                with st.spinner("Đang upload..."):
-                                    success = manager.upload_new_file(data, uploaded_file.name)
-                                    
-                                if success:
-                                    st.balloons()
-                                    st.success("🎉 Upload thành công!")
-                                    # Đợi một chút trước khi rerun
-                                    time.sleep(1)
-                                    st.rerun()
-                                else:
-                                    st.error("❌ Upload thất bại!")
-                                    
-                            except Exception as upload_error:
-                                st.error(f"❌ Lỗi upload: {str(upload_error)}")
-                                st.info("💡 Vui lòng thử lại hoặc kiểm tra kết nối mạng")
+                            # Chạy nền: đóng tab / rerun không làm dừng upload, bấm trùng -> cùng 1 job
+                            st.session_state['upload_job_id'] = get_upload_jobs().submit(
+                                manager, data, uploaded_file.name, mode=upload_mode,
+                                on_success=get_dataset_cache().invalidate
+                            )
                     
                     with col2:
                         if st.button("🔄 Reset Form", use_container_width=True):
@@ -2431,6 +5137,9 @@ def weekly_dashboard_main():
                     1    | 1     | Văn bản đến     | Xử lý đúng hạn             | 140
                     ```
                     """)
+        
+        # Tiến trình upload nền của session (fragment tự cập nhật, không chặn script)
+        display_upload_job_status()
     
     else:
         st.error(status_msg)
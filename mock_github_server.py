@@ -0,0 +1,368 @@
+"""
+Mock GitHub API server chạy trong process (không cần mạng)
+
+Mô phỏng các endpoint mà dashboard dùng:
+- Contents API: GET/PUT/DELETE /repos/{owner}/{repo}/contents/{path}
+- Git Data API: branches, git/trees, git/blobs, git/commits, git/refs
+- ETag / If-None-Match (304) cho GET
+
+Cấu hình được độ trễ mỗi request và giới hạn kích thước để đo và kiểm thử
+pipeline upload/backup/cleanup ngay trên máy local.
+
+Chạy độc lập:
+    python mock_github_server.py --port 8765 --latency 0.05
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockGitHubRepo:
+    """Repo git tối giản trong bộ nhớ: chỉ file ở thư mục gốc"""
+
+    def __init__(self, branch="main"):
+        self.branch = branch
+        self.blobs = {}      # sha -> bytes
+        self.trees = {}      # sha -> {path: blob sha}
+        self.commits = {}    # sha -> {'tree', 'parents', 'message'}
+        self.refs = {}       # branch -> commit sha
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _hash(kind, payload):
+        return hashlib.sha1(kind.encode() + b"\0" + payload).hexdigest()
+
+    def put_blob(self, content):
+        sha = self._hash("blob", content)
+        self.blobs[sha] = content
+        return sha
+
+    def put_tree(self, files):
+        payload = json.dumps(sorted(files.items())).encode()
+        sha = self._hash("tree", payload)
+        self.trees[sha] = dict(files)
+        return sha
+
+    def put_commit(self, tree_sha, parents, message):
+        payload = json.dumps([tree_sha, parents, message, time.time()]).encode()
+        sha = self._hash("commit", payload)
+        self.commits[sha] = {'tree': tree_sha, 'parents': list(parents), 'message': message}
+        return sha
+
+    def head(self):
+        commit_sha = self.refs.get(self.branch)
+        if commit_sha is None:
+            return None, None
+        return commit_sha, self.commits[commit_sha]['tree']
+
+    def files(self):
+        """{path: blob sha} ở commit hiện tại"""
+        _, tree_sha = self.head()
+        return dict(self.trees[tree_sha]) if tree_sha else {}
+
+    def commit_files(self, files, message):
+        """Tạo commit mới với bộ file cho trước và cập nhật branch"""
+        commit_sha, _ = self.head()
+        tree_sha = self.put_tree(files)
+        new_commit = self.put_commit(tree_sha, [commit_sha] if commit_sha else [], message)
+        self.refs[self.branch] = new_commit
+        return new_commit
+
+
+class MockGitHubServer:
+    """
+    HTTP server giả lập GitHub API trong thread nền
+
+    - latency: số giây trễ thêm cho mỗi request
+    - max_file_size: kích thước blob tối đa (bytes), vượt -> 422 như GitHub
+    - inline_content_limit: contents API chỉ trả nội dung cho file nhỏ hơn mức này
+    """
+
+    def __init__(self, owner="owner", repo="repo", latency=0.0, max_file_size=100 * 1024 * 1024,
+                 inline_content_limit=1024 * 1024, host="127.0.0.1", port=0):
+        self.owner = owner
+        self.repo_name = repo
+        self.latency = latency
+        self.max_file_size = max_file_size
+        self.inline_content_limit = inline_content_limit
+        self.repo = MockGitHubRepo()
+        self.request_log = []
+
+        handler = self._make_handler()
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def request_count(self, method=None):
+        if method is None:
+            return len(self.request_log)
+        return sum(1 for m, _ in self.request_log if m == method)
+
+    def reset_stats(self):
+        self.request_log.clear()
+
+    def _make_handler(self):
+        server = self
+        prefix = re.compile(r"^/repos/(?P<owner>[^/]+)/(?P<repo>[^/?]+)(?P<rest>/[^?]*)?")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, etag=None, raw=None):
+                if raw is not None:
+                    data = raw
+                    content_type = "application/octet-stream"
+                else:
+                    data = json.dumps(body).encode() if body is not None else b""
+                    content_type = "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_json_cached(self, body):
+                etag = '"' + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, etag=etag)
+                else:
+                    self._send(200, body, etag=etag)
+
+            def _read_json(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _route(self, method):
+                server.request_log.append((method, self.path))
+                if server.latency:
+                    time.sleep(server.latency)
+
+                match = prefix.match(self.path)
+                if not match or match['owner'] != server.owner or match['repo'] != server.repo_name:
+                    return self._send(404, {"message": "Not Found"})
+
+                rest = (match['rest'] or "").rstrip("/")
+                with server.repo.lock:
+                    return self._dispatch(method, rest)
+
+            def _dispatch(self, method, rest):
+                repo = server.repo
+
+                if rest == "" and method == "GET":
+                    return self._send_json_cached({"full_name": f"{server.owner}/{server.repo_name}", "private": True})
+
+                if rest == "/contents" and method == "GET":
+                    files = repo.files()
+                    listing = [self._file_info(path, sha) for path, sha in sorted(files.items())]
+                    return self._send_json_cached(listing)
+
+                if rest.startswith("/contents/"):
+                    return self._contents(method, rest[len("/contents/"):])
+
+                if rest.startswith("/branches/") and method == "GET":
+                    commit_sha, tree_sha = repo.head()
+                    if commit_sha is None or rest[len("/branches/"):] != repo.branch:
+                        return self._send(404, {"message": "Branch not found"})
+                    return self._send_json_cached({
+                        "name": repo.branch,
+                        "commit": {"sha": commit_sha, "commit": {"tree": {"sha": tree_sha}}}
+                    })
+
+                if rest.startswith("/git/trees"):
+                    return self._trees(method, rest[len("/git/trees"):].lstrip("/"))
+
+                if rest.startswith("/git/blobs"):
+                    return self._blobs(method, rest[len("/git/blobs"):].lstrip("/"))
+
+                if rest == "/git/commits" and method == "POST":
+                    body = self._read_json()
+                    if body.get("tree") not in repo.trees:
+                        return self._send(422, {"message": "Tree not found"})
+                    sha = repo.put_commit(body["tree"], body.get("parents", []), body.get("message", ""))
+                    return self._send(201, {"sha": sha})
+
+                if rest.startswith("/git/refs/heads/") and method == "PATCH":
+                    body = self._read_json()
+                    new_sha = body.get("sha")
+                    if new_sha not in repo.commits:
+                        return self._send(422, {"message": "Object does not exist"})
+                    current = repo.refs.get(rest[len("/git/refs/heads/"):])
+                    if not body.get("force") and current and current not in repo.commits[new_sha]['parents']:
+                        return self._send(422, {"message": "Update is not a fast forward"})
+                    repo.refs[rest[len("/git/refs/heads/"):]] = new_sha
+                    return self._send(200, {"object": {"sha": new_sha}})
+
+                return self._send(404, {"message": "Not Found"})
+
+            def _file_info(self, path, sha):
+                return {
+                    "name": path.rsplit("/", 1)[-1], "path": path, "sha": sha,
+                    "size": len(server.repo.blobs[sha]), "type": "file"
+                }
+
+            def _contents(self, method, path):
+                repo = server.repo
+                files = repo.files()
+
+                if method == "GET":
+                    if path not in files:
+                        return self._send(404, {"message": "Not Found"})
+                    sha = files[path]
+                    info = self._file_info(path, sha)
+                    content = repo.blobs[sha]
+                    if len(content) <= server.inline_content_limit:
+                        info.update({"encoding": "base64", "content": base64.encodebytes(content).decode()})
+                    else:
+                        info.update({"encoding": "none", "content": ""})
+                    etag = f'"{sha}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self._send(304, etag=etag)
+                    return self._send(200, info, etag=etag)
+
+                body = self._read_json()
+                if path in files and body.get("sha") != files[path]:
+                    return self._send(409 if method == "PUT" and "sha" in body else 422,
+                                      {"message": "sha mismatch"})
+
+                if method == "PUT":
+                    content = base64.b64decode(body.get("content", ""))
+                    if len(content) > server.max_file_size:
+                        return self._send(422, {"message": "File too large"})
+                    files[path] = repo.put_blob(content)
+                    commit = repo.commit_files(files, body.get("message", ""))
+                    return self._send(201 if body.get("sha") is None else 200,
+                                      {"content": self._file_info(path, files[path]), "commit": {"sha": commit}})
+
+                if method == "DELETE":
+                    if path not in files:
+                        return self._send(404, {"message": "Not Found"})
+                    del files[path]
+                    commit = repo.commit_files(files, body.get("message", ""))
+                    return self._send(200, {"commit": {"sha": commit}})
+
+                return self._send(405, {"message": "Method not allowed"})
+
+            def _trees(self, method, tree_ref):
+                repo = server.repo
+
+                if method == "GET":
+                    tree_sha = tree_ref
+                    if tree_ref == repo.branch:
+                        _, tree_sha = repo.head()
+                    if tree_sha not in repo.trees:
+                        return self._send(404, {"message": "Not Found"})
+                    entries = [
+                        {"path": path, "mode": "100644", "type": "blob", "sha": sha, "size": len(repo.blobs[sha])}
+                        for path, sha in sorted(repo.trees[tree_sha].items())
+                    ]
+                    return self._send_json_cached({"sha": tree_sha, "tree": entries, "truncated": False})
+
+                if method == "POST":
+                    body = self._read_json()
+                    files = dict(repo.trees.get(body.get("base_tree"), {}))
+                    for entry in body.get("tree", []):
+                        if "content" in entry:
+                            files[entry["path"]] = repo.put_blob(entry["content"].encode())
+                        elif entry.get("sha") is None:
+                            files.pop(entry["path"], None)
+                        elif entry["sha"] in repo.blobs:
+                            files[entry["path"]] = entry["sha"]
+                        else:
+                            return self._send(422, {"message": f"Blob {entry['sha']} not found"})
+                    return self._send(201, {"sha": repo.put_tree(files)})
+
+                return self._send(405, {"message": "Method not allowed"})
+
+            def _blobs(self, method, sha):
+                repo = server.repo
+
+                if method == "POST":
+                    body = self._read_json()
+                    if body.get("encoding") == "base64":
+                        content = base64.b64decode(body.get("content", ""))
+                    else:
+                        content = body.get("content", "").encode()
+                    if len(content) > server.max_file_size:
+                        return self._send(422, {"message": "File too large"})
+                    if repo.head()[0] is None:
+                        return self._send(409, {"message": "Git Repository is empty."})
+                    return self._send(201, {"sha": repo.put_blob(content)})
+
+                if method == "GET":
+                    if sha not in repo.blobs:
+                        return self._send(404, {"message": "Not Found"})
+                    if "raw" in (self.headers.get("Accept") or ""):
+                        return self._send(200, raw=repo.blobs[sha])
+                    return self._send(200, {
+                        "sha": sha, "size": len(repo.blobs[sha]), "encoding": "base64",
+                        "content": base64.encodebytes(repo.blobs[sha]).decode()
+                    })
+
+                return self._send(405, {"message": "Method not allowed"})
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_PUT(self):
+                self._route("PUT")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_PATCH(self):
+                self._route("PATCH")
+
+            def do_DELETE(self):
+                self._route("DELETE")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock GitHub API server cho dashboard")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ mỗi request (giây)")
+    parser.add_argument("--max-file-size-mb", type=float, default=100)
+    parser.add_argument("--owner", default="owner")
+    parser.add_argument("--repo", default="repo")
+    args = parser.parse_args()
+
+    mock = MockGitHubServer(
+        owner=args.owner, repo=args.repo, latency=args.latency,
+        max_file_size=int(args.max_file_size_mb * 1024 * 1024), port=args.port
+    )
+    print(f"Mock GitHub API: {mock.api_url} (repo {args.owner}/{args.repo})")
+    print("Cấu hình secrets: github_api_url, github_owner, github_repo, github_token (bất kỳ)")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass